@@ -0,0 +1,313 @@
+"""
+End-to-end crawl benchmark against a synthetic documentation site served locally.
+
+The site runs in its own process, so the crawler's CPU time and peak RSS
+are measured without the server's. Nothing touches the network.
+
+Usage:
+    python benchmarks/bench_crawl.py [--pages 500] [--flavor sphinx|mkdocs] [--fan-out 8]
+        [--shared-assets 12] [--latency-ms 5] [--error-rate 0.02] [--concurrency 16]
+        [--parse-workers N] [--repeat 1] [--output results.jsonl]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+from aiohttp import web
+from mcp_windows_website_downloader.downloader import WebsiteDownloader
+from mcp_windows_website_downloader.parser import ParsePool
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+VOCABULARY = [f"term{n}" for n in range(2000)]
+STATS_PATH = "/_bench/stats"
+
+
+class DocsSite:
+    """
+    Deterministic Sphinx- or MkDocs-shaped site
+
+    Page i links to its fan_out children in a tree (so every page is
+    reachable) plus fan_out pseudo-random related pages, and references
+    assets_per_page files out of a pool of shared_assets stylesheets,
+    scripts and images. Stylesheets pull in a shared font through url().
+    """
+
+    def __init__(self, pages: int = 500, flavor: str = "sphinx", fan_out: int = 8,
+                 shared_assets: int = 12, assets_per_page: int = 4, asset_bytes: int = 20_000,
+                 words_per_page: int = 400, latency_ms: float = 0.0, error_rate: float = 0.0,
+                 sitemap: bool = True, seed: int = 0):
+        self.pages = pages
+        self.flavor = flavor
+        self.fan_out = fan_out
+        self.shared_assets = max(1, shared_assets)
+        self.assets_per_page = assets_per_page
+        self.asset_bytes = asset_bytes
+        self.words_per_page = words_per_page
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.sitemap = sitemap
+        self.seed = seed
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self._attempts: Dict[str, int] = {}
+
+    def page_url(self, i: int) -> str:
+        if self.flavor == "mkdocs":
+            return "/" if i == 0 else f"/section{i % 10}/page{i}/"
+        return "/en/stable/index.html" if i == 0 else f"/en/stable/section{i % 10}/page{i}.html"
+
+    def start_url(self) -> str:
+        return self.page_url(0)
+
+    def asset_urls(self, i: int):
+        prefix = "/assets" if self.flavor == "mkdocs" else "/en/stable/_static"
+        urls = []
+        for m in range(self.assets_per_page):
+            k = (i + m) % self.shared_assets
+            kind = ("css", "js", "png")[k % 3]
+            urls.append(f"{prefix}/{kind}/asset{k}.{kind}")
+        return urls
+
+    def render_page(self, i: int) -> str:
+        rng = random.Random(self.seed * 1_000_003 + i)
+        children = [c for c in range(i * self.fan_out + 1, i * self.fan_out + self.fan_out + 1) if c < self.pages]
+        related = [rng.randrange(self.pages) for _ in range(self.fan_out)]
+        links = "".join(f'<li><a href="{self.page_url(n)}">Page {n}</a></li>' for n in children + related)
+        head = "".join(
+            f'<link rel="stylesheet" href="{url}">' if url.endswith(".css")
+            else f'<script src="{url}"></script>' if url.endswith(".js")
+            else ""
+            for url in self.asset_urls(i)
+        )
+        images = "".join(f'<img src="{url}" alt="">' for url in self.asset_urls(i) if url.endswith(".png"))
+        paragraphs = "".join(
+            "<p>" + " ".join(rng.choice(VOCABULARY) for _ in range(50)) + "</p>"
+            for _ in range(max(1, self.words_per_page // 50))
+        )
+        body = f"<h1>Page {i}</h1>{paragraphs}{images}"
+        if self.flavor == "mkdocs":
+            layout = (f'<nav class="md-nav"><ul>{links}</ul></nav>'
+                      f'<div class="md-content"><article>{body}</article></div>')
+        else:
+            layout = (f'<div class="sphinxsidebar"><ul>{links}</ul></div>'
+                      f'<div class="document"><div class="body" role="main">{body}</div></div>')
+        return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Page {i}</title>{head}</head>'
+                f'<body>{layout}</body></html>')
+
+    def render_asset(self, path: str) -> Optional[tuple]:
+        name = path.rsplit("/", 1)[-1]
+        if name == "font.woff2":
+            return b"wOF2" + b"\0" * self.asset_bytes, "font/woff2"
+        if not name.startswith("asset"):
+            return None
+        kind = name.rsplit(".", 1)[-1]
+        if kind == "css":
+            rules = "".join(f".{kind}{n} {{ color: black; }}\n" for n in range(self.asset_bytes // 24))
+            return f'@font-face {{ src: url("../font.woff2") }}\n/* {name} */\n{rules}'.encode(), "text/css"
+        if kind == "js":
+            return (f"// {name}\n" + "var x = 1;\n" * (self.asset_bytes // 11)).encode(), "application/javascript"
+        return b"\x89PNG" + name.encode() + b"\0" * self.asset_bytes, "image/png"
+
+    def render_sitemap(self) -> str:
+        urls = "".join(f"<url><loc>{{origin}}{self.page_url(i)}</loc></url>" for i in range(self.pages))
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>')
+
+    def app(self) -> web.Application:
+        pages = {self.page_url(i): i for i in range(self.pages)}
+        sitemap = self.render_sitemap()
+
+        async def handler(request):
+            if request.path == STATS_PATH:
+                return web.json_response({"requests": self.requests, "errors": self.errors,
+                                          "bytes_sent": self.bytes_sent})
+            self.requests += 1
+            if self.latency:
+                jitter = int(hashlib.sha256(request.path_qs.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+                await asyncio.sleep(self.latency * (0.5 + jitter))
+            if self._fails(request.path):
+                self.errors += 1
+                return web.Response(status=503)
+            if request.path == "/sitemap.xml" and self.sitemap:
+                body = sitemap.replace("{origin}", str(request.url.origin())).encode()
+                content_type = "application/xml"
+            elif request.path in pages:
+                body = self.render_page(pages[request.path]).encode()
+                content_type = "text/html"
+            else:
+                asset = self.render_asset(request.path)
+                if asset is None:
+                    return web.Response(status=404)
+                body, content_type = asset
+            self.bytes_sent += len(body)
+            return web.Response(body=body, content_type=content_type)
+
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", handler)
+        return app
+
+    def _fails(self, path: str) -> bool:
+        """First request for a path fails with 503 for error_rate of paths; retries succeed"""
+        if not self.error_rate:
+            return False
+        attempt = self._attempts.get(path, 0)
+        self._attempts[path] = attempt + 1
+        draw = int(hashlib.sha256(f"{self.seed}:{path}".encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+        return attempt == 0 and draw < self.error_rate
+
+
+def _serve(site_options: Dict[str, Any], port: int):
+    """Server process entry point"""
+    web.run_app(DocsSite(**site_options).app(), host="127.0.0.1", port=port, print=None,
+                handle_signals=True, access_log=None)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_for(url: str, timeout: float = 15.0):
+    import aiohttp
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(url) as response:
+                    return await response.json()
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+
+
+def _peak_rss(who) -> Optional[int]:
+    """Peak resident set size in bytes (ru_maxrss is KiB on Linux, bytes on macOS)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+async def run_once(origin: str, start_url: str, concurrency: int, parse_workers: Optional[int],
+                   max_pages: Optional[int], shards: int = 1) -> Dict[str, Any]:
+    """Crawl the served site into a throwaway library and measure it"""
+    before = await _wait_for(origin + STATS_PATH)
+    cpu_before = os.times()
+    with tempfile.TemporaryDirectory() as library:
+        downloader = WebsiteDownloader(Path(library), parse_pool=ParsePool(parse_workers))
+        start = time.perf_counter()
+        try:
+            result = await downloader.download(origin + start_url, concurrency=concurrency, max_pages=max_pages,
+                                               shards=shards)
+        finally:
+            wall = time.perf_counter() - start
+            # Also stops the parse workers, so their CPU time is accounted below
+            await downloader.close()
+    cpu_after = os.times()
+    after = await _wait_for(origin + STATS_PATH)
+    if result.get("status") != "success":
+        raise RuntimeError(f"Crawl failed: {result.get('error')}")
+
+    pages = result["pages"]
+    requests = after["requests"] - before["requests"]
+    return {
+        "pages": pages,
+        "wall_seconds": round(wall, 3),
+        "pages_per_second": round(pages / wall, 2) if wall > 0 else None,
+        "requests": requests,
+        "requests_per_page": round(requests / pages, 3) if pages else None,
+        "server_errors": after["errors"] - before["errors"],
+        "bytes_received": after["bytes_sent"] - before["bytes_sent"],
+        "cpu_seconds": {
+            "crawler": round((cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system), 3),
+            # Parse workers and crawl shards are reaped when they exit, so their time shows up as children's
+            "parse_workers": round((cpu_after.children_user - cpu_before.children_user)
+                                   + (cpu_after.children_system - cpu_before.children_system), 3),
+        },
+        # Process-lifetime peaks, so with --repeat they cover every run so far
+        "peak_rss_bytes": {
+            "crawler": _peak_rss(resource.RUSAGE_SELF) if resource else None,
+            "parse_workers": _peak_rss(resource.RUSAGE_CHILDREN) if resource else None,
+        },
+        "retries": result["requests"].get("retries"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end crawl benchmark")
+    parser.add_argument("--pages", type=int, default=500, help="Pages on the synthetic site")
+    parser.add_argument("--flavor", choices=["sphinx", "mkdocs"], default="sphinx", help="Site layout")
+    parser.add_argument("--fan-out", type=int, default=8, help="Child and related links per page")
+    parser.add_argument("--shared-assets", type=int, default=12, help="Asset pool shared by all pages")
+    parser.add_argument("--assets-per-page", type=int, default=4, help="Assets each page references")
+    parser.add_argument("--asset-bytes", type=int, default=20_000, help="Approximate size of each asset")
+    parser.add_argument("--words", type=int, default=400, help="Words of body text per page")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean injected response latency")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of URLs whose first request fails with 503")
+    parser.add_argument("--no-sitemap", action="store_true", help="Don't serve /sitemap.xml")
+    parser.add_argument("--concurrency", type=int, default=16, help="Crawl concurrency")
+    parser.add_argument("--parse-workers", type=int, default=None, help="Parse pool size (0 parses inline)")
+    parser.add_argument("--max-pages", type=int, default=None, help="Stop the crawl after this many pages")
+    parser.add_argument("--shards", type=int, default=1, help="Worker processes the crawl is split across")
+    parser.add_argument("--repeat", type=int, default=1, help="Crawls to run; each starts from an empty library")
+    parser.add_argument("--seed", type=int, default=0, help="Site generator seed")
+    parser.add_argument("--output", type=Path, default=None, help="Also append the result as a JSON line here")
+    args = parser.parse_args()
+
+    site_options = {
+        "pages": args.pages, "flavor": args.flavor, "fan_out": args.fan_out,
+        "shared_assets": args.shared_assets, "assets_per_page": args.assets_per_page,
+        "asset_bytes": args.asset_bytes, "words_per_page": args.words, "latency_ms": args.latency_ms,
+        "error_rate": args.error_rate, "sitemap": not args.no_sitemap, "seed": args.seed,
+    }
+    port = _free_port()
+    server = multiprocessing.Process(target=_serve, args=(site_options, port), daemon=True)
+    server.start()
+    origin = f"http://127.0.0.1:{port}"
+    try:
+        runs = [
+            asyncio.run(run_once(origin, DocsSite(**site_options).start_url(), args.concurrency,
+                                 args.parse_workers, args.max_pages, args.shards))
+            for _ in range(args.repeat)
+        ]
+    finally:
+        server.terminate()
+        server.join()
+
+    report = {
+        "benchmark": "crawl",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "site": site_options,
+        "crawl": {"concurrency": args.concurrency, "parse_workers": args.parse_workers,
+                  "max_pages": args.max_pages, "shards": args.shards},
+        "runs": runs,
+        "best_pages_per_second": max(run["pages_per_second"] or 0 for run in runs),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Single-file site archives: an append-only WARC plus a CDXJ offset index.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+from .storage import CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FILENAME = "site.warc"
+ARCHIVE_INDEX_FILENAME = "site.cdxj"
+OUTPUT_MODES = ("files", "warc")
+WARC_VERSION = b"WARC/1.1"
+# Site-relative path the record would have in "files" mode, so archived pages can link to it
+PATH_HEADER = "X-Site-Path"
+
+
+def surt(url: str) -> str:
+    """Sort-friendly URL key as used in CDX indexes: com,example,docs)/path?query"""
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if host.startswith("www."):
+        host = host[4:]
+    key = ",".join(reversed(host.split("."))) + ")" + (parts.path or "/")
+    if parts.query:
+        key += "?" + parts.query
+    return key.lower()
+
+
+class SiteArchive:
+    """
+    Append-only WARC writer for one site
+
+    Pages and assets are written as WARC "resource" records to site.warc
+    as the crawl produces them; nothing is ever rewritten in place. Each
+    record's offset and length go into site.cdxj, which is rewritten
+    (sorted, atomically) at the end of the crawl. A re-crawl appends only
+    what changed, and the index points every URL at its newest record.
+    Records appended after the last index save (an interrupted crawl)
+    are recovered by scanning the tail of the WARC on open. All methods
+    block, so the crawl runs them on the writer pool.
+    """
+
+    def __init__(self, site_dir: Path):
+        self.path = site_dir / ARCHIVE_FILENAME
+        self.index_path = site_dir / ARCHIVE_INDEX_FILENAME
+        self.index: Dict[str, Dict[str, Any]] = {}
+        self._handle = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Load the index, recover unindexed records and get ready to append"""
+        self.index = load_index(self.index_path)
+        end = max((entry["offset"] + entry["length"] for entry in self.index.values()), default=0)
+        self._handle = open(self.path, "ab+")
+        size = os.fstat(self._handle.fileno()).st_size
+        if end > size:
+            logger.warning(f"Index {self.index_path} is ahead of {self.path}; rebuilding it")
+            self.index, end = {}, 0
+        valid_end = self._recover(end, size)
+        if valid_end < size:
+            logger.warning(f"Truncating incomplete record at {valid_end} in {self.path}")
+            self._handle.truncate(valid_end)
+        if valid_end == 0:
+            self._write_record("warcinfo", None, "application/warc-fields",
+                               b"software: mcp-windows-website-downloader\r\nformat: WARC File Format 1.1\r\n")
+
+    def _recover(self, offset: int, size: int) -> int:
+        """Index complete records from offset on; returns where the last complete one ends"""
+        while offset < size:
+            self._handle.seek(offset)
+            record = _read_record_header(self._handle)
+            if record is None:
+                break
+            headers, header_length = record
+            length = header_length + int(headers["content-length"]) + 4
+            if offset + length > size:
+                break
+            if headers.get("warc-type") == "resource" and "warc-target-uri" in headers:
+                self._index_record(offset, length, headers)
+            offset += length
+        return offset
+
+    def has(self, url: str) -> bool:
+        return url in self.index
+
+    def read(self, url: str) -> bytes:
+        """Body of the newest record for a URL"""
+        entry = self.index[url]
+        with open(self.path, "rb") as f:
+            f.seek(entry["offset"])
+            record = _read_record_header(f)
+            if record is None:
+                raise ValueError(f"No WARC record at offset {entry['offset']} of {self.path}")
+            return f.read(int(record[0]["content-length"]))
+
+    def add_bytes(self, url: str, path: str, content_type: Optional[str], data: bytes):
+        """Append a page or asset held in memory"""
+        self._write_record("resource", url, content_type, data, path)
+
+    def add_file(self, url: str, path: str, content_type: Optional[str], src: Path):
+        """Append an asset streamed to a temp file, then remove the temp file"""
+        try:
+            self._write_record("resource", url, content_type, src, path)
+        finally:
+            src.unlink(missing_ok=True)
+
+    def _write_record(self, kind: str, url: Optional[str], content_type: Optional[str],
+                      block, path: Optional[str] = None):
+        if isinstance(block, Path):
+            size = block.stat().st_size
+            hasher = hashlib.sha256()
+            with open(block, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+        else:
+            size = len(block)
+            hasher = hashlib.sha256(block)
+        headers = {
+            "WARC-Type": kind,
+            "WARC-Record-ID": f"<urn:uuid:{uuid.uuid4()}>",
+            "WARC-Date": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        if url:
+            headers["WARC-Target-URI"] = url
+            headers["WARC-Payload-Digest"] = f"sha256:{hasher.hexdigest()}"
+        if path:
+            headers[PATH_HEADER] = path
+        headers["Content-Type"] = content_type or "application/octet-stream"
+        headers["Content-Length"] = str(size)
+        head = WARC_VERSION + b"\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()
+        ).encode("utf-8") + b"\r\n"
+
+        with self._lock:
+            offset = self._handle.seek(0, os.SEEK_END)
+            self._handle.write(head)
+            if isinstance(block, Path):
+                with open(block, "rb") as f:
+                    shutil.copyfileobj(f, self._handle, CHUNK_SIZE)
+            else:
+                self._handle.write(block)
+            self._handle.write(b"\r\n\r\n")
+            self._handle.flush()
+            if kind == "resource":
+                lowered = {name.lower(): value for name, value in headers.items()}
+                self._index_record(offset, len(head) + size + 4, lowered)
+
+    def _index_record(self, offset: int, length: int, headers: Dict[str, str]):
+        url = headers["warc-target-uri"]
+        self.index[url] = {
+            "url": url,
+            "timestamp": headers["warc-date"],
+            "mime": headers.get("content-type"),
+            "digest": headers.get("warc-payload-digest"),
+            "path": headers.get(PATH_HEADER.lower()),
+            "offset": offset,
+            "length": length,
+            "filename": ARCHIVE_FILENAME
+        }
+
+    def save_index(self):
+        """Atomically rewrite the CDXJ index, sorted by URL key"""
+        lines = []
+        for url, entry in self.index.items():
+            timestamp = "".join(c for c in entry["timestamp"] if c.isdigit())
+            lines.append(f"{surt(url)} {timestamp} {json.dumps(entry, separators=(',', ':'))}\n")
+        lines.sort()
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        with self._lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+
+def _read_record_header(handle) -> Optional[Tuple[Dict[str, str], int]]:
+    """Read a WARC record's version line and headers; None at EOF or on a torn header"""
+    start = handle.tell()
+    line = handle.readline()
+    if not line.startswith(WARC_VERSION):
+        return None
+    headers = {}
+    while True:
+        line = handle.readline()
+        if not line.endswith(b"\n"):
+            return None
+        if line in (b"\r\n", b"\n"):
+            break
+        name, _, value = line.decode("utf-8", "replace").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "content-length" not in headers:
+        return None
+    return headers, handle.tell() - start
+
+
+def load_index(index_path: Path) -> Dict[str, Dict[str, Any]]:
+    """URL -> newest record entry from a CDXJ index"""
+    index: Dict[str, Dict[str, Any]] = {}
+    if not index_path.exists():
+        return index
+    with open(index_path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.split(" ", 2)
+            if len(parts) < 3:
+                continue
+            try:
+                entry = json.loads(parts[2])
+            except ValueError:
+                continue
+            previous = index.get(entry["url"])
+            if previous is None or previous["offset"] < entry["offset"]:
+                index[entry["url"]] = entry
+    return index
+
+
+class ArchiveReader:
+    """
+    Random access to an archived site without extracting it
+
+    The WARC is memory-mapped and records are located through the CDXJ
+    index, so serving a page costs one dictionary lookup and a slice of
+    the mapping.
+    """
+
+    def __init__(self, site_dir: Path):
+        self.site_dir = site_dir
+        self.index = load_index(site_dir / ARCHIVE_INDEX_FILENAME)
+        self.by_path = {entry["path"]: url for url, entry in self.index.items() if entry.get("path")}
+        self._file = open(site_dir / ARCHIVE_FILENAME, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Index entry for a URL or a site-relative path"""
+        url = key if key in self.index else self.by_path.get(key.lstrip("/"))
+        return self.index.get(url) if url else None
+
+    def read(self, key: str) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        """
+        A record's index entry and body
+
+        Args:
+            key: URL or site-relative path
+
+        Returns:
+            (entry, body), or None if it is not archived
+        """
+        entry = self.lookup(key)
+        if entry is None or self._map is None:
+            return None
+        offset = entry["offset"]
+        header_end = self._map.find(b"\r\n\r\n", offset, offset + entry["length"])
+        if header_end < 0:
+            return None
+        headers = self._map[offset:header_end].decode("utf-8", "replace")
+        length = next(
+            int(line.split(":", 1)[1]) for line in headers.split("\r\n")
+            if line.lower().startswith("content-length:")
+        )
+        start = header_end + 4
+        return entry, self._map[start:start + length]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,161 @@
+"""
+Library-wide content-addressed store for downloaded assets.
+"""
+import gzip
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Tuple
+from .storage import CHUNK_SIZE, _open_temp, _remove
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for blob_compression="zstd"
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIRNAME = ".blobs"
+BLOB_COMPRESSIONS = ("none", "gzip", "zstd")
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+# Only text compresses well; images and fonts are stored as they are
+TEXT_EXTENSIONS = {
+    ".css", ".scss", ".js", ".mjs", ".map", ".json", ".svg", ".xml", ".txt",
+    ".md", ".csv", ".html", ".htm"
+}
+
+
+class BlobStore:
+    """
+    Assets stored once per library, keyed by SHA-256
+
+    Blobs live in <library>/.blobs/<first two hex digits>/<digest>. Site
+    directories reference uncompressed blobs through hardlinks (falling
+    back to copies where the filesystem can't link), so identical
+    bundles shared by many sites take the disk space and inode of one
+    file, and two assets can never overwrite each other's bytes. Treat
+    linked files as read-only: editing one in place edits every site
+    that shares it.
+
+    With compression enabled, text assets are stored gzip- or
+    zstd-compressed and the site gets a plain, decompressed copy of its
+    own, since its pages link to it; read() returns a blob's original bytes.
+    """
+
+    def __init__(self, library_dir: Path, compression: str = "none"):
+        if compression not in BLOB_COMPRESSIONS:
+            raise ValueError(f"blob compression must be one of {', '.join(BLOB_COMPRESSIONS)}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd blob compression needs the zstandard package")
+        self.root = library_dir / BLOB_DIRNAME
+        self.tmp_dir = self.root / "tmp"
+        self.compression = compression
+
+    def blob_path(self, digest: str, suffix: str = "") -> Path:
+        return self.root / digest[:2] / (digest + suffix)
+
+    def _suffix_for(self, name: str) -> str:
+        if self.compression == "none" or Path(name).suffix.lower() not in TEXT_EXTENSIONS:
+            return ""
+        return COMPRESSED_SUFFIXES[self.compression]
+
+    def put(self, tmp_path: Path, digest: str, name: str) -> Tuple[Path, bool]:
+        """
+        Move a streamed temp file into the store (blocking)
+
+        Args:
+            tmp_path: Finished temp file, preferably inside tmp_dir
+            digest: SHA-256 hex digest of its contents
+            name: Asset file name, used to decide whether to compress it
+
+        Returns:
+            (blob path, True if the blob was new or False if it was already stored)
+        """
+        blob = self.blob_path(digest, self._suffix_for(name))
+        if blob.exists():
+            _remove(tmp_path)
+            return blob, False
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        if blob.suffix in (".gz", ".zst"):
+            _compress(tmp_path, blob)
+            _remove(tmp_path)
+        else:
+            try:
+                os.replace(tmp_path, blob)
+            except OSError:
+                shutil.move(str(tmp_path), blob)
+        return blob, True
+
+    def link(self, blob: Path, target: Path):
+        """Atomically make target a hardlink to (or, failing that, a copy of) an uncompressed blob"""
+        try:
+            if target.exists() and os.path.samefile(blob, target):
+                return
+        except OSError:
+            pass
+        target.parent.mkdir(parents=True, exist_ok=True)
+        handle, tmp_path = _open_temp(target.parent)
+        handle.close()
+        try:
+            try:
+                _remove(tmp_path)
+                os.link(blob, tmp_path)
+            except OSError:
+                shutil.copyfile(blob, tmp_path)
+            os.replace(tmp_path, target)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+
+    def extract(self, blob: Path, target: Path):
+        """Atomically give target a blob's original bytes: a link to a plain blob, a decompressed copy otherwise"""
+        if blob.suffix not in (".gz", ".zst"):
+            self.link(blob, target)
+            return
+        handle, tmp_path = _open_temp(target.parent)
+        try:
+            with handle, _decompressed(blob) as reader:
+                shutil.copyfileobj(reader, handle, CHUNK_SIZE)
+            os.replace(tmp_path, target)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+
+    def read(self, blob: Path) -> bytes:
+        """Original bytes of a blob, decompressing if needed"""
+        if blob.suffix not in (".gz", ".zst"):
+            return blob.read_bytes()
+        with _decompressed(blob) as reader:
+            return reader.read()
+
+
+def _decompressed(blob: Path):
+    """Readable stream of a compressed blob's original bytes"""
+    if blob.suffix == ".gz":
+        return gzip.open(blob, "rb")
+    return zstandard.ZstdDecompressor().stream_reader(open(blob, "rb"))
+
+
+def _compress(src: Path, blob: Path):
+    """Compress src into blob through a temp file in the blob's directory"""
+    handle, tmp_path = _open_temp(blob.parent)
+    try:
+        with open(src, "rb") as reader:
+            if blob.suffix == ".gz":
+                with gzip.GzipFile(fileobj=handle, mode="wb", compresslevel=6, mtime=0) as writer:
+                    shutil.copyfileobj(reader, writer, CHUNK_SIZE)
+            else:
+                with zstandard.ZstdCompressor(level=10).stream_writer(handle, closefd=False) as writer:
+                    shutil.copyfileobj(reader, writer, CHUNK_SIZE)
+        handle.close()
+        os.replace(tmp_path, blob)
+    except BaseException:
+        handle.close()
+        _remove(tmp_path)
+        raise
+
+
+def relative_to_site(blob: Path, site_dir: Path) -> str:
+    """Blob path as stored in a site manifest (relative, so the library can move)"""
+    return os.path.relpath(blob, site_dir).replace(os.sep, "/")
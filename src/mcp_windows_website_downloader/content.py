@@ -0,0 +1,259 @@
+"""
+Main-content text extraction from saved pages, for search and RAG.
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+import lxml.html
+from lxml import etree
+from .frontier import detect_framework, nav_links
+
+# Where documentation generators put the article body, most specific first
+MAIN_CONTENT_XPATHS = [
+    "//main",
+    "//article",
+    "//*[@role='main']",
+    "//div[contains(concat(' ', normalize-space(@class), ' '), ' md-content ')]",  # mkdocs
+    "//div[contains(concat(' ', normalize-space(@class), ' '), ' theme-doc-markdown ')]",  # docusaurus
+    "//div[contains(concat(' ', normalize-space(@class), ' '), ' body ')]",  # sphinx
+    "//div[contains(concat(' ', normalize-space(@class), ' '), ' document ')]",
+    "//*[@id='content']",
+]
+# Page chrome that never belongs in the extracted text
+BOILERPLATE_TAGS = [
+    "script", "style", "noscript", "template", "nav", "header", "footer",
+    "aside", "form", "button", "svg", "iframe"
+]
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def parse_html(body: bytes, encoding: Optional[str] = None):
+    """Parse a page into an lxml tree, or None if it has no usable markup"""
+    if not body.strip():
+        return None
+    parser = lxml.html.HTMLParser(encoding=encoding) if encoding else None
+    try:
+        return lxml.html.document_fromstring(body, parser=parser)
+    except (etree.ParserError, ValueError, LookupError):
+        return None
+
+
+def main_content(tree):
+    """
+    The element holding a page's article body, with boilerplate removed
+
+    Falls back to <body> when no known content container is found.
+    """
+    for xpath in MAIN_CONTENT_XPATHS:
+        found = tree.xpath(xpath)
+        if found:
+            root = found[0]
+            break
+    else:
+        root = tree.find("body")
+        if root is None:
+            root = tree
+    for element in root.xpath(".//" + " | .//".join(BOILERPLATE_TAGS)):
+        element.drop_tree()
+    return root
+
+
+def page_title(tree) -> str:
+    """The page's <title>, falling back to its first <h1>"""
+    for xpath in ("//title", "//h1"):
+        found = tree.xpath(xpath)
+        if found:
+            title = normalize_space(found[0].text_content())
+            if title:
+                return title
+    return ""
+
+
+def canonical_link(tree) -> Optional[str]:
+    """The href of the page's <link rel="canonical">, unresolved"""
+    for href in tree.xpath("//link[contains(concat(' ', translate(normalize-space(@rel), "
+                           "'CANONICAL', 'canonical'), ' '), ' canonical ')]/@href"):
+        href = href.strip()
+        if href:
+            return href
+    return None
+
+
+def normalize_space(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def extract_text(body: bytes, encoding: Optional[str] = None) -> Dict[str, str]:
+    """
+    Title and main-content text of a page
+
+    Args:
+        body: Raw or rewritten HTML
+        encoding: Charset from the response, if known
+
+    Returns:
+        {"title": ..., "text": ...}; both empty if the page can't be parsed
+    """
+    return extract_document(body, encoding)
+
+
+DEFAULT_CHUNK_TOKENS = 512
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+# Elements that start a new paragraph-like block of text
+BLOCK_TAGS = {
+    "p", "div", "section", "li", "ul", "ol", "dl", "dt", "dd", "table", "tr",
+    "blockquote", "figure", "figcaption", "details", "summary", "br", "hr"
+}
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate token count: words and punctuation marks
+
+    Tracks BPE tokenizers closely enough for sizing chunks without
+    depending on any one model's vocabulary.
+    """
+    return len(_TOKEN.findall(text))
+
+
+class _SectionBuilder:
+    """Collects text blocks under the heading path they appear beneath"""
+
+    def __init__(self):
+        self.headings: List[Tuple[int, str]] = []
+        self.blocks: List[Tuple[Tuple[str, ...], str]] = []
+        self._buffer: List[str] = []
+
+    def text(self, text: Optional[str]):
+        if text:
+            self._buffer.append(text)
+
+    def flush(self):
+        text = normalize_space("".join(self._buffer))
+        self._buffer = []
+        if text:
+            self.blocks.append((tuple(h for _, h in self.headings), text))
+
+    def preformatted(self, text: str):
+        self.flush()
+        text = text.strip("\n")
+        if text.strip():
+            self.blocks.append((tuple(h for _, h in self.headings), text))
+
+    def heading(self, level: int, text: str):
+        self.flush()
+        while self.headings and self.headings[-1][0] >= level:
+            self.headings.pop()
+        if text:
+            self.headings.append((level, text))
+
+    def walk(self, element):
+        tag = element.tag if isinstance(element.tag, str) else ""
+        if tag in HEADING_TAGS:
+            self.heading(int(tag[1]), normalize_space(element.text_content()))
+            return
+        if tag == "pre":
+            self.preformatted(element.text_content())
+            return
+        block = tag in BLOCK_TAGS
+        if block:
+            self.flush()
+        if tag:
+            self.text(element.text)
+        for child in element:
+            self.walk(child)
+            self.text(child.tail)
+        if block:
+            self.flush()
+
+
+def _split_block(text: str, max_tokens: int) -> List[str]:
+    """Split one oversized block at word boundaries"""
+    pieces, current, size = [], [], 0
+    for word in text.split(" "):
+        tokens = count_tokens(word)
+        if current and size + tokens > max_tokens:
+            pieces.append(" ".join(current))
+            current, size = [], 0
+        current.append(word)
+        size += tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def extract_chunks(body: bytes, encoding: Optional[str] = None,
+                   max_tokens: int = DEFAULT_CHUNK_TOKENS) -> List[Dict[str, Any]]:
+    """
+    Split a page's main content into heading-aware chunks
+
+    Blocks under the same heading path are packed together up to
+    max_tokens; a chunk never spans two sections, and blocks larger than
+    max_tokens are split at word boundaries.
+
+    Returns:
+        [{"headings": [...], "text": ..., "tokens": ...}] in document order
+    """
+    tree = parse_html(body, encoding)
+    if tree is None:
+        return []
+    return _chunk(main_content(tree), max_tokens)
+
+
+def extract_document(body: bytes, encoding: Optional[str] = None,
+                     chunk_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """
+    extract_text() plus the page's canonical link, generator "framework" and
+    unresolved "nav_links", and extract_chunks() under "chunks" when
+    chunk_tokens is given, from a single parse of the page
+    """
+    tree = parse_html(body, encoding)
+    if tree is None:
+        return {"title": "", "text": "", "canonical": None, "framework": None, "nav_links": [],
+                **({"chunks": []} if chunk_tokens else {})}
+    title = page_title(tree)
+    canonical = canonical_link(tree)
+    framework = detect_framework(tree)
+    # Before main_content() drops the navigation from the tree
+    navigation = nav_links(tree, framework)
+    root = main_content(tree)
+    result = {"title": title, "text": normalize_space(" ".join(root.itertext())), "canonical": canonical,
+              "framework": framework, "nav_links": navigation}
+    if chunk_tokens:
+        result["chunks"] = _chunk(root, chunk_tokens)
+    return result
+
+
+def _chunk(root, max_tokens: int) -> List[Dict[str, Any]]:
+    """Pack the blocks under root into chunks of at most max_tokens"""
+    builder = _SectionBuilder()
+    builder.walk(root)
+    builder.flush()
+
+    chunks: List[Dict[str, Any]] = []
+    current: List[str] = []
+    current_path: Optional[Tuple[str, ...]] = None
+    size = 0
+
+    def emit():
+        if current:
+            text = "\n\n".join(current)
+            chunks.append({"headings": list(current_path), "text": text, "tokens": count_tokens(text)})
+
+    for path, text in builder.blocks:
+        tokens = count_tokens(text)
+        if path != current_path or size + tokens > max_tokens:
+            emit()
+            current, current_path, size = [], path, 0
+        if tokens > max_tokens:
+            for piece in _split_block(text, max_tokens):
+                current = [piece]
+                emit()
+            current, size = [], 0
+            continue
+        current.append(text)
+        size += tokens
+    emit()
+    return chunks
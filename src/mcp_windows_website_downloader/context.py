@@ -0,0 +1,167 @@
+"""
+Per-crawl state, kept separate so several site downloads can share one downloader.
+"""
+import asyncio
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+from .archive import SiteArchive
+from .dedup import DuplicateDetector, SubtreePruner
+from .export import ChunkExporter
+from .frontier import CrawlFrontier
+from .journal import CrawlJournal
+from .manifest import CrawlManifest
+from .metrics import CrawlMetrics
+from .scope import CrawlScope
+from .scheduler import RequestScheduler
+from .shards import ShardLink
+from .utils import UrlCanonicalizer
+
+DEFAULT_MAX_DEPTH = 2  # Used until site analysis picks a depth
+DEFAULT_ASSET_CONCURRENCY = 16
+
+
+class CrawlContext:
+    """
+    Everything one site crawl reads and writes
+
+    WebsiteDownloader keeps only shared, crawl-independent resources
+    (HTTP connection pool, file writer, parse pool). Each download()
+    call builds its own context, so overlapping crawls never see each
+    other's frontier, domain, output directory or limits.
+    """
+
+    def __init__(self, url: str, site_dir: Path, canonicalizer: UrlCanonicalizer,
+                 concurrency: int, max_pages: Optional[int] = None,
+                 max_asset_size: Optional[int] = None,
+                 on_progress: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.start_url = url
+        self.current_domain = urlparse(url).netloc
+        self.site_dir = site_dir
+        self.canonicalizer = canonicalizer
+        self.concurrency = concurrency
+        self.max_pages = max_pages
+        self.max_asset_size = max_asset_size
+        # Per-file cap for pages and assets, and the crawl's total byte budget
+        self.max_file_size: Optional[int] = None
+        self.max_total_bytes: Optional[int] = None
+        self.scope = CrawlScope()
+        self.max_depth = DEFAULT_MAX_DEPTH
+        self.on_progress = on_progress
+
+        self.visited_urls: Set[str] = set()  # canonical URLs
+        self.queue = CrawlFrontier()
+        # Pages taken off the frontier so far, counted against max_pages
+        self.pages_started = 0
+        # Start page response (and its parse) from the site analysis, picked up by the crawl
+        self.prefetched: Dict[str, Dict[str, Any]] = {}
+        # Documentation generator detected by the site analysis
+        self.framework: Optional[str] = None
+        # Asset registry: canonical URL -> in-flight or finished download
+        self.assets: Dict[str, asyncio.Task] = {}
+        self.asset_semaphore = asyncio.Semaphore(DEFAULT_ASSET_CONCURRENCY)
+        self.manifest: Optional[CrawlManifest] = None
+        self.client: Optional[RequestScheduler] = None
+        self.journal: Optional[CrawlJournal] = None
+        # RAG chunk export, when enabled, and the chunk size it uses
+        self.exporter: Optional[ChunkExporter] = None
+        self.chunk_tokens: Optional[int] = None
+        # Single-file WARC output instead of loose files, when enabled
+        self.archive: Optional[SiteArchive] = None
+        # robots.txt rules (None when not fetched or not respected)
+        self.robots: Optional[RobotFileParser] = None
+        # Canonical URL -> sitemap <lastmod> for pages listed in the sitemaps
+        self.lastmod_hints: Dict[str, str] = {}
+        self.sitemap_urls = 0
+        self.robots_blocked = 0
+        self.skipped_by_lastmod = 0
+        # URLs left out by the scope rules, content-type filter and size caps
+        self.skipped = {"out_of_scope": 0, "content_type": 0, "too_large": 0, "over_budget": 0}
+        # Whether max_pages left pages out of the crawl
+        self.page_budget_reached = False
+        # Duplicate page detection, when enabled, and subtree pruning on top of it
+        self.dedup: Optional[DuplicateDetector] = None
+        self.pruner: Optional[SubtreePruner] = None
+        self.duplicates = {"exact": 0, "near": 0, "pruned_urls": 0, "canonical_links": 0}
+        self.duplicate_of: Dict[str, str] = {}  # skipped duplicate URL -> kept URL
+        # This crawl's place in a sharded crawl, when it is one of its worker processes
+        self.shard: Optional[ShardLink] = None
+        # Lowest depth each page was queued (or sent to its shard) at, and the
+        # (links, nav links) of the pages whose links were followed
+        self.page_depths: Dict[str, int] = {}
+        self.followed: Dict[str, Tuple[List[str], List[str]]] = {}
+        # Request phase timings, stage timers and byte counters
+        self.metrics = CrawlMetrics()
+
+        self.saved_pages = 0
+        self.assets_deduplicated = 0  # assets whose bytes were already in the blob store
+        self.bytes_downloaded = 0
+        self.started_at = time.monotonic()
+
+    def canonical_list(self, urls: List[str]) -> List[str]:
+        """Canonicalize URLs, dropping the duplicates that collapse together"""
+        return list(dict.fromkeys(self.canonicalizer.canonicalize(url) for url in urls))
+
+    def size_cap(self, asset: bool = True) -> Optional[int]:
+        """Largest body accepted for an asset or a page, if capped"""
+        caps = [self.max_file_size] + ([self.max_asset_size] if asset else [])
+        caps = [cap for cap in caps if cap is not None]
+        return min(caps) if caps else None
+
+    def too_large(self, size: Optional[int], asset: bool = True) -> bool:
+        """Whether a declared body size exceeds the per-file (or per-asset) cap"""
+        cap = self.size_cap(asset)
+        return cap is not None and size is not None and size > cap
+
+    def pages_exhausted(self) -> bool:
+        """Whether max_pages pages have been taken off the frontier"""
+        return self.max_pages is not None and self.pages_started >= self.max_pages
+
+    def budget_reached(self) -> bool:
+        """Whether the page or byte budget left anything out of the crawl"""
+        return self.page_budget_reached or self.skipped["over_budget"] > 0
+
+    def over_budget(self) -> bool:
+        """Whether the crawl has downloaded its total byte budget"""
+        return self.max_total_bytes is not None and self.bytes_downloaded >= self.max_total_bytes
+
+    def metric_counters(self) -> Dict[str, int]:
+        """Counters kept outside CrawlMetrics, flattened for a metrics snapshot"""
+        counters = {"pages_saved": self.saved_pages, "bytes_downloaded": self.bytes_downloaded,
+                    "assets_deduplicated": self.assets_deduplicated}
+        if self.client is not None:
+            counters.update(self.client.stats)
+        counters.update({f"duplicates_{name}": value for name, value in self.duplicates.items()})
+        counters.update({f"skipped_{name}": value for name, value in self.skipped.items()})
+        return counters
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        """JSON view of this crawl's metrics so far"""
+        return self.metrics.snapshot(self.metric_counters())
+
+    def metrics_prometheus(self) -> str:
+        """Prometheus text view of this crawl's metrics so far"""
+        return self.metrics.prometheus(self.site_dir.name, self.metric_counters())
+
+    def progress(self) -> Dict[str, Any]:
+        """
+        Snapshot of the running crawl
+
+        The ETA only covers pages already in the frontier, so it grows as
+        new links are discovered.
+        """
+        elapsed = time.monotonic() - self.started_at
+        queued = self.queue.qsize()
+        if self.max_pages is not None:
+            queued = min(queued, max(0, self.max_pages - self.pages_started))
+        rate = self.saved_pages / elapsed if elapsed > 0 else 0.0
+        return {
+            "pages_done": self.saved_pages,
+            "queued": queued,
+            "bytes": self.bytes_downloaded,
+            "elapsed_seconds": round(elapsed, 1),
+            "pages_per_second": round(rate, 2),
+            "eta_seconds": round(queued / rate, 1) if rate > 0 else None
+        }
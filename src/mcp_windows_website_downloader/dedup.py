@@ -0,0 +1,190 @@
+"""
+Content fingerprints for spotting duplicate and near-duplicate pages during a crawl.
+"""
+import hashlib
+import logging
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+from .utils import page_path
+
+logger = logging.getLogger(__name__)
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+NEAR_DUPLICATE_DISTANCE = 6  # bits out of 64; unrelated pages differ in about 32
+MIN_SIMHASH_WORDS = 50  # shorter texts are too small for SimHash to tell apart
+BANDS = 8  # NEAR_DUPLICATE_DISTANCE < BANDS, so near-duplicates share at least one band
+PRUNE_MIN_DUPLICATES = 5
+PRUNE_RATIO = 0.8
+
+_WORD = re.compile(r"\w+")
+
+
+def fingerprint(text: str) -> Dict[str, Optional[str]]:
+    """
+    Exact and near-duplicate fingerprints of a page's main-content text
+
+    Returns:
+        {"text_hash": ..., "simhash": ...}; text_hash is None for empty text
+        and simhash is None for texts under MIN_SIMHASH_WORDS words
+    """
+    words = _WORD.findall(text.lower())
+    if not words:
+        return {"text_hash": None, "simhash": None}
+    text_hash = hashlib.sha256(" ".join(words).encode("utf-8")).hexdigest()[:32]
+    value = simhash(words) if len(words) >= MIN_SIMHASH_WORDS else None
+    return {"text_hash": text_hash, "simhash": f"{value:016x}" if value is not None else None}
+
+
+def simhash(words: List[str]) -> int:
+    """
+    64-bit SimHash over word shingles
+
+    Rather than summing each of the 64 bits over every shingle hash, the
+    hashes' bytes are tallied per position and each bit's count is read
+    off the (at most 256) distinct bytes seen at its position.
+    """
+    digest_size = SIMHASH_BITS // 8
+    digests = b"".join(
+        hashlib.blake2b(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8"), digest_size=digest_size).digest()
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    )
+    half = len(digests) / digest_size / 2
+    value = 0
+    for position in range(digest_size):
+        tally = Counter(digests[position::digest_size])
+        shift = 8 * (digest_size - 1 - position)  # digests are big-endian
+        for bit in range(8):
+            if sum(count for byte, count in tally.items() if byte >> bit & 1) > half:
+                value |= 1 << (shift + bit)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class DuplicateDetector:
+    """
+    Remembers the fingerprints of pages kept so far in a crawl
+
+    Exact duplicates are found by text hash. Near-duplicates are found by
+    SimHash within NEAR_DUPLICATE_DISTANCE bits, looked up through banded
+    buckets so each check only compares against pages sharing a band.
+    """
+
+    def __init__(self, distance: int = NEAR_DUPLICATE_DISTANCE):
+        self.distance = distance
+        self.exact: Dict[str, str] = {}
+        self.bands: List[Dict[int, List[Tuple[int, str]]]] = [{} for _ in range(BANDS)]
+
+    def _band_keys(self, value: int):
+        width = SIMHASH_BITS // BANDS
+        mask = (1 << width) - 1
+        return [(value >> (i * width)) & mask for i in range(BANDS)]
+
+    def add(self, url: str, text_hash: Optional[str], simhash_hex: Optional[str]):
+        """Register a page that is being kept"""
+        if text_hash:
+            self.exact.setdefault(text_hash, url)
+        if simhash_hex:
+            value = int(simhash_hex, 16)
+            for band, key in zip(self.bands, self._band_keys(value)):
+                band.setdefault(key, []).append((value, url))
+
+    def check(self, url: str, text_hash: Optional[str], simhash_hex: Optional[str]) -> Optional[Tuple[str, str]]:
+        """
+        Compare a page with the pages kept so far, keeping it if it is new
+
+        Returns:
+            ("exact" or "near", URL of the kept page), or None if the page is new
+        """
+        if text_hash and self.exact.get(text_hash, url) != url:
+            return "exact", self.exact[text_hash]
+        if simhash_hex:
+            value = int(simhash_hex, 16)
+            for band, key in zip(self.bands, self._band_keys(value)):
+                for other, other_url in band.get(key, ()):
+                    if other_url != url and hamming(value, other) <= self.distance:
+                        return "near", other_url
+        self.add(url, text_hash, simhash_hex)
+        return None
+
+
+class SubtreePruner:
+    """
+    Stops crawling URL subtrees that keep serving duplicates
+
+    Every directory a page sits under counts its pages and duplicates.
+    Once a directory has PRUNE_MIN_DUPLICATES duplicates making up at
+    least PRUNE_RATIO of its pages (say /en/latest/ mirroring
+    /en/stable/), nothing more under it is queued. Directories above the
+    start URL are never pruned.
+    """
+
+    def __init__(self, start_url: str):
+        self.protected = set(_directories(urlparse(start_url).path)) | {"/"}
+        self.counts: Dict[str, List[int]] = {}
+        self.pruned: List[str] = []
+
+    def observe(self, url: str, duplicate: bool) -> Optional[str]:
+        """Count a fetched page; returns a directory if this page got it pruned"""
+        newly = None
+        for directory in _directories(urlparse(url).path):
+            if directory in self.protected:
+                continue
+            counts = self.counts.setdefault(directory, [0, 0])
+            counts[0] += 1
+            counts[1] += duplicate
+            if (counts[1] >= PRUNE_MIN_DUPLICATES and counts[1] >= PRUNE_RATIO * counts[0]
+                    and not self.is_pruned(directory)):
+                self.pruned.append(directory)
+                newly = newly or directory
+        return newly
+
+    def is_pruned(self, url_or_path: str) -> bool:
+        path = urlparse(url_or_path).path if "://" in url_or_path else url_or_path
+        return any(path.startswith(directory) for directory in self.pruned)
+
+
+def _directories(path: str) -> List[str]:
+    """Every directory prefix of a URL path: /a/b/c.html -> /, /a/, /a/b/"""
+    parts = path.split("/")[:-1]
+    return ["/".join(parts[:i + 1]) + "/" for i in range(len(parts))]
+
+
+def duplicate_stats(counts: Dict[str, int], pruner: Optional[SubtreePruner]) -> Dict[str, Any]:
+    """Duplicate section of the download result"""
+    stats: Dict[str, Any] = dict(counts)
+    if pruner is not None:
+        stats["pruned_subtrees"] = list(pruner.pruned)
+    return stats
+
+
+def skipped_link_targets(links: Iterable[str], duplicate_of: Dict[str, str], pruned: List[str],
+                         saved: Dict[str, Any]) -> Dict[str, str]:
+    """
+    New hrefs for a saved page's local links to pages the crawl skipped
+
+    The parser points every in-domain link at a local file before the crawl
+    knows which pages it will skip, so those files are never written.
+
+    Args:
+        links: In-domain links the page's manifest entry records
+        duplicate_of: Skipped duplicate URL -> kept URL
+        pruned: Pruned directory paths
+        saved: Manifest entries of the pages with a local copy
+
+    Returns:
+        Local href -> replacement: a duplicate's kept page, or the absolute URL
+        of an unsaved page in a pruned subtree
+    """
+    targets = {}
+    for link in links:
+        if link in duplicate_of:
+            targets[f"/{page_path(link)}"] = f"/{page_path(duplicate_of[link])}"
+        elif link not in saved and any(urlparse(link).path.startswith(directory) for directory in pruned):
+            targets[f"/{page_path(link)}"] = link
+    return targets
@@ -5,145 +5,280 @@ import logging
 import asyncio
 from pathlib import Path
 import aiohttp
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse, unquote
+from urllib.parse import urljoin, urlparse
 import json
-import re
-from typing import Dict, Any, Optional, Set
-from .utils import clean_filename
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from .utils import clean_filename, page_path, asset_path, UrlCanonicalizer
+from .manifest import CrawlManifest, MANIFEST_FILENAME, content_hash, local_copy
+from .storage import AsyncFileWriter, CHUNK_SIZE
+from .parser import ParsePool, relink_page
+from .search import SearchIndex
+from .export import ChunkExporter, CHUNKS_FILENAME
+from .blobs import BlobStore, relative_to_site
+from .archive import SiteArchive, OUTPUT_MODES, ARCHIVE_FILENAME
+from .content import DEFAULT_CHUNK_TOKENS
+from .scope import CrawlScope
+from .dedup import DuplicateDetector, SubtreePruner, duplicate_stats, skipped_link_targets
+from .frontier import NAV_PRIORITY, link_priority, recommended_depth
+from .metrics import CrawlProfiler, METRICS_FILENAME, check_profiler, request_trace_config
+from .scheduler import RequestScheduler, DEFAULT_MAX_RETRIES
+from .context import CrawlContext
+from .journal import CrawlJournal, JournalState, CHECKPOINT_INTERVAL, JOURNAL_FILENAME
+from .shards import ShardedCrawl, ShardLink, shard_filename
+from .sitemap import ROBOTS_AGENT, fetch_robots, iter_sitemap, parse_lastmod
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CONNECTION_LIMIT = 64
+DNS_CACHE_SECONDS = 300
+# Responses that mean a URL was deleted, not just unavailable right now
+GONE_STATUSES = (404, 410)
+
 class WebsiteDownloader:
-    """Downloads and processes documentation websites"""
+    """
+    Downloads and processes documentation websites
+
+    Holds the resources shared by every crawl (HTTP connection pool with
+    its DNS cache, file writer, parse pool). Per-crawl state lives in a
+    CrawlContext, so several download() calls can run at once.
+    """
     
-    def __init__(self, output_dir: Path):
+    def __init__(self, output_dir: Path, writer: Optional[AsyncFileWriter] = None,
+                 parse_pool: Optional[ParsePool] = None,
+                 search_index: Optional[SearchIndex] = None,
+                 max_connections: int = DEFAULT_CONNECTION_LIMIT,
+                 blob_compression: str = "none"):
         self.output_dir = output_dir
         logger.info(f"Downloader initialized with output directory: {self.output_dir}")
         if not self.output_dir.exists():
             self.output_dir.mkdir(parents=True)
             logger.info(f"Created output directory at {self.output_dir}")
-        self.visited_urls = set()
-        self.current_domain = None
-        self.site_dir = None
-        self.max_depth = 2  # Default, will be adjusted based on site analysis
+        # Global cap on open connections across all running crawls
+        self.max_connections = max_connections
+        self.blob_compression = blob_compression
+        self._session: Optional[aiohttp.ClientSession] = None
+        # One crawl per site directory at a time; other sites run in parallel
+        self._site_locks: Dict[Path, asyncio.Lock] = {}
+        # Running crawls by site directory name, for live metrics
+        self._active: Dict[str, CrawlContext] = {}
+        # cProfile and pyinstrument can only profile one crawl at a time
+        self._profiling = False
+        # Bounded thread pool for all filesystem work during a crawl
+        self.writer = writer or AsyncFileWriter()
+        # Worker processes that parse and rewrite HTML off the event loop
+        self.parse_pool = parse_pool or ParsePool()
+        # Content-addressed asset storage shared by every site in the library
+        self.blobs = BlobStore(self.output_dir, blob_compression)
+        # Full-text index shared by every site in the library
+        self.search_index = search_index or SearchIndex(self.output_dir)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Shared session, created on first use inside the running loop"""
+        if self._session is None or self._session.closed:
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/91.0.4472.124',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+                'Accept-Language': 'en-US,en;q=0.5'
+            }
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections, use_dns_cache=True, ttl_dns_cache=DNS_CACHE_SECONDS
+            )
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+            # Request phase timings reach each crawl's metrics via trace_request_ctx
+            self._session = aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout,
+                                                  trace_configs=[request_trace_config()])
+        return self._session
+
+    async def close(self):
+        """Close the shared session and stop the writer and parse pools"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self.parse_pool.shutdown()
+        self.writer.shutdown()
+        self.search_index.close()
 
-    async def _analyze_site_structure(self, session: aiohttp.ClientSession, url: str) -> int:
+    async def _analyze_site_structure(self, ctx: CrawlContext, url: str) -> int:
         """
         Analyze the site structure to determine appropriate crawl depth.
         Returns recommended max depth.
+
+        The start page fetched (and parsed) here is handed to the crawl
+        through ctx.prefetched, so it is only requested once; the
+        framework found decides which links count as navigation.
         """
         try:
             logger.info("Analyzing site structure...")
-            async with session.get(url) as response:
-                if response.status != 200:
-                    return self.max_depth
-                    
-                content = await response.text()
-                soup = BeautifulSoup(content, "html.parser")
-                
-                # Look for common documentation patterns
-                nav_elements = soup.find_all(['nav', 'sidebar', 'menu', 'toc'])
-                has_nav = len(nav_elements) > 0
-                
-                # Check URL patterns
-                path = urlparse(url).path
-                is_docs_url = any(x in path.lower() for x in ['/docs/', '/documentation/', '/guide/', '/tutorial/'])
-                
-                # Check for documentation frameworks
-                is_sphinx = bool(soup.find('div', {'class': 'sphinxsidebar'}))
-                is_mkdocs = bool(soup.find('nav', {'class': 'md-nav'}))
-                is_docusaurus = bool(soup.find('nav', {'class': 'menu'}))
-                
-                # Analyze link structure
-                links = set()
-                for a in soup.find_all('a', href=True):
-                    href = a['href']
-                    if not href.startswith(('#', 'mailto:', 'tel:', 'javascript:')):
-                        full_url = urljoin(url, href)
-                        if urlparse(full_url).netloc == self.current_domain:
-                            links.add(full_url)
+            fetched = await self._fetch_page(ctx, url)
+            if fetched is None:
+                return ctx.max_depth
+            ctx.prefetched[url] = fetched
+            if fetched["not_modified"]:
+                # Unchanged since the last crawl: look at the saved copy instead
+                body = await self._read_saved(ctx, url, ctx.manifest.get(url))
+                analysis = await self.parse_pool.extract_text(body)
+            else:
+                analysis = fetched["parsed"] = await self._parse_fetched(ctx, fetched)
                 
-                # Determine appropriate depth
-                if is_sphinx or is_mkdocs or is_docusaurus:
-                    # Known documentation sites usually need more depth
-                    depth = 4
-                elif is_docs_url and has_nav:
-                    # Looks like structured documentation
-                    depth = 3
-                elif len(links) > 100:
-                    # Large site, be conservative
-                    depth = 2
-                else:
-                    # Small or unknown site structure
-                    depth = 2
-                    
-                logger.info(f"Site analysis complete. Recommended depth: {depth}")
-                return depth
+            ctx.framework = analysis["framework"]
+            depth = recommended_depth(url, ctx.framework, bool(analysis["nav_links"]))
+            logger.info(f"Site analysis complete. Framework: {ctx.framework or 'unknown'}, "
+                        f"recommended depth: {depth}")
+            return depth
                 
         except Exception as e:
             logger.warning(f"Site analysis failed: {str(e)}")
-            return self.max_depth
+            return ctx.max_depth
 
-    async def download(self, url: str) -> Dict[str, Any]:
-        """Download a documentation website"""
+    async def download(self, url: str, concurrency: int = DEFAULT_CONCURRENCY,
+                       max_pages: Optional[int] = None,
+                       max_asset_size: Optional[int] = None,
+                       ignore_query_params: Optional[List[str]] = None,
+                       trailing_slash: str = "strip-files",
+                       lowercase_path: bool = False,
+                       rate_limit: Optional[float] = None,
+                       max_retries: int = DEFAULT_MAX_RETRIES,
+                       use_sitemap: bool = True,
+                       respect_robots: bool = True,
+                       resume: bool = False,
+                       export_chunks: bool = False,
+                       chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+                       output: str = "files",
+                       skip_duplicates: bool = True,
+                       prune_duplicates: bool = False,
+                       include: Optional[List[str]] = None,
+                       exclude: Optional[List[str]] = None,
+                       allowed_types: Optional[List[str]] = None,
+                       max_file_size: Optional[int] = None,
+                       max_total_bytes: Optional[int] = None,
+                       profile: Optional[str] = None,
+                       shards: int = 1,
+                       on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       shard: Optional[ShardLink] = None) -> Dict[str, Any]:
+        """
+        Download a documentation website
+
+        Args:
+            url: Start URL of the site
+            concurrency: Number of pages fetched in parallel
+            max_pages: Optional cap on the number of pages crawled
+            max_asset_size: Optional cap in bytes for a single asset; larger ones are skipped
+            ignore_query_params: Query parameter patterns that don't identify a page
+                (default: highlight, utm_* and similar; ["*"] ignores all queries)
+            trailing_slash: Trailing-slash policy for URL canonicalization
+            lowercase_path: Lowercase URL paths, so /Guide.html and /guide.html count as
+                one page on case-insensitive servers
+            rate_limit: Optional cap on requests per second to the site
+            max_retries: Retries for 429/5xx responses and connection errors
+            use_sitemap: Seed the frontier from the site's sitemaps
+            respect_robots: Honor robots.txt disallow rules and Crawl-delay
+            resume: Continue an interrupted crawl of this URL from its last checkpoint
+            export_chunks: Also write RAG-ready text chunks to chunks.jsonl
+            chunk_tokens: Maximum approximate tokens per exported chunk
+            output: "files" saves pages and assets as loose files, "warc" appends
+                them to a single site.warc with a site.cdxj offset index
+            skip_duplicates: Don't save, index or export pages whose text duplicates
+                or nearly duplicates a page already kept
+            prune_duplicates: Stop crawling directories (like /latest/ next to /stable/)
+                whose pages keep coming back as duplicates; needs skip_duplicates,
+                and is not supported by sharded crawls
+            include: URL rules a page must match to be crawled (globs; "/..." globs match
+                the path, "re:..." rules are regexes); the start page is always fetched
+            exclude: URL rules for pages and assets that are never fetched
+            allowed_types: Content types (fnmatch patterns such as "image/*") to download,
+                checked from the response headers before the body is read
+            max_file_size: Optional cap in bytes for any single page or asset
+            max_total_bytes: Optional budget in bytes for the whole crawl; no new
+                requests are made once it is spent
+            profile: Profile the crawl with "cprofile" or "pyinstrument" (optional
+                package) and save the profile in the site directory
+            shards: Split the crawl by URL hash across this many worker processes;
+                page and byte budgets are shared out evenly between them
+            on_progress: Called with a CrawlContext.progress() snapshot after every page
+            shard: Set by ShardedCrawl in its worker processes: the part of the
+                site this call crawls, and the link to the other shards
+        """
         try:
-            # Reset state
-            self.visited_urls.clear()
-            self.current_domain = urlparse(url).netloc
+            if concurrency < 1:
+                raise ValueError("concurrency must be at least 1")
+            if max_pages is not None and max_pages < 1:
+                raise ValueError("max_pages must be at least 1")
+            if chunk_tokens < 1:
+                raise ValueError("chunk_tokens must be at least 1")
+            if output not in OUTPUT_MODES:
+                raise ValueError(f"output must be one of {', '.join(OUTPUT_MODES)}")
+            for name, value in [("max_file_size", max_file_size), ("max_total_bytes", max_total_bytes)]:
+                if value is not None and value < 1:
+                    raise ValueError(f"{name} must be at least 1")
+            check_profiler(profile)
+            if shards < 1:
+                raise ValueError("shards must be at least 1")
+            if shards > 1:
+                for name, value in [("resume", resume), ("profile", profile), ("output='warc'", output == "warc"),
+                                    ("prune_duplicates", prune_duplicates)]:
+                    if value:
+                        raise ValueError(f"{name} is not supported by sharded crawls")
+            scope = CrawlScope(include, exclude, allowed_types)
+
+            canonicalizer = UrlCanonicalizer(ignore_query_params, trailing_slash, lowercase_path)
+            url = canonicalizer.canonicalize(url)
             
             # Ensure we're using the configured output directory
             logger.info(f"Using output directory: {self.output_dir}")
             
             # Create site directory inside the output directory
-            self.site_dir = self.output_dir / clean_filename(self.current_domain)
-            logger.info(f"Creating site directory at: {self.site_dir}")
-            self.site_dir.mkdir(exist_ok=True)
-            
-            logger.info(f"Starting download of {url} to {self.site_dir}")
-            
-            # Create clean directory structure
-            assets_dir = self.site_dir / "assets"
-            assets_dir.mkdir(exist_ok=True)
-            for dir_name in ["css", "js", "images", "fonts", "other"]:
-                (assets_dir / dir_name).mkdir(exist_ok=True)
-
-            # Configure session            
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/91.0.4472.124',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5'
-            }
-            
-            async with aiohttp.ClientSession(headers=headers) as session:
-                # Analyze site and set depth
-                self.max_depth = await self._analyze_site_structure(session, url)
-                logger.info(f"Using max depth of {self.max_depth} for this site")
-                
-                # Start download
-                await self._process_page(session, url)
-                
-            # Create index
-            index = {
-                "url": url,
-                "domain": self.current_domain,
-                "pages": len(self.visited_urls),
-                "path": str(self.site_dir),
-                "max_depth_used": self.max_depth
-            }
-            
-            index_path = self.site_dir / "rag_index.json"
-            with open(index_path, "w") as f:
-                json.dump(index, f, indent=2)
-            
-            logger.info(f"Download complete. {len(self.visited_urls)} pages saved to {self.site_dir}")
-            
-            return {
-                "status": "success",
-                "path": str(self.site_dir),
-                "pages": len(self.visited_urls),
-                "depth_used": self.max_depth
-            }
+            site_dir = self.output_dir / self.site_name(url)
+            lock = self._site_locks.setdefault(site_dir, asyncio.Lock())
+            if lock.locked():
+                logger.info(f"Waiting for the running crawl of {site_dir} to finish")
+            async with lock:
+                if shards > 1:
+                    options = {
+                        "concurrency": concurrency, "max_pages": max_pages, "max_asset_size": max_asset_size,
+                        "ignore_query_params": ignore_query_params, "trailing_slash": trailing_slash,
+                        "lowercase_path": lowercase_path,
+                        "rate_limit": rate_limit, "max_retries": max_retries, "use_sitemap": use_sitemap,
+                        "respect_robots": respect_robots, "export_chunks": export_chunks,
+                        "chunk_tokens": chunk_tokens, "skip_duplicates": skip_duplicates,
+                        "prune_duplicates": prune_duplicates, "include": include, "exclude": exclude,
+                        "allowed_types": allowed_types, "max_file_size": max_file_size,
+                        "max_total_bytes": max_total_bytes
+                    }
+                    # The connection cap is shared out like the other budgets
+                    settings = {"max_connections": max(1, self.max_connections // shards),
+                                "blob_compression": self.blob_compression}
+                    return await ShardedCrawl(url, site_dir, shards, options, settings, self.search_index,
+                                              on_progress).run()
+                ctx = CrawlContext(url, site_dir, canonicalizer, concurrency, max_pages,
+                                   max_asset_size, on_progress)
+                ctx.scope = scope
+                ctx.max_file_size = max_file_size
+                ctx.max_total_bytes = max_total_bytes
+                if shard:
+                    ctx.shard = shard
+                    ctx.on_progress = on_progress or shard.report_progress
+                if export_chunks:
+                    part_name = shard_filename(CHUNKS_FILENAME + ".part", shard.index) if shard else None
+                    ctx.exporter = ChunkExporter(site_dir, part_name)
+                    ctx.chunk_tokens = chunk_tokens
+                if output == "warc":
+                    ctx.archive = SiteArchive(site_dir)
+                if skip_duplicates:
+                    ctx.dedup = DuplicateDetector()
+                    if prune_duplicates:
+                        ctx.pruner = SubtreePruner(url)
+                profiler = self._start_profiler(profile, site_dir) if profile else None
+                self._active[site_dir.name] = ctx
+                try:
+                    result = await self._download(ctx, rate_limit, max_retries, use_sitemap, respect_robots, resume)
+                finally:
+                    del self._active[site_dir.name]
+                    if profiler:
+                        self._profiling = False
+                        profile_path = profiler.stop()
+                if profiler and result.get("status") == "success":
+                    result["profile"] = str(profile_path)
+                return result
             
         except asyncio.CancelledError:
             logger.info("Download cancelled")
@@ -155,143 +290,877 @@ class WebsiteDownloader:
                 "error": str(e)
             }
 
-    async def _process_page(self, session: aiohttp.ClientSession, url: str, depth: int = 0) -> Optional[str]:
+    @staticmethod
+    def site_name(url: str) -> str:
+        """Name of the library directory a URL's site is downloaded into"""
+        return clean_filename(urlparse(UrlCanonicalizer().canonicalize(url)).netloc)
+
+    def _start_profiler(self, profile: str, site_dir: Path) -> CrawlProfiler:
+        if self._profiling:
+            raise ValueError("Another crawl is already being profiled")
+        profiler = CrawlProfiler(profile, site_dir)
+        profiler.start()
+        self._profiling = True
+        return profiler
+
+    def crawl_metrics(self, site: str, format: str = "json") -> Dict[str, Any]:
+        """
+        Metrics of a running crawl, or of a site's last finished crawl
+
+        Args:
+            site: Site directory name (as listed by the library)
+            format: "json" for a snapshot dict, "prometheus" for text exposition format
+
+        Returns:
+            {"status": "success", "site", "running", "metrics"}; metrics is a
+            string in the Prometheus format
+        """
+        if format not in ("json", "prometheus"):
+            return {"status": "error", "error": "format must be json or prometheus"}
+        ctx = self._active.get(site)
+        if ctx is not None:
+            metrics = ctx.metrics_snapshot() if format == "json" else ctx.metrics_prometheus()
+            return {"status": "success", "site": site, "running": True, "metrics": metrics}
+        site_dir = self.output_dir / site
+        try:
+            if format == "json":
+                metrics = json.loads((site_dir / "rag_index.json").read_text(encoding="utf-8"))["metrics"]
+            else:
+                metrics = (site_dir / METRICS_FILENAME).read_text(encoding="utf-8")
+        except (OSError, ValueError, KeyError):
+            return {"status": "error", "error": f"No crawl metrics for {site}"}
+        return {"status": "success", "site": site, "running": False, "metrics": metrics}
+
+    async def _download(self, ctx: CrawlContext, rate_limit: Optional[float], max_retries: int,
+                        use_sitemap: bool = True, respect_robots: bool = True,
+                        resume: bool = False) -> Dict[str, Any]:
+        """Crawl one site into its directory and write its index"""
+        filename = shard_filename(JOURNAL_FILENAME, ctx.shard.index) if ctx.shard else JOURNAL_FILENAME
+        ctx.journal = CrawlJournal(ctx.site_dir, filename)
+        try:
+            return await self._download_site(ctx, rate_limit, max_retries, use_sitemap, respect_robots, resume)
+        finally:
+            await asyncio.shield(self.writer.run(ctx.journal.close))
+            if ctx.exporter:
+                await asyncio.shield(self.writer.run(ctx.exporter.close))
+            if ctx.archive:
+                await asyncio.shield(self.writer.run(ctx.archive.close))
+
+    async def _download_site(self, ctx: CrawlContext, rate_limit: Optional[float], max_retries: int,
+                             use_sitemap: bool, respect_robots: bool, resume: bool) -> Dict[str, Any]:
+        logger.info(f"Creating site directory at: {ctx.site_dir}")
+        await self.writer.mkdir(ctx.site_dir)
+        
+        logger.info(f"Starting download of {ctx.start_url} to {ctx.site_dir}")
+        
+        # Create clean directory structure (an archive needs none)
+        if ctx.archive:
+            await self.writer.run(ctx.archive.open)
+        else:
+            assets_dir = ctx.site_dir / "assets"
+            for dir_name in ["css", "js", "images", "fonts", "media", "other"]:
+                await self.writer.mkdir(assets_dir / dir_name)
+            
+        # Previous crawl state drives conditional requests
+        ctx.manifest = await self.writer.run(CrawlManifest.load, ctx.site_dir)
+        if ctx.shard:
+            # A shard revalidates and reports removed only the URLs it owns
+            owned = {url: entry for url, entry in ctx.manifest.previous.items() if ctx.shard.owns(url)}
+            ctx.manifest = CrawlManifest(ctx.site_dir, owned, shard_filename(MANIFEST_FILENAME, ctx.shard.index))
+        
+        # Pick up where an interrupted crawl left off, or start a fresh journal
+        state = await self.writer.run(ctx.journal.replay, ctx.start_url) if resume else None
+        if state is None:
+            if resume:
+                logger.info(f"No checkpoint to resume for {ctx.start_url}; starting over")
+            await self.writer.run(ctx.journal.reset)
+        ctx.manifest.listener = ctx.journal.recorded
+        if ctx.exporter:
+            await self.writer.run(ctx.exporter.open, resume=state is not None)
+        
+        # Per-crawl politeness on top of the shared connection pool
+        ctx.client = RequestScheduler(
+            self._get_session(), rate_limit=rate_limit, max_retries=max_retries,
+            max_concurrency=min(self.max_connections, max(ctx.concurrency * 2, 10)),
+            metrics=ctx.metrics
+        )
+        
+        # robots.txt feeds both the frontier filter and the sitemap list
+        robots = await fetch_robots(ctx.client, ctx.start_url)
+        if respect_robots and robots is not None:
+            ctx.robots = robots
+            self._apply_crawl_delay(ctx, rate_limit)
+        
+        # Analyze site and set depth
+        if state is not None:
+            self._restore(ctx, state)
+        else:
+            if ctx.shard and not self._owns(ctx, ctx.start_url):
+                # The shard owning the start page analyzes the site for every shard
+                ctx.max_depth, ctx.framework = await ctx.shard.configuration()
+            else:
+                if self._allowed(ctx, ctx.start_url):
+                    ctx.max_depth = await self._analyze_site_structure(ctx, ctx.start_url)
+                if ctx.shard:
+                    ctx.shard.configure(ctx.max_depth, ctx.framework)
+            ctx.journal.start(ctx.start_url, ctx.max_depth, ctx.framework)
+        logger.info(f"Using max depth of {ctx.max_depth} for this site")
+        
+        # Start download
+        sitemaps = self._sitemap_urls(ctx, robots) if use_sitemap and self._owns(ctx, ctx.start_url) else []
+        await self._crawl(ctx, sitemaps, state.frontier if state else None)
+        
+        for url, lastmod in ctx.lastmod_hints.items():
+            ctx.manifest.set_lastmod(url, lastmod)
+        # Pages this crawl did not reach keep their entry, index rows and chunks unless they are gone
+        kept = ctx.manifest.carry_forward(complete=not ctx.budget_reached())
+        if ctx.dedup and not ctx.shard:
+            # A sharded crawl's coordinator does this once it has every shard's duplicates
+            await self._relink_skipped(ctx)
+        await self.writer.run(ctx.manifest.save)
+        await self.writer.run(self.search_index.remove, ctx.manifest.removed())
+        if ctx.exporter:
+            await self.writer.run(ctx.exporter.carry_forward, kept)
+            # A shard's part file is joined with the others' by the coordinator
+            await self.writer.run(ctx.exporter.close if ctx.shard else ctx.exporter.finish)
+        if ctx.archive:
+            await self.writer.run(ctx.archive.save_index)
+        changes = ctx.manifest.summary()
+        
+        # Create index
+        index = {
+            "url": ctx.start_url,
+            "domain": ctx.current_domain,
+            "pages": ctx.saved_pages,
+            "assets": len(ctx.assets),
+            "path": str(ctx.site_dir),
+            "max_depth_used": ctx.max_depth,
+            "framework": ctx.framework,
+            "sitemap_urls": ctx.sitemap_urls,
+            "changes": changes
+        }
+        if ctx.dedup:
+            # Skipped duplicate URL -> the kept page with the same content
+            index["duplicates"] = ctx.duplicate_of
+        if ctx.exporter:
+            index["chunks"] = {"path": ctx.exporter.path.name, "count": ctx.exporter.count,
+                               "max_tokens": ctx.chunk_tokens}
+        if ctx.archive:
+            index["archive"] = {"path": ctx.archive.path.name, "index": ctx.archive.index_path.name,
+                                "records": len(ctx.archive.index)}
+        index["metrics"] = ctx.metrics_snapshot()
+        
+        if not ctx.shard:
+            index_path = ctx.site_dir / "rag_index.json"
+            await self.writer.write_text(index_path, json.dumps(index, indent=2))
+            await self.writer.write_text(ctx.site_dir / METRICS_FILENAME, ctx.metrics_prometheus())
+        # Finished crawls have nothing to resume
+        await self.writer.run(ctx.journal.reset)
+        
+        logger.info(f"Download complete. {ctx.saved_pages} pages saved to {ctx.site_dir}")
+        
+        result = {
+            "status": "success",
+            "path": str(ctx.site_dir),
+            "pages": ctx.saved_pages,
+            "depth_used": ctx.max_depth,
+            "framework": ctx.framework,
+            "changes": changes,
+            "sitemap_urls": ctx.sitemap_urls,
+            "robots_blocked": ctx.robots_blocked,
+            "skipped_by_lastmod": ctx.skipped_by_lastmod,
+            "resumed": state is not None,
+            "assets_deduplicated": ctx.assets_deduplicated,
+            "skipped": ctx.skipped,
+            "duplicates": duplicate_stats(ctx.duplicates, ctx.pruner) if ctx.dedup else None,
+            "requests": ctx.client.stats
+        }
+        if ctx.shard:
+            # The coordinator merges these into the site's index and metrics
+            result.update({"index": index, "metrics": ctx.metrics, "counters": ctx.metric_counters()})
+        return result
+
+    def _apply_crawl_delay(self, ctx: CrawlContext, rate_limit: Optional[float]):
+        """Slow the site's host down to its robots.txt Crawl-delay / Request-rate"""
+        rates = []
+        delay = ctx.robots.crawl_delay(ROBOTS_AGENT)
+        if delay:
+            rates.append(1 / float(delay))
+        request_rate = ctx.robots.request_rate(ROBOTS_AGENT)
+        if request_rate and request_rate.seconds:
+            rates.append(request_rate.requests / request_rate.seconds)
+        if not rates:
+            return
+        if ctx.shard:
+            # Every shard requests from the same host
+            rates = [rate / ctx.shard.count for rate in rates]
+        rate = min(rates + ([rate_limit] if rate_limit else []))
+        logger.info(f"robots.txt limits {ctx.current_domain} to {rate:.2f} requests/s")
+        ctx.client.set_rate_limit(ctx.start_url, rate)
+
+    def _sitemap_urls(self, ctx: CrawlContext, robots) -> List[str]:
+        """Sitemaps listed in robots.txt, or /sitemap.xml when it lists none"""
+        listed = robots.site_maps() if robots is not None else None
+        if listed:
+            return [urljoin(ctx.start_url, sitemap) for sitemap in listed]
+        return [urljoin(ctx.start_url, "/sitemap.xml")]
+
+    def _owns(self, ctx: CrawlContext, url: str) -> bool:
+        """Whether this crawl fetches a URL itself rather than handing it to another shard"""
+        return ctx.shard is None or ctx.shard.owns(url)
+
+    def _allowed(self, ctx: CrawlContext, url: str) -> bool:
+        """Whether robots.txt lets us fetch a URL"""
+        return ctx.robots is None or ctx.robots.can_fetch(ROBOTS_AGENT, url)
+
+    def _restore(self, ctx: CrawlContext, state: JournalState):
+        """Load an interrupted crawl's settings, seen-set, finished pages and manifest entries"""
+        ctx.max_depth = state.max_depth
+        ctx.framework = state.framework
+        ctx.visited_urls.update(state.queued)
+        ctx.saved_pages = state.saved_pages
+        ctx.pages_started = len(state.done)
+        loop = asyncio.get_running_loop()
+        for url, (entry, status) in state.entries.items():
+            ctx.manifest.restore(url, entry, status)
+            if ctx.dedup and "links" in entry:
+                ctx.dedup.add(url, entry.get("text_hash"), entry.get("simhash"))
+            if "links" not in entry:
+                # Finished assets resolve straight from the registry
+                done = loop.create_future()
+                done.set_result(Path(entry["path"]))
+                ctx.assets[url] = done
+        logger.info(f"Resuming {ctx.start_url}: {len(state.done)} pages done, "
+                    f"{len(state.frontier)} still queued")
+
+    async def _checkpoint(self, ctx: CrawlContext, interval: float = CHECKPOINT_INTERVAL):
+        """Flush the journal every interval seconds while the crawl runs"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.writer.run(ctx.journal.flush)
+
+    async def _crawl(self, ctx: CrawlContext, sitemaps: Optional[List[str]] = None,
+                     frontier: Optional[List[tuple]] = None):
+        """Priority-ordered, breadth-first crawl drained by a pool of worker coroutines"""
+        # A resumed crawl already saw these URLs, so they bypass _enqueue
+        for url, depth, priority in frontier or []:
+            ctx.queue.push(url, depth, link_priority(url) if priority is None else priority)
+        if self._owns(ctx, ctx.start_url):
+            self._enqueue(ctx, ctx.start_url, 0, NAV_PRIORITY)
+        if ctx.shard:
+            ctx.shard.attach(lambda *page: self._receive_page(ctx, *page),
+                             lambda url: self._asset_task(ctx, url))
+        
+        workers = [
+            asyncio.create_task(self._worker(ctx))
+            for _ in range(ctx.concurrency)
+        ]
+        checkpoint = asyncio.create_task(self._checkpoint(ctx))
+        try:
+            # Sitemaps stream in while the workers already crawl
+            for sitemap in sitemaps or []:
+                await self._seed_from_sitemap(ctx, sitemap)
+            await self._drain(ctx)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Shared asset downloads are shielded from page workers, so settle them here;
+            # stylesheets keep adding the assets they reference until none are left
+            pending = [task for task in ctx.assets.values() if not task.done()]
+            while pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                pending = [task for task in ctx.assets.values() if not task.done()]
+            checkpoint.cancel()
+            await asyncio.gather(checkpoint, return_exceptions=True)
+            # Last checkpoint, even when the crawl was cancelled
+            await asyncio.shield(self.writer.run(ctx.journal.flush))
+
+    async def _drain(self, ctx: CrawlContext):
+        """
+        Wait for the frontier to run dry
+
+        A shard then also settles its asset downloads and reports itself
+        idle, since other shards can still send it work; it returns once
+        the coordinator sees every shard idle and stops the crawl.
+        """
+        while True:
+            await ctx.queue.join()
+            if ctx.shard is None:
+                return
+            pending = [task for task in ctx.assets.values() if not task.done()]
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                continue
+            if ctx.queue.idle and await ctx.shard.wait_idle():
+                return
+
+    def _receive_page(self, ctx: CrawlContext, url: str, depth: int, priority: int, lastmod: Optional[str]):
+        """Queue a page another shard found"""
+        if lastmod:
+            ctx.lastmod_hints[url] = lastmod
+        self._enqueue(ctx, url, depth, priority)
+
+    async def _seed_from_sitemap(self, ctx: CrawlContext, sitemap_url: str):
+        """
+        Add every in-domain page a sitemap lists to the frontier
+
+        Sitemap pages are queued at the maximum depth: they are fetched
+        however deep they sit in the link graph, but their own links are
+        not followed any further than the start page's are.
+        """
+        seen = set()
+        async for loc, lastmod in iter_sitemap(ctx.client, sitemap_url, seen):
+            url = ctx.canonicalizer.canonicalize(loc)
+            if urlparse(url).netloc.lower() != ctx.current_domain.lower():
+                continue
+            ctx.sitemap_urls += 1
+            if lastmod:
+                ctx.lastmod_hints[url] = lastmod
+            self._enqueue(ctx, url, ctx.max_depth)
+            if ctx.pages_exhausted() and ctx.shard is None:
+                ctx.page_budget_reached = True
+                break
+
+    async def _worker(self, ctx: CrawlContext):
+        """Take pages off the frontier until the crawl is cancelled"""
+        while True:
+            url, depth = await ctx.queue.pop()
+            try:
+                if ctx.pages_exhausted():
+                    # Left for a resumed crawl with a larger budget
+                    ctx.page_budget_reached = True
+                    continue
+                ctx.pages_started += 1
+                saved = bool(await self._process_page(ctx, url, depth))
+                if saved:
+                    ctx.saved_pages += 1
+                ctx.journal.done(url, saved)
+            finally:
+                ctx.queue.task_done()
+            if ctx.on_progress:
+                ctx.on_progress(ctx.progress())
+
+    def _enqueue(self, ctx: CrawlContext, url: str, depth: int, priority: Optional[int] = None) -> bool:
+        """
+        Add a URL to the frontier unless it was seen, is too deep or the page budget is spent
+
+        priority defaults to the tier its URL pattern alone suggests.
+        """
+        url = ctx.canonicalizer.canonicalize(url)
+        if depth > ctx.max_depth:
+            return False
+        if priority is None:
+            priority = link_priority(url)
+        if url in ctx.visited_urls:
+            if depth < ctx.page_depths.get(url, depth):
+                self._found_shallower(ctx, url, depth, priority)
+            return False
+        ctx.page_depths[url] = depth
+        if not self._owns(ctx, url):
+            # The owning shard applies the rest of the checks and its own budget
+            ctx.visited_urls.add(url)
+            ctx.shard.send_page(url, depth, priority, ctx.lastmod_hints.get(url))
+            return True
+        if ctx.pages_exhausted():
+            ctx.page_budget_reached = True
+            return False
+        if not self._allowed(ctx, url):
+            ctx.visited_urls.add(url)
+            ctx.robots_blocked += 1
+            logger.info(f"Skipping {url}: disallowed by robots.txt")
+            return False
+        if ctx.pruner and ctx.pruner.is_pruned(url):
+            ctx.visited_urls.add(url)
+            ctx.duplicates["pruned_urls"] += 1
+            return False
+        if url != ctx.start_url and not ctx.scope.allows_page(url):
+            ctx.visited_urls.add(url)
+            ctx.skipped["out_of_scope"] += 1
+            return False
+        if ctx.over_budget() and url not in ctx.prefetched:
+            ctx.visited_urls.add(url)
+            ctx.skipped["over_budget"] += 1
+            return False
+            
+        ctx.visited_urls.add(url)
+        ctx.journal.queued(url, depth, priority)
+        ctx.queue.push(url, depth, priority)
+        return True
+
+    def _found_shallower(self, ctx: CrawlContext, url: str, depth: int, priority: int):
+        """
+        Move a page up to a depth it was just found at
+
+        Workers (and shards) finish pages out of order, so a page can be
+        queued through a longer path before a shallower parent is done; its
+        links are then followed again from the new depth, or will be once
+        the page is processed.
+        """
+        ctx.page_depths[url] = depth
+        if not self._owns(ctx, url):
+            ctx.shard.send_page(url, depth, priority, ctx.lastmod_hints.get(url))
+        elif url in ctx.followed:
+            self._enqueue_links(ctx, url, *ctx.followed[url], depth)
+
+    async def _process_page(self, ctx: CrawlContext, url: str, depth: int) -> Optional[str]:
         """Process a single page and its assets"""
-        if url in self.visited_urls or depth > self.max_depth:
+        logger.info(f"Processing {url} (depth {depth}/{ctx.max_depth})")
+        
+        if ctx.pruner and ctx.pruner.is_pruned(url):
+            # Queued before its subtree was pruned
+            ctx.duplicates["pruned_urls"] += 1
             return None
             
-        self.visited_urls.add(url)
-        logger.info(f"Processing {url} (depth {depth}/{self.max_depth})")
-        
         try:
-            async with session.get(url) as response:
-                if response.status != 200:
-                    logger.warning(f"Failed to get {url}: {response.status}")
-                    return None
+            # The site analysis already fetched the start page
+            fetched = ctx.prefetched.pop(url, None)
+            if fetched is None:
+                if await self._unchanged_by_lastmod(ctx, url):
+                    # The sitemap says nothing changed since the saved copy, so skip the request
+                    ctx.skipped_by_lastmod += 1
+                    return await self._reuse_page(ctx, url, depth)
                     
-                content = await response.text()
-                soup = BeautifulSoup(content, "html.parser")
-                
-                # Save processed page first
-                save_path = self._get_save_path(url)
-                if not save_path:
-                    logger.warning(f"Invalid save path for {url}")
+                if ctx.over_budget():
+                    ctx.skipped["over_budget"] += 1
                     return None
                     
-                save_path.parent.mkdir(parents=True, exist_ok=True)
+                fetched = await self._fetch_page(ctx, url)
+                if fetched is None:
+                    return None
+                
+            if fetched["not_modified"]:
+                return await self._reuse_page(ctx, url, depth)
                 
-                # Handle assets before saving page
-                await self._handle_assets(session, soup, url)
+            save_path = self._get_save_path(ctx, url)
+            if not save_path:
+                logger.warning(f"Invalid save path for {url}")
+                return None
                 
-                # Process internal links
-                await self._process_links(session, soup, url, depth)
+            parsed = fetched.get("parsed") or await self._parse_fetched(ctx, fetched)
+            body, response_headers = fetched["body"], fetched["headers"]
+            links = ctx.canonical_list(parsed["links"])
+            assets = ctx.canonical_list(parsed["assets"])
+            
+            # Queue internal links (a duplicate's too, unless its subtree gets pruned)
+            duplicate = self._check_duplicate(ctx, url, parsed)
+            self._enqueue_links(ctx, url, links, parsed["nav_links"], depth)
+            if duplicate:
+                return None
                 
-                with open(save_path, "w", encoding="utf-8") as f:
-                    f.write(str(soup))
+            # Handle assets before saving page
+            await self._handle_assets(ctx, assets)
+            
+            rel_path = str(save_path.relative_to(ctx.site_dir))
+            digest = content_hash(body)
+            archive = ARCHIVE_FILENAME if ctx.archive else None
+            status = ctx.manifest.record(url, response_headers, digest, rel_path, links, assets, archive=archive,
+                                         fingerprint=parsed["fingerprint"], canonical=parsed["canonical"])
+            with ctx.metrics.timer("page_write"):
+                if ctx.archive:
+                    if status != "unchanged" or not ctx.archive.has(url):
+                        await self.writer.run(ctx.archive.add_bytes, url, rel_path,
+                                              response_headers.get("Content-Type"), parsed["html"])
+                elif status != "unchanged" or not await self.writer.run(save_path.exists):
+                    await self.writer.write_bytes(save_path, parsed["html"])
+            with ctx.metrics.timer("index"):
+                await self.writer.run(self.search_index.add, ctx.site_dir.name, url, rel_path,
+                                      parsed["title"], parsed["text"], digest)
+            if ctx.exporter:
+                with ctx.metrics.timer("export"):
+                    await self.writer.run(ctx.exporter.write_page, url, rel_path, parsed["title"], parsed["chunks"])
                     
-                return str(save_path.relative_to(self.site_dir))
+            return rel_path
                 
         except Exception as e:
             logger.warning(f"Error processing {url}: {str(e)}")
             return None
 
-    async def _handle_assets(self, session: aiohttp.ClientSession, soup: BeautifulSoup, base_url: str):
-        """Download and update page assets"""
-        for tag, attr in [("link", "href"), ("script", "src"), ("img", "src")]:
-            for elem in soup.find_all(tag, {attr: True}):
-                src = elem[attr]
-                if src.startswith(("data:", "blob:", "javascript:", "#", "mailto:")):
+    async def _fetch_page(self, ctx: CrawlContext, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Request a page, conditionally when a saved copy can be reused
+
+        Returns:
+            {"not_modified", "body", "encoding", "url" (after redirects), "headers"},
+            or None if the page failed or is out of bounds
+        """
+        headers = await self._conditional_headers(ctx, url)
+        async with ctx.client.get(url, headers=headers) as response:
+            not_modified = response.status == 304 and bool(headers)
+            if not not_modified and response.status != 200:
+                logger.warning(f"Failed to get {url}: {response.status}")
+                if response.status in GONE_STATUSES:
+                    ctx.manifest.mark_gone(url)
+                return None
+                
+            with ctx.metrics.timer("page_body"):
+                body = b"" if not_modified else await self._read_page_body(ctx, url, response)
+            if body is None:
+                return None
+            ctx.bytes_downloaded += len(body)
+            ctx.metrics.count("page_bytes", len(body))
+            # Resolve relative links against where we actually ended up after redirects
+            return {"not_modified": not_modified, "body": body, "encoding": response.charset,
+                    "url": str(response.url), "headers": response.headers}
+
+    async def _parse_fetched(self, ctx: CrawlContext, fetched: Dict[str, Any]) -> Dict[str, Any]:
+        """Parse and rewrite a fetched page in a worker process"""
+        with ctx.metrics.timer("parse"):
+            return await self.parse_pool.parse(fetched["body"], fetched["url"], ctx.current_domain,
+                                               fetched["encoding"], text=True, chunk_tokens=ctx.chunk_tokens,
+                                               dedup=ctx.dedup is not None)
+
+    def _enqueue_links(self, ctx: CrawlContext, url: str, links: List[str], nav_links: List[str], depth: int):
+        """Queue the links of a page at depth, its navigation and TOC links ahead of the rest"""
+        ctx.followed[url] = (links, nav_links)
+        depth = min(depth, ctx.page_depths.get(url, depth))
+        navigation = set(ctx.canonical_list(nav_links))
+        for link in links:
+            self._enqueue(ctx, link, depth + 1, link_priority(link, link in navigation))
+
+    async def _read_page_body(self, ctx: CrawlContext, url: str, response) -> Optional[bytes]:
+        """Read a page body unless its content type or size is out of bounds"""
+        if not self._acceptable_type(ctx, url, response):
+            return None
+        cap = ctx.size_cap(asset=False)
+        if ctx.too_large(response.content_length, asset=False):
+            ctx.skipped["too_large"] += 1
+            logger.warning(f"Skipping {url}: {response.content_length} bytes exceeds size cap")
+            return None
+        if cap is None:
+            return await response.read()
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            size += len(chunk)
+            if size > cap:
+                ctx.skipped["too_large"] += 1
+                logger.warning(f"Skipping {url}: body exceeds size cap of {cap} bytes")
+                return None
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _acceptable_type(self, ctx: CrawlContext, url: str, response) -> bool:
+        """Whether a response's Content-Type is allowed, counting it when not"""
+        content_type = response.headers.get("Content-Type")
+        if ctx.scope.allows_type(content_type):
+            return True
+        ctx.skipped["content_type"] += 1
+        logger.info(f"Skipping {url}: content type {content_type} is not allowed")
+        return False
+
+    def _check_duplicate(self, ctx: CrawlContext, url: str, parsed: Dict[str, Any]) -> bool:
+        """
+        Whether a fetched page duplicates one already kept, updating the duplicate stats
+
+        Also notes the page's canonical link, and feeds the subtree pruner.
+        """
+        canonical = parsed["canonical"]
+        if canonical:
+            canonical = parsed["canonical"] = ctx.canonicalizer.canonicalize(canonical)
+            if canonical != url:
+                ctx.duplicates["canonical_links"] += 1
+        if ctx.dedup is None:
+            return False
+        fingerprint = parsed["fingerprint"]
+        duplicate = ctx.dedup.check(url, fingerprint["text_hash"], fingerprint["simhash"])
+        if ctx.pruner:
+            pruned = ctx.pruner.observe(url, duplicate is not None)
+            if pruned:
+                logger.info(f"Pruning {pruned}: its pages keep duplicating pages already saved")
+        if duplicate is None:
+            return False
+        kind, original = duplicate
+        ctx.duplicates[kind] += 1
+        ctx.duplicate_of[url] = original
+        logger.info(f"Skipping {url}: {kind} duplicate of {original}")
+        return True
+
+    async def _reuse_page(self, ctx: CrawlContext, url: str, depth: int) -> str:
+        """Keep the saved copy of an unchanged page and follow its recorded links"""
+        entry = ctx.manifest.not_modified(url)
+        if ctx.dedup:
+            ctx.dedup.add(url, entry.get("text_hash"), entry.get("simhash"))
+        self._enqueue_links(ctx, url, entry.get("links", []), [], depth)
+        # Revalidate its assets through the registry; shared ones cost one request per crawl
+        await self._handle_assets(ctx, entry.get("assets", []))
+        await self._refresh_saved_page(ctx, url, entry)
+        return entry["path"]
+
+    async def _refresh_saved_page(self, ctx: CrawlContext, url: str, entry: Dict[str, Any]):
+        """
+        Bring the search index and chunk export up to date for an unchanged page
+
+        Its previous chunks are copied over as they are; the saved copy is
+        only re-read when the index or the previous export lacks the page.
+        """
+        try:
+            needs_index = not await self.writer.run(self.search_index.has, url, entry.get("hash"))
+            needs_chunks = bool(ctx.exporter) and not await self.writer.run(ctx.exporter.copy_previous, url)
+            if not needs_index and not needs_chunks:
+                return
+            body = await self._read_saved(ctx, url, entry)
+            extracted = await self.parse_pool.extract_text(body, chunk_tokens=ctx.chunk_tokens if needs_chunks else None)
+            if needs_index:
+                await self.writer.run(self.search_index.add, ctx.site_dir.name, url, entry["path"],
+                                      extracted["title"], extracted["text"], entry.get("hash"))
+            if needs_chunks:
+                await self.writer.run(ctx.exporter.write_page, url, entry["path"],
+                                      extracted["title"], extracted["chunks"])
+        except Exception as e:
+            logger.warning(f"Could not index {url}: {str(e)}")
+
+    async def _unchanged_by_lastmod(self, ctx: CrawlContext, url: str) -> bool:
+        """Whether the sitemap's lastmod is no newer than the one recorded with the saved copy"""
+        hint = parse_lastmod(ctx.lastmod_hints.get(url))
+        entry = ctx.manifest.get(url)
+        if hint is None or not entry or not entry.get("path"):
+            return False
+        recorded = parse_lastmod(entry.get("lastmod"))
+        if recorded is None or hint > recorded or not self._stored_alike(ctx, url, entry):
+            return False
+        return await self.writer.run(local_copy(entry, ctx.site_dir).exists)
+
+    def _stored_alike(self, ctx: CrawlContext, url: str, entry: Dict[str, Any]) -> bool:
+        """Whether the previous crawl stored url the way this crawl does (files vs archive)"""
+        if ctx.archive:
+            return bool(entry.get("archive")) and ctx.archive.has(url)
+        return not entry.get("archive")
+
+    async def _conditional_headers(self, ctx: CrawlContext, url: str) -> Dict[str, str]:
+        """Validators from the manifest, unless the previous copy can't be reused by this crawl"""
+        entry = ctx.manifest.get(url)
+        if not entry or not self._stored_alike(ctx, url, entry):
+            return {}
+        # Checks that the local copy still exists, so it runs on the writer pool
+        return await self.writer.run(ctx.manifest.conditional_headers, url, ctx.site_dir)
+
+    async def _relink_skipped(self, ctx: CrawlContext):
+        """Point saved pages' links to skipped duplicates and pruned pages at what exists instead"""
+        pruned = ctx.pruner.pruned if ctx.pruner else []
+        if not ctx.duplicate_of and not pruned:
+            return
+        for url, entry in list(ctx.manifest.entries.items()):
+            targets = skipped_link_targets(entry.get("links", ()), ctx.duplicate_of, pruned, ctx.manifest.entries)
+            if not targets:
+                continue
+            try:
+                body = await self._read_saved(ctx, url, entry)
+                relinked = relink_page(body, targets)
+                if relinked == body:
                     continue
+                if ctx.archive:
+                    await self.writer.run(ctx.archive.add_bytes, url, entry["path"],
+                                          ctx.archive.index[url]["mime"], relinked)
+                else:
+                    await self.writer.write_bytes(ctx.site_dir / entry["path"], relinked)
+            except Exception as e:
+                logger.warning(f"Could not relink {url}: {str(e)}")
+
+    async def _read_saved(self, ctx: CrawlContext, url: str, entry: Dict[str, Any]) -> bytes:
+        """Saved body of an unchanged page, from the archive or the site directory"""
+        if ctx.archive:
+            return await self.writer.run(ctx.archive.read, url)
+        return await self.writer.run((ctx.site_dir / entry["path"]).read_bytes)
+
+    async def _handle_assets(self, ctx: CrawlContext, asset_urls: List[str]):
+        """Download a page's assets in parallel; the registry collapses repeats"""
+        results = await asyncio.gather(
+            *(self._fetch_asset(ctx, full_url) for full_url in asset_urls),
+            return_exceptions=True
+        )
+        for full_url, result in zip(asset_urls, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Asset error ({full_url}): {str(result)}")
+
+    async def _fetch_asset(self, ctx: CrawlContext, url: str) -> Optional[Path]:
+        """Return the local path of an asset, downloading it at most once per crawl"""
+        # Shield so a cancelled page does not cancel a download other pages are waiting on
+        return await asyncio.shield(self._asset_task(ctx, url))
+
+    def _asset_task(self, ctx: CrawlContext, url: str) -> asyncio.Future:
+        """
+        The registry's download task for an asset, started if it is new
+
+        An asset another shard owns is sent to it; its site path is known
+        up front, so the page does not wait for the download.
+        """
+        key = ctx.canonicalizer.canonicalize(url)
+        if not self._owns(ctx, key):
+            ctx.shard.send_asset(key)
+            handed_off = asyncio.get_running_loop().create_future()
+            handed_off.set_result(self._get_asset_path(ctx, key))
+            return handed_off
+        task = ctx.assets.get(key)
+        if task is None:
+            task = asyncio.create_task(self._download_asset(ctx, key))
+            ctx.assets[key] = task
+        return task
+
+    def _schedule_assets(self, ctx: CrawlContext, asset_urls: List[str]):
+        """
+        Start downloading assets a stylesheet references without waiting for them
+
+        Stylesheets can import each other in cycles, so they never wait on
+        their own dependencies; the crawl settles every pending asset before
+        it finishes.
+        """
+        for url in asset_urls:
+            self._asset_task(ctx, url)
+
+    async def _download_asset(self, ctx: CrawlContext, url: str) -> Optional[Path]:
+        """Stream a single asset to disk, bounded by the asset semaphore"""
+        async with ctx.asset_semaphore:
+            try:
+                rel_path = self._get_asset_path(ctx, url)
+                if not rel_path:
+                    return None
+                if not ctx.scope.allows_asset(url):
+                    ctx.skipped["out_of_scope"] += 1
+                    return None
+                if ctx.over_budget():
+                    ctx.skipped["over_budget"] += 1
+                    return None
                     
-                try:
-                    full_url = urljoin(base_url, src)
-                    if urlparse(full_url).netloc != self.current_domain:
-                        continue
+                headers = await self._conditional_headers(ctx, url)
+                async with ctx.client.get(url, headers=headers) as response:
+                    if response.status == 304 and headers:
+                        entry = ctx.manifest.not_modified(url)
+                        # An unchanged stylesheet still has its references revalidated
+                        self._schedule_assets(ctx, entry.get("assets", []))
+                        return Path(entry["path"])
+                    if response.status != 200:
+                        logger.warning(f"Failed to get asset {url}: {response.status}")
+                        if response.status in GONE_STATUSES:
+                            ctx.manifest.mark_gone(url)
+                        return None
+                    if not self._acceptable_type(ctx, url, response):
+                        return None
+                    if ctx.too_large(response.content_length):
+                        ctx.skipped["too_large"] += 1
+                        logger.warning(f"Skipping asset {url}: {response.content_length} bytes exceeds size cap")
+                        return None
                         
-                    async with session.get(full_url) as response:
-                        if response.status == 200:
-                            content = await response.read()
-                            save_path = self._save_asset(full_url, content)
-                            if save_path:
-                                elem[attr] = str(save_path)
-                except Exception as e:
-                    logger.warning(f"Asset error ({src}): {str(e)}")
-
-    async def _process_links(self, session: aiohttp.ClientSession, soup: BeautifulSoup, url: str, depth: int):
-        """Process and update page links"""
-        for a in soup.find_all("a", href=True):
-            href = a["href"]
-            if href.startswith(("#", "mailto:", "tel:", "javascript:")):
-                continue
-                
-            try:
-                full_url = urljoin(url, href)
-                if urlparse(full_url).netloc == self.current_domain:
-                    if new_path := await self._process_page(session, full_url, depth + 1):
-                        a["href"] = f"/{new_path}"
+                    with ctx.metrics.timer("asset_body"):
+                        temp = await self.writer.stream_to_temp(
+                            response.content.iter_chunked(CHUNK_SIZE),
+                            self.blobs.tmp_dir,
+                            ctx.size_cap()
+                        )
+                    response_headers = response.headers
+                    final_url = str(response.url)
+                    
+                if temp is None:
+                    ctx.skipped["too_large"] += 1
+                    logger.warning(f"Skipping asset {url}: body exceeds size cap of {ctx.size_cap()} bytes")
+                    return None
+                tmp_path, digest, size = temp
+                ctx.bytes_downloaded += size
+                ctx.metrics.count("asset_bytes", size)
+                references = None
+                if self._is_stylesheet(rel_path, response_headers):
+                    with ctx.metrics.timer("stylesheet_rewrite"):
+                        digest, references = await self._rewrite_stylesheet(ctx, final_url, rel_path, tmp_path)
+                with ctx.metrics.timer("asset_write"):
+                    saved = await self._save_asset(ctx, url, rel_path, tmp_path, digest, response_headers,
+                                                   references)
+                if references:
+                    self._schedule_assets(ctx, references)
+                return saved
             except Exception as e:
-                logger.warning(f"Link error ({href}): {str(e)}")
+                logger.warning(f"Asset error ({url}): {str(e)}")
+                return None
+
+    def _is_stylesheet(self, rel_path: Path, headers) -> bool:
+        content_type = headers.get("Content-Type") or ""
+        return rel_path.suffix.lower() == ".css" or content_type.split(";", 1)[0].strip().lower() == "text/css"
+
+    async def _rewrite_stylesheet(self, ctx: CrawlContext, base_url: str, rel_path: Path,
+                                  tmp_path: Path) -> Tuple[str, List[str]]:
+        """
+        Point a streamed stylesheet's url() and @import references at local copies, in place
+
+        Returns:
+            (digest of the rewritten stylesheet, canonical URLs of the assets it references)
+        """
+        try:
+            body = await self.writer.run(tmp_path.read_bytes)
+            rewritten = await self.parse_pool.rewrite_stylesheet(body, base_url, ctx.current_domain,
+                                                                 rel_path.as_posix())
+            await self.writer.run(tmp_path.write_bytes, rewritten["css"])
+        except BaseException:
+            await asyncio.shield(self.writer.discard(tmp_path))
+            raise
+        return content_hash(rewritten["css"]), ctx.canonical_list(rewritten["assets"])
 
-    def _save_asset(self, url: str, content: bytes) -> Optional[Path]:
-        """Save an asset file"""
+    async def _save_asset(self, ctx: CrawlContext, url: str, rel_path: Path, tmp_path: Path, digest: str,
+                          headers, references: Optional[List[str]] = None) -> Optional[Path]:
+        """
+        Store a streamed asset in the blob store and reference it from the site
+
+        Plain blobs are hardlinked at the asset's site path; compressed ones
+        are decompressed there, since pages link to that path, and also
+        referenced from the manifest. A stylesheet's references are
+        recorded with it, so an unchanged stylesheet can revalidate them.
+        """
         try:
-            # Get clean filename from URL
-            path = urlparse(url).path.lstrip("/")
-            if not path:
-                return None
-                
-            filename = clean_filename(unquote(path))
-            
-            # Determine asset type and directory
-            if url.endswith((".css", ".scss")):
-                asset_dir = "css"
-            elif url.endswith((".js", ".mjs")):
-                asset_dir = "js"
-            elif url.endswith((".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp")):
-                asset_dir = "images"
-            elif url.endswith((".woff", ".woff2", ".ttf", ".eot")):
-                asset_dir = "fonts"
+            if ctx.archive:
+                return await self._archive_asset(ctx, url, rel_path, tmp_path, digest, headers, references)
+            full_path = ctx.site_dir / rel_path
+            blob, new = await self.writer.run(self.blobs.put, tmp_path, digest, rel_path.name)
+            if not new:
+                ctx.assets_deduplicated += 1
+            await self.writer.run(self.blobs.extract, blob, full_path)
+            if blob.name == digest:
+                ctx.manifest.record(url, headers, digest, str(rel_path), assets=references)
             else:
-                asset_dir = "other"
-                
-            # Create relative asset path ensuring it's under the configured directory
-            rel_path = Path("assets") / asset_dir / filename
-            full_path = self.site_dir / rel_path
+                ctx.manifest.record(url, headers, digest, str(rel_path), assets=references,
+                                    blob=relative_to_site(blob, ctx.site_dir))
+            return rel_path
+            
+        except Exception as e:
+            await self.writer.discard(tmp_path)
+            logger.warning(f"Failed to save asset {url}: {str(e)}")
+            return None
+
+    async def _archive_asset(self, ctx: CrawlContext, url: str, rel_path: Path, tmp_path: Path,
+                             digest: str, headers, references: Optional[List[str]] = None) -> Path:
+        """Append a streamed asset to the site archive unless it is unchanged and already there"""
+        status = ctx.manifest.record(url, headers, digest, str(rel_path), assets=references,
+                                     archive=ARCHIVE_FILENAME)
+        if status == "unchanged" and ctx.archive.has(url):
+            await self.writer.discard(tmp_path)
+        else:
+            await self.writer.run(ctx.archive.add_file, url, rel_path.as_posix(),
+                                  headers.get("Content-Type"), tmp_path)
+        return rel_path
+
+    def _get_asset_path(self, ctx: CrawlContext, url: str) -> Optional[Path]:
+        """Get the site-relative path an asset is saved to"""
+        try:
+            rel_path = asset_path(url)
+            if not rel_path:
+                return None
+            full_path = ctx.site_dir / rel_path
             
             # Ensure we're not trying to write outside the site directory
-            if not str(full_path).startswith(str(self.site_dir)):
+            if not str(full_path).startswith(str(ctx.site_dir)):
                 logger.warning(f"Attempted to write asset outside site directory: {full_path}")
                 return None
-            
-            # Ensure parent directory exists
-            full_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            # Write content
-            with open(full_path, "wb") as f:
-                f.write(content)
                 
             return rel_path
             
         except Exception as e:
-            logger.warning(f"Failed to save asset {url}: {str(e)}")
+            logger.warning(f"Invalid asset path for {url}: {str(e)}")
             return None
 
-    def _get_save_path(self, url: str) -> Optional[Path]:
+    def _get_save_path(self, ctx: CrawlContext, url: str) -> Optional[Path]:
         """Get file system path for saving page"""
         try:
-            # Get clean path from URL
-            path = urlparse(url).path.lstrip("/")
-            if not path:
-                path = "index.html"
-            elif not path.endswith((".html", ".htm")):
-                path = f"{path}.html"
-                
-            # Clean the path and create Path object
-            clean_path = clean_filename(unquote(path))
-            save_path = self.site_dir / clean_path
+            save_path = ctx.site_dir / page_path(url)
             # user is able to save wherever they write in their app json- this is unneeded:
             # Safety check - ensure we're not trying to write outside site directory
-            if not str(save_path).startswith(str(self.site_dir)):
+            if not str(save_path).startswith(str(ctx.site_dir)):
                 logger.warning(f"Attempted to save page outside site directory: {save_path}")
                 return None
                 
@@ -299,4 +1168,4 @@ class WebsiteDownloader:
             
         except Exception as e:
             logger.warning(f"Invalid save path for {url}: {str(e)}")
-            return None
\ No newline at end of file
+            return None
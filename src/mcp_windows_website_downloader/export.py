@@ -0,0 +1,173 @@
+"""
+Streaming export of RAG-ready text chunks, one JSONL file per site.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHUNKS_FILENAME = "chunks.jsonl"
+
+
+def chunk_id(url: str, headings: List[str], ordinal: int) -> str:
+    """
+    Stable id for a chunk
+
+    Derived from the page URL, the heading path and the chunk's position
+    within that section, so editing one section of a page leaves the ids
+    of the others unchanged.
+    """
+    key = "\0".join([url, " > ".join(headings), str(ordinal)])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+class ChunkExporter:
+    """
+    Writes a site's chunks to chunks.jsonl as pages complete
+
+    Records stream into chunks.jsonl.part, one contiguous block of lines
+    per page, and the part file replaces chunks.jsonl when the crawl
+    finishes. Pages that did not change since the last crawl copy their
+    block from the previous file instead of being re-chunked. An
+    interrupted crawl keeps its part file so a resumed crawl can append
+    to it. All methods block, so the crawl runs them on the writer pool.
+    """
+
+    def __init__(self, site_dir: Path, part_name: Optional[str] = None):
+        self.path = site_dir / CHUNKS_FILENAME
+        self.part_path = site_dir / (part_name or CHUNKS_FILENAME + ".part")
+        self.count = 0
+        self._previous: Dict[str, Tuple[int, int]] = {}  # URL -> byte range in chunks.jsonl
+        self._handle = None
+        self._resumed = False
+        self._lock = threading.Lock()
+
+    def open(self, resume: bool = False):
+        """Index the previous export and start (or, when resuming, continue) the part file"""
+        self._previous = _scan(self.path)
+        self._resumed = resume and self.part_path.exists()
+        if self._resumed:
+            _truncate_partial_line(self.part_path)
+            self._handle = open(self.part_path, "ab")
+        else:
+            self._handle = open(self.part_path, "wb")
+
+    def write_page(self, url: str, path: str, title: str, chunks: List[Dict[str, Any]]):
+        """Append one page's chunks"""
+        ordinals: Dict[Tuple[str, ...], int] = {}
+        lines = []
+        for chunk in chunks:
+            section = tuple(chunk["headings"])
+            ordinal = ordinals.get(section, 0)
+            ordinals[section] = ordinal + 1
+            record = {
+                "id": chunk_id(url, chunk["headings"], ordinal),
+                "url": url,
+                "path": path,
+                "title": title,
+                "headings": chunk["headings"],
+                "text": chunk["text"],
+                "tokens": chunk["tokens"],
+                "hash": hashlib.sha256(chunk["text"].encode("utf-8")).hexdigest()[:16]
+            }
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        self._append("".join(lines).encode("utf-8"), len(lines))
+
+    def copy_previous(self, url: str) -> bool:
+        """Carry an unchanged page's chunks over from the last export; False if it had none"""
+        span = self._previous.get(url)
+        if span is None:
+            return False
+        with open(self.path, "rb") as f:
+            f.seek(span[0])
+            block = f.read(span[1] - span[0])
+        self._append(block, block.count(b"\n"))
+        return True
+
+    def carry_forward(self, urls: List[str]):
+        """Copy the previous chunks of pages this crawl kept without visiting"""
+        for url in urls:
+            self.copy_previous(url)
+
+    def _append(self, block: bytes, lines: int):
+        with self._lock:
+            # One write per page keeps each page's lines contiguous
+            self._handle.write(block)
+            self._handle.flush()
+            self.count += lines
+
+    def finish(self):
+        """Replace chunks.jsonl with this crawl's export"""
+        self.close()
+        if self._resumed:
+            # Pages re-processed after a resume appear twice; keep their last block
+            self.count = _compact(self.part_path)
+        os.replace(self.part_path, self.path)
+
+    def close(self):
+        with self._lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+
+def _scan(path: Path) -> Dict[str, Tuple[int, int]]:
+    """Byte range of every page's block of lines in an export"""
+    spans: Dict[str, Tuple[int, int]] = {}
+    if not path.exists():
+        return spans
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                url = json.loads(line)["url"]
+            except (ValueError, KeyError):
+                offset += len(line)
+                continue
+            start = spans[url][0] if url in spans else offset
+            offset += len(line)
+            spans[url] = (start, offset)
+    return spans
+
+
+def _truncate_partial_line(path: Path):
+    """Drop a line left half-written by a crash"""
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+
+
+def _compact(path: Path) -> int:
+    """Rewrite an export keeping only the last block of lines per page; returns the line count"""
+    last: Dict[str, int] = {}
+    block = 0
+    previous_url = None
+    with open(path, "rb") as f:
+        for line in f:
+            url = json.loads(line)["url"]
+            if url != previous_url:
+                block += 1
+                previous_url = url
+            last[url] = block
+    tmp_path = path.with_suffix(".compact")
+    count = 0
+    block = 0
+    previous_url = None
+    with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+        for line in src:
+            url = json.loads(line)["url"]
+            if url != previous_url:
+                block += 1
+                previous_url = url
+            if last[url] == block:
+                dst.write(line)
+                count += 1
+    os.replace(tmp_path, path)
+    return count
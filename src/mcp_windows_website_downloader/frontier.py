@@ -0,0 +1,116 @@
+"""
+Crawl frontier ordering: documentation framework detection and link priorities.
+"""
+import asyncio
+import itertools
+import logging
+import re
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Frontier tiers, fetched lowest first; depth then discovery order break ties
+NAV_PRIORITY = 0
+CONTENT_PRIORITY = 1
+LOW_PRIORITY = 2
+
+
+def _class_xpath(tag: str, name: str) -> str:
+    return f"//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')]"
+
+
+# Markers identifying the generator of a page, checked in order
+FRAMEWORK_MARKERS = {
+    "sphinx": [_class_xpath("div", "sphinxsidebar"), _class_xpath("*", "wy-nav-side"),
+               _class_xpath("*", "sidebar-tree")],
+    "mkdocs": [_class_xpath("nav", "md-nav")],
+    "docusaurus": [_class_xpath("nav", "menu"), "//*[@id='__docusaurus']"],
+}
+# Where each framework puts its navigation and tables of contents
+FRAMEWORK_NAV_XPATHS = {
+    "sphinx": [_class_xpath("div", "sphinxsidebar"), _class_xpath("div", "toctree-wrapper"),
+               _class_xpath("*", "wy-menu"), _class_xpath("*", "sidebar-tree")],
+    "mkdocs": [_class_xpath("nav", "md-nav"), _class_xpath("*", "md-tabs")],
+    "docusaurus": [_class_xpath("nav", "menu"), _class_xpath("*", "table-of-contents")],
+}
+GENERIC_NAV_XPATHS = ["//nav", "//*[@role='navigation']", _class_xpath("*", "toc")]
+# Index, search, changelog and source-listing pages: fetched after the docs themselves
+LOW_VALUE_PATH = re.compile(
+    r"(?:^|/)(?:genindex|py-modindex|modindex|search|searchindex|changelog|changes|history|"
+    r"release-notes|releases|whatsnew|news|_modules|_sources|tags?|archives?|404)"
+    r"(?:[-_.][\w.-]*)?(?:/|$)"
+)
+DOCS_PATH_HINTS = ["/docs/", "/documentation/", "/guide/", "/tutorial/"]
+
+
+def detect_framework(tree) -> Optional[str]:
+    """The documentation generator that built a page ("sphinx", "mkdocs", "docusaurus"), if known"""
+    for content in tree.xpath("//meta[@name='generator']/@content"):
+        for name in FRAMEWORK_MARKERS:
+            if name in content.lower():
+                return name
+    for name, xpaths in FRAMEWORK_MARKERS.items():
+        if any(tree.xpath(xpath) for xpath in xpaths):
+            return name
+    return None
+
+
+def nav_links(tree, framework: Optional[str] = None) -> List[str]:
+    """Unresolved hrefs of the links in a page's navigation and tables of contents"""
+    xpaths = FRAMEWORK_NAV_XPATHS.get(framework, []) + GENERIC_NAV_XPATHS
+    hrefs = tree.xpath(" | ".join(f"{xpath}//a/@href" for xpath in xpaths))
+    return list(dict.fromkeys(href.strip() for href in hrefs if href.strip() and not href.startswith("#")))
+
+
+def link_priority(url: str, in_nav: bool = False) -> int:
+    """
+    Frontier tier of a link
+
+    Low-value pages (genindex, search, changelogs, ...) come last even when
+    the sidebar links to them; other navigation and TOC links come first.
+    """
+    if LOW_VALUE_PATH.search(urlparse(url).path.lower()):
+        return LOW_PRIORITY
+    return NAV_PRIORITY if in_nav else CONTENT_PRIORITY
+
+
+def recommended_depth(url: str, framework: Optional[str], has_nav: bool) -> int:
+    """Crawl depth for a site, from what the analysis of its start page found"""
+    if framework:
+        # Known documentation sites usually need more depth
+        return 4
+    path = urlparse(url).path.lower()
+    if has_nav and any(hint in path for hint in DOCS_PATH_HINTS):
+        # Looks like structured documentation
+        return 3
+    # Small, large or unknown site structure: be conservative
+    return 2
+
+
+class CrawlFrontier(asyncio.PriorityQueue):
+    """
+    Pages waiting to be crawled, best first
+
+    Ordered by priority tier, then depth, then discovery order, so within
+    a tier the crawl stays breadth-first. With a page budget the docs
+    reachable from the navigation arrive before everything else, and a
+    partial crawl holds the most useful pages.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._order = itertools.count()
+
+    def push(self, url: str, depth: int, priority: int = CONTENT_PRIORITY):
+        self.put_nowait((priority, depth, next(self._order), url))
+
+    @property
+    def idle(self) -> bool:
+        """Whether every page taken off the frontier has been finished"""
+        return self.empty() and self._unfinished_tasks == 0
+
+    async def pop(self) -> Tuple[str, int]:
+        """Next (url, depth) to crawl, waiting for one if the frontier is empty"""
+        _, depth, _, url = await self.get()
+        return url, depth
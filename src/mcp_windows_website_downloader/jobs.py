@@ -0,0 +1,164 @@
+"""
+Background download jobs for the MCP server.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from .downloader import WebsiteDownloader
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_JOBS = 3
+MAX_FINISHED_JOBS = 100
+FINISHED_STATES = ("completed", "failed", "cancelled")
+
+# Called with the job whenever its progress or status changes
+JobListener = Callable[["DownloadJob"], Awaitable[None]]
+
+
+class DownloadJob:
+    """One site download tracked by the job manager"""
+
+    def __init__(self, url: str, options: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.options = options
+        self.status = "queued"
+        self.progress: Dict[str, Any] = {}
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Status report for the download_status and list_downloads tools"""
+        report = {
+            "job_id": self.id,
+            "url": self.url,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            **self.progress
+        }
+        if self.result is not None:
+            report["result"] = self.result
+        if self.error is not None:
+            report["error"] = self.error
+        return report
+
+
+class JobManager:
+    """Runs download jobs in the background, at most max_jobs at a time"""
+
+    def __init__(self, downloader: WebsiteDownloader, max_jobs: int = DEFAULT_MAX_JOBS):
+        self.downloader = downloader
+        self.max_jobs = max_jobs
+        self.jobs: "OrderedDict[str, DownloadJob]" = OrderedDict()
+        self._slots = asyncio.Semaphore(max_jobs)
+        self._tasks = set()
+
+    def submit(self, url: str, options: Optional[Dict[str, Any]] = None,
+               listener: Optional[JobListener] = None) -> DownloadJob:
+        """Queue a download and return its job right away"""
+        job = DownloadJob(url, options or {})
+        self.jobs[job.id] = job
+        self._prune()
+        job.task = asyncio.create_task(self._run(job, listener))
+        self._tasks.add(job.task)
+        job.task.add_done_callback(self._tasks.discard)
+        logger.info(f"Queued job {job.id} for {url}")
+        return job
+
+    async def wait(self, job: DownloadJob) -> DownloadJob:
+        """Wait for a job to finish"""
+        if job.task is not None:
+            await asyncio.shield(job.task)
+        return job
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        return self.jobs.get(job_id)
+
+    def list(self) -> List[DownloadJob]:
+        return list(self.jobs.values())
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; False if it is unknown or already finished"""
+        job = self.jobs.get(job_id)
+        if job is None or job.done or job.task is None:
+            return False
+        job.task.cancel()
+        return True
+
+    async def shutdown(self):
+        """Cancel every unfinished job and wait for them to stop"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: DownloadJob, listener: Optional[JobListener]):
+        """Wait for a slot, run the download and record how it ended"""
+        changed = asyncio.Event()
+
+        def on_progress(progress: Dict[str, Any]):
+            job.progress = progress
+            changed.set()
+
+        reporter = asyncio.create_task(self._report(job, listener, changed)) if listener else None
+        try:
+            async with self._slots:
+                job.status = "running"
+                job.started_at = time.time()
+                changed.set()
+                result = await self.downloader.download(job.url, on_progress=on_progress, **job.options)
+            job.result = result
+            if result.get("status") == "success":
+                job.status = "completed"
+            else:
+                job.status = "failed"
+                job.error = result.get("error")
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            logger.info(f"Job {job.id} cancelled")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Job {job.id} failed: {str(e)}", exc_info=True)
+        finally:
+            job.finished_at = time.time()
+            if reporter:
+                reporter.cancel()
+                await asyncio.gather(reporter, return_exceptions=True)
+                await self._notify(listener, job)
+
+    async def _report(self, job: DownloadJob, listener: JobListener, changed: asyncio.Event,
+                      interval: float = 1.0):
+        """Forward progress to the listener, at most once per interval"""
+        while True:
+            await changed.wait()
+            changed.clear()
+            await self._notify(listener, job)
+            await asyncio.sleep(interval)
+
+    async def _notify(self, listener: JobListener, job: DownloadJob):
+        try:
+            await listener(job)
+        except Exception as e:
+            logger.warning(f"Progress listener failed for job {job.id}: {str(e)}")
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond MAX_FINISHED_JOBS"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
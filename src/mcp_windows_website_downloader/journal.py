@@ -0,0 +1,146 @@
+"""
+Append-only crawl journal used to resume an interrupted download.
+"""
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILENAME = "crawl_journal.sqlite"
+CHECKPOINT_INTERVAL = 5.0  # seconds between flushes of buffered events
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    depth INTEGER,
+    data TEXT
+)
+"""
+
+
+class CrawlJournal:
+    """
+    Append-only log of a crawl's frontier and finished work
+
+    Events are buffered in memory by the crawl and written in one
+    transaction per checkpoint, so the crawl never waits on SQLite. The
+    database runs in WAL mode: a crash loses at most the events since the
+    last checkpoint, never the journal itself.
+
+    Event kinds:
+        start   - the crawl's start URL, with its depth limit and framework in data
+        queued  - a URL entered the frontier at depth, with its priority in data
+        done    - a page finished; data holds whether it was saved
+        record  - a manifest entry (page or asset) with its change status
+    """
+
+    def __init__(self, site_dir: Path, filename: str = JOURNAL_FILENAME):
+        self.path = site_dir / filename
+        self._buffer: List[Tuple[str, str, Optional[int], Optional[str]]] = []
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Used from the writer pool, one thread at a time under self._lock
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(_SCHEMA)
+        return self._conn
+
+    def start(self, url: str, max_depth: int, framework: Optional[str] = None):
+        self._buffer.append(("start", url, None, json.dumps({"max_depth": max_depth, "framework": framework})))
+
+    def queued(self, url: str, depth: int, priority: Optional[int] = None):
+        data = json.dumps({"priority": priority}) if priority is not None else None
+        self._buffer.append(("queued", url, depth, data))
+
+    def done(self, url: str, saved: bool):
+        self._buffer.append(("done", url, None, json.dumps({"saved": saved})))
+
+    def recorded(self, url: str, entry: Dict[str, Any], status: str):
+        self._buffer.append(("record", url, None, json.dumps({"entry": entry, "status": status})))
+
+    def flush(self):
+        """Write buffered events in one transaction (blocking; run it on the writer pool)"""
+        events, self._buffer = self._buffer, []
+        if not events:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT INTO events (kind, url, depth, data) VALUES (?, ?, ?, ?)", events)
+
+    def reset(self):
+        """Forget any previous crawl"""
+        with self._lock:
+            self._close()
+            for suffix in ("", "-wal", "-shm"):
+                Path(str(self.path) + suffix).unlink(missing_ok=True)
+        self._buffer = []
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def replay(self, url: str) -> Optional["JournalState"]:
+        """
+        Rebuild the state of an interrupted crawl of url
+
+        Returns:
+            The replayed state, or None if there is no journal for this start URL
+        """
+        if not self.path.exists():
+            return None
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT kind, url, depth, data FROM events ORDER BY seq").fetchall()
+        if not rows or rows[0][0] != "start" or rows[0][1] != url:
+            return None
+
+        start = json.loads(rows[0][3])
+        state = JournalState(start["max_depth"], start.get("framework"))
+        for kind, event_url, depth, data in rows[1:]:
+            if kind == "queued":
+                state.queued[event_url] = depth
+                if data:
+                    state.priorities[event_url] = json.loads(data)["priority"]
+            elif kind == "done":
+                state.done.add(event_url)
+                if json.loads(data)["saved"]:
+                    state.saved_pages += 1
+            elif kind == "record":
+                record = json.loads(data)
+                state.entries[event_url] = (record["entry"], record["status"])
+        return state
+
+
+class JournalState:
+    """What an interrupted crawl had seen, finished and recorded"""
+
+    def __init__(self, max_depth: int, framework: Optional[str] = None):
+        self.max_depth = max_depth
+        self.framework = framework  # found by the site analysis, which a resumed crawl skips
+        self.queued: Dict[str, int] = {}  # URL -> depth, in frontier order
+        self.priorities: Dict[str, int] = {}  # URL -> frontier priority, when recorded
+        self.done = set()
+        self.saved_pages = 0
+        self.entries: Dict[str, Tuple[Dict[str, Any], str]] = {}
+
+    @property
+    def frontier(self) -> List[Tuple[str, int, Optional[int]]]:
+        """(url, depth, priority) of the URLs that were queued but never finished"""
+        return [(url, depth, self.priorities.get(url)) for url, depth in self.queued.items()
+                if url not in self.done]
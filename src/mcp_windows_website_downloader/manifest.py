@@ -0,0 +1,190 @@
+"""
+Persistent crawl manifest used for incremental re-crawls.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "crawl_manifest.json"
+
+
+class CrawlManifest:
+    """
+    Records what a crawl fetched so the next crawl can send conditional requests.
+
+    Each entry is keyed by URL and holds the ETag, Last-Modified header,
+    a SHA-256 of the body, the local path it was saved to and, for pages,
+    the in-domain links and assets it referenced (so an unchanged page can
+    still seed the frontier without being re-fetched or re-read) and the
+    sitemap <lastmod> it was listed with, if any.
+    """
+
+    def __init__(self, site_dir: Path, previous: Optional[Dict[str, Dict[str, Any]]] = None,
+                 filename: str = MANIFEST_FILENAME):
+        self.path = site_dir / filename
+        self.previous = previous or {}
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.counts = {"added": 0, "changed": 0, "unchanged": 0}
+        # URLs that answered 404 or 410 during this crawl
+        self.gone: Set[str] = set()
+        # Called with (url, entry, status) for every entry this crawl records
+        self.listener: Optional[Callable[[str, Dict[str, Any], str], None]] = None
+
+    @classmethod
+    def load(cls, site_dir: Path) -> "CrawlManifest":
+        """Load the manifest left by the previous crawl, if any"""
+        path = site_dir / MANIFEST_FILENAME
+        previous = {}
+        if path.exists():
+            try:
+                with open(path, encoding="utf-8") as f:
+                    previous = json.load(f).get("entries", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable manifest {path}: {str(e)}")
+        return cls(site_dir, previous)
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Entry recorded for a URL by the previous crawl"""
+        return self.previous.get(url)
+
+    def conditional_headers(self, url: str, site_dir: Path) -> Dict[str, str]:
+        """If-None-Match / If-Modified-Since headers for a URL whose local copy still exists"""
+        entry = self.previous.get(url)
+        if not entry or not entry.get("path") or not local_copy(entry, site_dir).exists():
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def not_modified(self, url: str) -> Dict[str, Any]:
+        """Carry the previous entry forward after a 304 response"""
+        entry = self.previous[url]
+        self.entries[url] = entry
+        self.counts["unchanged"] += 1
+        if self.listener:
+            self.listener(url, entry, "unchanged")
+        return entry
+
+    def restore(self, url: str, entry: Dict[str, Any], status: str):
+        """Re-apply an entry recorded by an interrupted run of this crawl"""
+        self.entries[url] = entry
+        self.counts[status] += 1
+
+    def record(self, url: str, headers, digest: str, path: str,
+               links: Optional[List[str]] = None, assets: Optional[List[str]] = None,
+               blob: Optional[str] = None, archive: Optional[str] = None,
+               fingerprint: Optional[Dict[str, Optional[str]]] = None,
+               canonical: Optional[str] = None) -> str:
+        """
+        Record a fetched URL
+
+        Args:
+            url: URL that was fetched
+            headers: Response headers (for ETag and Last-Modified)
+            digest: content_hash() of the body
+            path: Site-relative path of the local copy
+            links: In-domain links found on a page
+            assets: Asset URLs referenced by a page
+            blob: Site-relative path of a compressed blob holding the body, when
+                the site directory has no plain copy at path
+            archive: Site-relative path of the archive holding the body, in warc output mode
+            fingerprint: dedup.fingerprint() of the page's text when the crawl checks
+                for duplicates, so a re-crawl that reuses the page can still match
+                duplicates against it
+            canonical: URL from the page's <link rel="canonical">, if any
+
+        Returns:
+            "added", "changed" or "unchanged" compared with the previous crawl
+        """
+        entry = {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "hash": digest,
+            "path": path
+        }
+        if links is not None:
+            entry["links"] = links
+        if assets is not None:
+            entry["assets"] = assets
+        if blob is not None:
+            entry["blob"] = blob
+        if archive is not None:
+            entry["archive"] = archive
+        if fingerprint:
+            entry.update((key, value) for key, value in fingerprint.items() if value)
+        if canonical is not None:
+            entry["canonical"] = canonical
+        self.entries[url] = entry
+
+        old = self.previous.get(url)
+        if old is None:
+            status = "added"
+        elif old.get("hash") == digest:
+            status = "unchanged"
+        else:
+            status = "changed"
+        self.counts[status] += 1
+        if self.listener:
+            self.listener(url, entry, status)
+        return status
+
+    def set_lastmod(self, url: str, lastmod: str):
+        """Remember the sitemap <lastmod> of the version recorded for a URL"""
+        entry = self.entries.get(url)
+        if entry is not None:
+            entry["lastmod"] = lastmod
+
+    def mark_gone(self, url: str):
+        """Note that a URL answered 404 or 410"""
+        self.gone.add(url)
+
+    def carry_forward(self, complete: bool) -> List[str]:
+        """
+        Keep the previous entries of URLs this crawl did not record, unless they are gone
+
+        A URL only counts as removed when it answered 404/410 in a complete
+        crawl (its frontier ran dry without hitting a budget). URLs left out
+        by a budget, the scope or robots rules, or a failed request keep
+        their previous entry, and so their local copy.
+
+        Returns:
+            The URLs carried forward
+        """
+        kept = [url for url in self.previous
+                if url not in self.entries and not (complete and url in self.gone)]
+        for url in kept:
+            self.entries[url] = self.previous[url]
+        return kept
+
+    def removed(self) -> List[str]:
+        """URLs seen by the previous crawl that are not in this crawl's manifest"""
+        return [url for url in self.previous if url not in self.entries]
+
+    def summary(self) -> Dict[str, int]:
+        """Added/changed/unchanged/removed counts for the result"""
+        return {**self.counts, "removed": len(self.removed())}
+
+    def save(self):
+        """Atomically replace the manifest on disk"""
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entries": self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+
+def local_copy(entry: Dict[str, Any], site_dir: Path) -> Path:
+    """Where the saved body of an entry lives: its archive or its file in the site, which pages link to"""
+    return site_dir / (entry.get("archive") or entry["path"])
+
+
+def content_hash(content: bytes) -> str:
+    """SHA-256 hex digest of a response body"""
+    return hashlib.sha256(content).hexdigest()
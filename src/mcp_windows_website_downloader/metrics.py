@@ -0,0 +1,283 @@
+"""
+Crawl instrumentation: request phase timings, stage timers, counters and their exports.
+"""
+import bisect
+import cProfile
+import logging
+import random
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+import aiohttp
+try:
+    import pyinstrument
+except ImportError:  # optional: only needed for profile="pyinstrument"
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the histogram buckets, as exported to Prometheus
+BUCKET_BOUNDS = [0.0005 * 2 ** k for k in range(18)]  # 0.5 ms .. ~65 s
+RESERVOIR_SIZE = 4096  # samples kept per histogram for percentiles
+PERCENTILES = (50, 95, 99)
+METRIC_PREFIX = "website_downloader"
+METRICS_FILENAME = "crawl_metrics.prom"
+PROFILERS = ("cprofile", "pyinstrument")
+PROFILE_FILENAMES = {"cprofile": "crawl_profile.pstats", "pyinstrument": "crawl_profile.html"}
+
+
+class Histogram:
+    """
+    Latency distribution with fixed buckets plus a uniform sample for percentiles
+
+    Memory stays bounded however long the crawl runs: bucket counts are
+    exact, percentiles come from a reservoir of RESERVOIR_SIZE samples.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)  # last one is +Inf
+        self.samples: List[float] = []
+        self._random = random.Random(0)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(value)
+        else:
+            slot = self._random.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.samples[slot] = value
+
+    def merge(self, other: "Histogram"):
+        """Fold another histogram in, keeping each one's share of the reservoir"""
+        if not other.count:
+            return
+        total = self.count + other.count
+        if len(self.samples) + len(other.samples) <= RESERVOIR_SIZE:
+            self.samples = self.samples + other.samples
+        else:
+            keep = round(RESERVOIR_SIZE * self.count / total)
+            self.samples = (self._random.sample(self.samples, min(keep, len(self.samples)))
+                            + self._random.sample(other.samples, min(RESERVOIR_SIZE - keep, len(other.samples))))
+        self.count = total
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def percentile(self, p: float) -> Optional[float]:
+        return _percentile(sorted(self.samples), p)
+
+    def summary(self) -> Dict[str, Any]:
+        summary = {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "min": _rounded(self.min),
+            "max": _rounded(self.max),
+        }
+        ordered = sorted(self.samples)
+        for p in PERCENTILES:
+            summary[f"p{p}"] = _rounded(_percentile(ordered, p))
+        return summary
+
+
+def _percentile(ordered: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted samples"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def _rounded(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 6)
+
+
+class CrawlMetrics:
+    """
+    Timings and counters for one crawl
+
+    Request phases (connection queueing, DNS, connect, time to first
+    byte) come from the aiohttp trace hooks in request_trace_config();
+    crawl stages (body transfer, parse, write, ...) are timed with
+    timer(). Everything is plain in-process bookkeeping on the event
+    loop, cheap enough to leave on for every crawl.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.status_codes: Dict[str, int] = {}
+
+    def observe(self, name: str, seconds: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count_status(self, status: int):
+        key = str(status)
+        self.status_codes[key] = self.status_codes.get(key, 0) + 1
+
+    def merge(self, other: "CrawlMetrics"):
+        """Add another crawl's metrics to these (the shards of one sharded crawl)"""
+        for name, histogram in other.histograms.items():
+            self.histograms.setdefault(name, Histogram()).merge(histogram)
+        for name, value in other.counters.items():
+            self.count(name, value)
+        for status, value in other.status_codes.items():
+            self.status_codes[status] = self.status_codes.get(status, 0) + value
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Time a block (including any awaits inside it) into the named histogram"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self, counters: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """
+        JSON-ready view of the metrics
+
+        Args:
+            counters: Counters kept elsewhere (scheduler stats, duplicates, ...)
+                to report alongside this object's own
+        """
+        return {
+            "counters": {**self.counters, **(counters or {})},
+            "status_codes": dict(sorted(self.status_codes.items())),
+            "timings": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+        }
+
+    def prometheus(self, site: str, counters: Optional[Dict[str, int]] = None) -> str:
+        """Prometheus text exposition format snapshot"""
+        label = f'site="{_escape_label(site)}"'
+        lines = []
+        for name, value in sorted({**self.counters, **(counters or {})}.items()):
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric}{{{label}}} {value}"]
+        if self.status_codes:
+            metric = f"{METRIC_PREFIX}_responses_total"
+            lines.append(f"# TYPE {metric} counter")
+            for status, value in sorted(self.status_codes.items()):
+                lines.append(f'{metric}{{{label},status="{status}"}} {value}')
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f"{METRIC_PREFIX}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket in zip(BUCKET_BOUNDS + [None], histogram.buckets):
+                cumulative += bucket
+                le = "+Inf" if bound is None else repr(round(bound, 6))
+                lines.append(f'{metric}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{metric}_sum{{{label}}} {round(histogram.total, 6)}")
+            lines.append(f"{metric}_count{{{label}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def request_trace_config() -> aiohttp.TraceConfig:
+    """
+    aiohttp trace hooks feeding request phase timings into CrawlMetrics
+
+    One TraceConfig serves the shared session; each request names the
+    crawl it belongs to by passing its CrawlMetrics as trace_request_ctx
+    (RequestScheduler does this). Requests without one are ignored.
+    """
+    config = aiohttp.TraceConfig()
+
+    def mark(name: str):
+        async def hook(session, context, params):
+            setattr(context, name, time.perf_counter())
+        return hook
+
+    def phase(start: str, histogram: str):
+        async def hook(session, context, params):
+            metrics = context.trace_request_ctx
+            started = getattr(context, start, None)
+            if isinstance(metrics, CrawlMetrics) and started is not None:
+                metrics.observe(histogram, time.perf_counter() - started)
+        return hook
+
+    async def on_request_end(session, context, params):
+        metrics = context.trace_request_ctx
+        if isinstance(metrics, CrawlMetrics):
+            metrics.observe("ttfb", time.perf_counter() - context.request_started)
+            metrics.count_status(params.response.status)
+
+    async def on_request_exception(session, context, params):
+        metrics = context.trace_request_ctx
+        if isinstance(metrics, CrawlMetrics):
+            metrics.count("request_exceptions")
+
+    config.on_request_start.append(mark("request_started"))
+    config.on_connection_queued_start.append(mark("queued_started"))
+    config.on_connection_queued_end.append(phase("queued_started", "connection_queued"))
+    config.on_dns_resolvehost_start.append(mark("dns_started"))
+    config.on_dns_resolvehost_end.append(phase("dns_started", "dns"))
+    config.on_connection_create_start.append(mark("connect_started"))
+    config.on_connection_create_end.append(phase("connect_started", "connect"))
+    config.on_request_end.append(on_request_end)
+    config.on_request_exception.append(on_request_exception)
+    return config
+
+
+def check_profiler(profiler: Optional[str]):
+    """Raise ValueError for an unknown or unavailable profiler"""
+    if profiler is None:
+        return
+    if profiler not in PROFILERS:
+        raise ValueError(f"profile must be one of {', '.join(PROFILERS)}")
+    if profiler == "pyinstrument" and pyinstrument is None:
+        raise ValueError("pyinstrument profiling needs the pyinstrument package")
+
+
+class CrawlProfiler:
+    """
+    cProfile or pyinstrument around one crawl, saved into the site directory
+
+    Both profile the whole process, so work from other crawls running at
+    the same time shows up too; parse workers run in other processes and
+    do not. The profile is written as crawl_profile.pstats (cProfile, for
+    pstats or snakeviz) or crawl_profile.html (pyinstrument).
+    """
+
+    def __init__(self, profiler: str, site_dir: Path):
+        check_profiler(profiler)
+        self.profiler = profiler
+        self.path = site_dir / PROFILE_FILENAMES[profiler]
+        self._profile = None
+
+    def start(self):
+        if self.profiler == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._profile = pyinstrument.Profiler(async_mode="disabled")
+            self._profile.start()
+
+    def stop(self) -> Path:
+        """Stop profiling and write the profile; returns its path"""
+        if self.profiler == "cprofile":
+            self._profile.disable()
+            self._profile.dump_stats(str(self.path))
+        else:
+            self._profile.stop()
+            self.path.write_text(self._profile.output_html(), encoding="utf-8")
+        logger.info(f"Crawl profile written to {self.path}")
+        return self.path
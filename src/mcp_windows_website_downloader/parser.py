@@ -0,0 +1,430 @@
+"""
+HTML parse/rewrite stage, run off the event loop in a process pool.
+"""
+import asyncio
+import codecs
+import html
+import logging
+import os
+import posixpath
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+from bs4 import BeautifulSoup
+from bs4.element import Stylesheet
+from .content import extract_document
+from .dedup import fingerprint
+from .utils import page_path, asset_path
+
+logger = logging.getLogger(__name__)
+
+ASSET_ATTRIBUTES = [
+    ("link", "href"), ("script", "src"), ("img", "src"), ("source", "src"),
+    ("video", "src"), ("video", "poster"), ("audio", "src"), ("track", "src")
+]
+SRCSET_TAGS = ["img", "source"]
+SKIPPED_ASSET_PREFIXES = ("data:", "blob:", "javascript:", "#", "mailto:")
+SKIPPED_LINK_PREFIXES = ("#", "mailto:", "tel:", "javascript:")
+# <link rel> values that point at pages rather than assets
+PAGE_LINK_RELS = {"canonical"}
+# <link rel> values whose href is an asset the page needs; others (alternate
+# feeds, search descriptions, prev/next) are left alone
+ASSET_LINK_RELS = {
+    "stylesheet", "icon", "shortcut", "apple-touch-icon", "apple-touch-icon-precomposed",
+    "mask-icon", "manifest", "preload", "modulepreload", "prefetch"
+}
+
+# Fast-path tokenizer: comments, and start tags (any of which may carry a style
+# attribute). script/style/textarea bodies are raw text and are skipped wholesale,
+# apart from rewriting the CSS inside <style>. Every attribute has one way to match:
+# names and unquoted values (which may contain "/", as in href=/docs/) run to their
+# end, and unquoted values can't start with a quote. Otherwise an unclosed tag such
+# as <a x=y/x=y/... backtracks exponentially.
+_ATTRIBUTE = rb"""([^\s"'>/=]+)(?![^\s"'>/=])(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>][^\s>]*(?![^\s>])))?"""
+_TOKEN = re.compile(
+    rb"<!--.*?(?:-->|\Z)"
+    rb"|<([a-zA-Z][a-zA-Z0-9:-]*)((?:[\s/]+" + _ATTRIBUTE + rb")*)[\s/]*>",
+    re.IGNORECASE | re.DOTALL
+)
+_HREF = re.compile(rb'(\bhref\s*=\s*)"([^"]*)"', re.IGNORECASE)
+_STYLE_ATTRIBUTE = re.compile(rb"style\s*=", re.IGNORECASE)
+_ATTRIBUTE_RE = re.compile(_ATTRIBUTE)
+_RAW_TEXT_END = {
+    tag: re.compile(rb"</" + tag + rb"\s*>", re.IGNORECASE)
+    for tag in (b"script", b"style", b"textarea")
+}
+# Rewrite targets per tag for the fast path
+_FAST_ATTRIBUTES = {
+    b"a": {b"href": "link"},
+    b"link": {b"href": "asset"},
+    b"script": {b"src": "asset"},
+    b"img": {b"src": "asset", b"srcset": "srcset"},
+    b"source": {b"src": "asset", b"srcset": "srcset"},
+    b"video": {b"src": "asset", b"poster": "asset"},
+    b"audio": {b"src": "asset"},
+    b"track": {b"src": "asset"},
+}
+# References a stylesheet makes: @import "x.css" and url(...), quoted or not
+_CSS_REFERENCE = re.compile(
+    r"""(@import\s+)(?:"([^"]*)"|'([^']*)')"""
+    r"""|url\(\s*(?:"([^"]*)"|'([^']*)'|([^)"'\s]*))\s*\)""",
+    re.IGNORECASE
+)
+
+
+def _resolve_asset(src: str, base_url: str, domain: str) -> Optional[Tuple[str, str]]:
+    """(absolute URL, local path) for an in-domain asset reference"""
+    if src.startswith(SKIPPED_ASSET_PREFIXES):
+        return None
+    full_url = urljoin(base_url, src)
+    if urlparse(full_url).netloc.lower() != domain:
+        return None
+    rel_path = asset_path(full_url)
+    if not rel_path:
+        return None
+    return full_url, rel_path.as_posix()
+
+
+def _resolve_link(href: str, base_url: str, domain: str) -> Optional[Tuple[str, str]]:
+    """(absolute URL, local path) for an in-domain page link"""
+    if href.startswith(SKIPPED_LINK_PREFIXES):
+        return None
+    full_url = urljoin(base_url, href)
+    if urlparse(full_url).netloc.lower() != domain:
+        return None
+    return full_url, f"/{page_path(full_url)}"
+
+
+def _rewrite_srcset(value: str, base_url: str, domain: str, assets: List[str]) -> str:
+    """Point every in-domain candidate of a srcset at its local copy"""
+    candidates = []
+    for candidate in value.split(","):
+        parts = candidate.strip().split(None, 1)
+        if not parts:
+            continue
+        resolved = _resolve_asset(parts[0], base_url, domain)
+        if resolved:
+            assets.append(resolved[0])
+            parts[0] = resolved[1]
+        candidates.append(" ".join(parts))
+    return ", ".join(candidates)
+
+
+def _rewrite_css(css: str, base_url: str, domain: str, assets: List[str],
+                 css_path: Optional[str] = None) -> str:
+    """
+    Point a stylesheet's in-domain url() and @import references at their local copies
+
+    Args:
+        css: Stylesheet text, or the contents of a <style> block or style attribute
+        base_url: URL references are relative to
+        domain: Netloc that counts as in-domain
+        assets: Collects the absolute URLs of the referenced assets
+        css_path: Site-relative path of a stylesheet file, so its references are
+            written relative to it; None for CSS inside a page
+    """
+    def replace(match):
+        value = next(group for group in match.groups()[1:] if group is not None)
+        resolved = _resolve_asset(value.strip(), base_url, domain)
+        if not resolved:
+            return match.group(0)
+        assets.append(resolved[0])
+        local = resolved[1]
+        if css_path is not None:
+            local = posixpath.relpath(local, posixpath.dirname(css_path) or ".")
+        if match.group(1):
+            return f'{match.group(1)}"{local}"'
+        return f'url("{local}")'
+
+    return _CSS_REFERENCE.sub(replace, css)
+
+
+def rewrite_stylesheet(body: bytes, base_url: str, domain: str, css_path: str) -> Dict[str, Any]:
+    """
+    Rewrite a downloaded stylesheet's references to local paths
+
+    Runs in a worker process. Bytes outside the rewritten references are
+    kept as they were, whatever the stylesheet's encoding.
+
+    Args:
+        body: Stylesheet as downloaded
+        base_url: URL it was fetched from
+        domain: Netloc that counts as in-domain
+        css_path: Site-relative path it is saved at
+
+    Returns:
+        Dict with the rewritten "css" bytes and the "assets" URLs it references
+    """
+    assets: List[str] = []
+    css = _rewrite_css(body.decode("utf-8", errors="surrogateescape"), base_url, domain, assets, css_path)
+    return {
+        "css": css.encode("utf-8", errors="surrogateescape"),
+        "assets": list(dict.fromkeys(assets))
+    }
+
+
+def parse_page(body: bytes, base_url: str, domain: str, encoding: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Parse a page with lxml and point its in-domain links and assets at their local copies
+
+    Runs in a worker process, so it only takes and returns picklable values.
+
+    Args:
+        body: Raw response body
+        base_url: URL the page was fetched from
+        domain: Netloc that counts as in-domain
+        encoding: Charset from the response headers, if any
+
+    Returns:
+        Dict with the rewritten "html" bytes, in-domain page "links" and "assets" URLs
+    """
+    soup = BeautifulSoup(body, "lxml", from_encoding=encoding)
+
+    assets: List[str] = []
+    links: List[str] = []
+    for tag, attr in ASSET_ATTRIBUTES:
+        for elem in soup.find_all(tag, {attr: True}):
+            if tag == "link":
+                kind = _link_kind(elem.get("rel", []))
+                if kind is None:
+                    continue
+                if kind == "link":
+                    resolved = _resolve_link(elem[attr], base_url, domain)
+                    if resolved:
+                        links.append(resolved[0])
+                        elem[attr] = resolved[1]
+                    continue
+            resolved = _resolve_asset(elem[attr], base_url, domain)
+            if resolved:
+                assets.append(resolved[0])
+                elem[attr] = resolved[1]
+    for elem in soup.find_all(SRCSET_TAGS, srcset=True):
+        elem["srcset"] = _rewrite_srcset(elem["srcset"], base_url, domain, assets)
+    for elem in soup.find_all("style"):
+        if elem.string:
+            elem.string = Stylesheet(_rewrite_css(str(elem.string), base_url, domain, assets))
+    for elem in soup.find_all(style=True):
+        elem["style"] = _rewrite_css(elem["style"], base_url, domain, assets)
+
+    for a in soup.find_all("a", href=True):
+        resolved = _resolve_link(a["href"], base_url, domain)
+        if resolved:
+            links.append(resolved[0])
+            a["href"] = resolved[1]
+
+    return {
+        "html": soup.encode("utf-8"),
+        "links": list(dict.fromkeys(links)),
+        "assets": list(dict.fromkeys(assets))
+    }
+
+
+def extract_page(body: bytes, base_url: str, domain: str, encoding: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Single-pass equivalent of parse_page that never builds a DOM
+
+    Scans the raw bytes once for a[href], link[href], script[src], img[src],
+    img/source[srcset], media sources, style attributes and <style> blocks,
+    and splices the rewritten values in by byte offset. Everything else, including the original encoding, is
+    left exactly as served. Bodies in encodings that are not ASCII
+    compatible fall back to parse_page.
+
+    Returns:
+        Same shape as parse_page
+    """
+    charset = _ascii_compatible(body, encoding)
+    if charset is None:
+        return parse_page(body, base_url, domain, encoding)
+
+    links: List[str] = []
+    assets: List[str] = []
+    pieces: List[bytes] = []
+    last = 0
+    pos = 0
+    while True:
+        match = _TOKEN.search(body, pos)
+        if not match:
+            break
+        pos = match.end()
+        tag = match.group(1)
+        if tag is None:
+            continue  # comment
+        tag = tag.lower()
+
+        targets = _FAST_ATTRIBUTES.get(tag)
+        if _STYLE_ATTRIBUTE.search(match.group(2)):
+            targets = {**(targets or {}), b"style": "style"}
+        if targets:
+            attrs_start = match.start(2)
+            attrs = list(_ATTRIBUTE_RE.finditer(match.group(2)))
+            if tag == b"link":
+                kind = _link_kind(_rel_values(attrs))
+                targets = {b"href": kind} if kind else {}
+            for attr in attrs:
+                kind = targets.get(attr.group(1).lower())
+                raw = attr.group(2)
+                if kind is None or raw is None:
+                    continue
+                if raw[:1] in (b'"', b"'"):
+                    raw = raw[1:-1]
+                value = html.unescape(raw.decode(charset, errors="replace")).strip()
+
+                if kind == "srcset":
+                    new_value = _rewrite_srcset(value, base_url, domain, assets)
+                elif kind == "style":
+                    new_value = _rewrite_css(value, base_url, domain, assets)
+                    if new_value == value:
+                        continue
+                else:
+                    resolve = _resolve_link if kind == "link" else _resolve_asset
+                    resolved = resolve(value, base_url, domain)
+                    if not resolved:
+                        continue
+                    (links if kind == "link" else assets).append(resolved[0])
+                    new_value = resolved[1]
+
+                start = attrs_start + attr.start(2)
+                pieces.append(body[last:start])
+                pieces.append(b'"' + html.escape(new_value).encode(charset, errors="xmlcharrefreplace") + b'"')
+                last = attrs_start + attr.end(2)
+
+        raw_text_end = _RAW_TEXT_END.get(tag)
+        if raw_text_end:
+            end = raw_text_end.search(body, pos)
+            content_end = end.start() if end else len(body)
+            if tag == b"style":
+                css = body[pos:content_end].decode(charset, errors="surrogateescape")
+                rewritten = _rewrite_css(css, base_url, domain, assets)
+                if rewritten != css:
+                    pieces.append(body[last:pos])
+                    pieces.append(rewritten.encode(charset, errors="surrogateescape"))
+                    last = content_end
+            pos = end.end() if end else len(body)
+
+    pieces.append(body[last:])
+    return {
+        "html": b"".join(pieces),
+        "links": list(dict.fromkeys(links)),
+        "assets": list(dict.fromkeys(assets))
+    }
+
+
+def relink_page(body: bytes, targets: Dict[str, str]) -> bytes:
+    """
+    Point a saved page's rewritten hrefs somewhere else
+
+    Args:
+        body: Saved page, as written by extract_page or parse_page
+        targets: Local href (such as "/stable_p0.html") -> new href
+
+    Returns:
+        The page with those hrefs replaced
+    """
+    encoded = {html.escape(old).encode("utf-8"): html.escape(new).encode("utf-8") for old, new in targets.items()}
+
+    def replace(match):
+        new = encoded.get(match.group(2))
+        return match.group(0) if new is None else match.group(1) + b'"' + new + b'"'
+
+    return _HREF.sub(replace, body)
+
+
+def _rel_values(attrs) -> List[str]:
+    """The rel tokens among a fast-path tag's attribute matches"""
+    for attr in attrs:
+        if attr.group(1).lower() == b"rel" and attr.group(2):
+            return attr.group(2).strip(b"\"'").decode("ascii", errors="replace").split()
+    return []
+
+
+def _link_kind(rels: List[str]) -> Optional[str]:
+    """"link" for a <link> pointing at a page, "asset" for one the page needs, else None"""
+    rels = {rel.lower() for rel in rels}
+    if rels & PAGE_LINK_RELS:
+        return "link"
+    if rels & ASSET_LINK_RELS:
+        return "asset"
+    return None
+
+
+def _ascii_compatible(body: bytes, encoding: Optional[str]) -> Optional[str]:
+    """Codec to decode attribute values with, or None if byte-level scanning is unsafe"""
+    if body.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return None
+    try:
+        name = codecs.lookup(encoding or "utf-8").name
+    except LookupError:
+        return "utf-8"
+    if name.startswith(("utf-16", "utf-32")):
+        return None
+    return name
+
+
+def _parse_task(body: bytes, base_url: str, domain: str, encoding: Optional[str],
+                full_dom: bool, text: bool, chunk_tokens: Optional[int], dedup: bool = False) -> Dict[str, Any]:
+    """
+    Everything the crawl needs from one page, computed in a single worker round trip
+
+    The SimHash costs more than parsing the DOM for text, so it is only
+    computed when the crawl checks for duplicates.
+    """
+    result = (parse_page if full_dom else extract_page)(body, base_url, domain, encoding)
+    if text or chunk_tokens:
+        result.update(extract_document(body, encoding, chunk_tokens))
+        result["fingerprint"] = fingerprint(result["text"]) if dedup else None
+        if result["canonical"]:
+            result["canonical"] = urljoin(base_url, result["canonical"])
+        result["nav_links"] = [urljoin(base_url, href) for href in result["nav_links"]]
+    return result
+
+
+class ParsePool:
+    """Process pool for the parse/rewrite stage; 0 workers parses inline on the event loop"""
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        if self.workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        logger.info(f"Parse pool using {self.workers} worker processes")
+
+    async def parse(self, body: bytes, base_url: str, domain: str,
+                    encoding: Optional[str] = None, full_dom: bool = False,
+                    text: bool = False, chunk_tokens: Optional[int] = None,
+                    dedup: bool = False) -> Dict[str, Any]:
+        """
+        Parse and rewrite a page in a worker process
+
+        The single-pass extractor is used unless full_dom asks for a BeautifulSoup tree.
+        With text=True the result also carries the page's "title", main-content "text",
+        resolved "canonical" link, generator "framework" and resolved "nav_links", its
+        dedup "fingerprint" when dedup is set (None otherwise), and with chunk_tokens its
+        heading-aware "chunks" of at most that many tokens.
+        """
+        args = (body, base_url, domain, encoding, full_dom, text, chunk_tokens, dedup)
+        if self._executor is None:
+            return _parse_task(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, _parse_task, *args)
+
+    async def rewrite_stylesheet(self, body: bytes, base_url: str, domain: str, css_path: str) -> Dict[str, Any]:
+        """Rewrite a downloaded stylesheet's url() and @import references in a worker process"""
+        if self._executor is None:
+            return rewrite_stylesheet(body, base_url, domain, css_path)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, rewrite_stylesheet, body, base_url, domain, css_path)
+
+    async def extract_text(self, body: bytes, encoding: Optional[str] = None,
+                           chunk_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Title, main-content text and optionally chunks of a page, extracted in a worker process"""
+        if self._executor is None:
+            return extract_document(body, encoding, chunk_tokens)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, extract_document, body, encoding, chunk_tokens)
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,257 @@
+"""
+Polite request scheduling: per-host rate limits, retries and adaptive concurrency.
+"""
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlparse
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30.0
+MAX_RETRY_AFTER = 120.0
+DEFAULT_INITIAL_CONCURRENCY = 4
+
+
+class TokenBucket:
+    """Token-bucket rate limiter; a rate of None means unlimited"""
+
+    def __init__(self, rate: Optional[float], burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Hold every request to this host for a while (Retry-After)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.rate is None:
+                    return
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one host
+
+    The limit grows by roughly one slot per window of successful requests
+    while latency stays near its baseline, and halves on errors, throttling
+    or a latency spike.
+    """
+
+    def __init__(self, initial: int = DEFAULT_INITIAL_CONCURRENCY, minimum: int = 1,
+                 maximum: int = 64, latency_tolerance: float = 2.0):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.baseline: Optional[float] = None
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        """Wait for a free slot under the current limit"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        """Give a slot back"""
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        """Additive increase while latency is stable"""
+        if self.baseline is None:
+            self.baseline = latency
+        elif latency > self.baseline * self.latency_tolerance:
+            self.on_congestion()
+            return
+        else:
+            self.baseline = 0.9 * self.baseline + 0.1 * latency
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_congestion(self):
+        """Multiplicative decrease, at most once per baseline latency so one burst of errors counts once"""
+        now = time.monotonic()
+        if now - self._last_decrease < (self.baseline or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class HostState:
+    """Rate limiter and concurrency limiter for one host"""
+
+    def __init__(self, rate: Optional[float], burst: Optional[float], initial: int, maximum: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(initial=initial, maximum=maximum)
+
+
+class RequestScheduler:
+    """
+    Wraps an aiohttp.ClientSession with per-host politeness
+
+    Usage mirrors the session: ``async with scheduler.get(url) as response``.
+    Retryable statuses (429 and 5xx gateway errors) and connection errors
+    are retried with exponential backoff and full jitter, honoring
+    Retry-After when the server sends it. The response handed to the
+    caller is the final attempt, whatever its status.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, rate_limit: Optional[float] = None,
+                 burst: Optional[float] = None, max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE, backoff_max: float = DEFAULT_BACKOFF_MAX,
+                 initial_concurrency: int = DEFAULT_INITIAL_CONCURRENCY, max_concurrency: int = 64,
+                 metrics=None):
+        """
+        Args:
+            session: Session that performs the requests
+            rate_limit: Requests per second per host, or None for no rate cap
+            burst: Token-bucket capacity (defaults to one second of rate_limit)
+            max_retries: Retries after the first attempt
+            backoff_base: First backoff delay in seconds
+            backoff_max: Largest backoff delay in seconds
+            initial_concurrency: Starting in-flight limit per host
+            max_concurrency: Ceiling the adaptive limit may grow to
+            metrics: CrawlMetrics to receive request timings through the
+                session's trace hooks, if any
+        """
+        self.session = session
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics
+        self.hosts: Dict[str, HostState] = {}
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "failed": 0}
+
+    def host(self, url: str) -> HostState:
+        """State for the host a URL points at"""
+        netloc = urlparse(url).netloc
+        state = self.hosts.get(netloc)
+        if state is None:
+            state = HostState(self.rate_limit, self.burst, self.initial_concurrency, self.max_concurrency)
+            self.hosts[netloc] = state
+        return state
+
+    def set_rate_limit(self, url: str, rate: Optional[float]):
+        """Override the rate for one host, e.g. from a robots.txt Crawl-delay"""
+        bucket = self.host(url).bucket
+        bucket.rate = rate
+        bucket.capacity = max(1.0, rate or 1.0)
+        bucket.tokens = min(bucket.tokens, bucket.capacity)
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """GET a URL politely, retrying transient failures"""
+        state = self.host(url)
+        if self.metrics is not None:
+            kwargs.setdefault("trace_request_ctx", self.metrics)
+        attempt = 0
+        while True:
+            await state.bucket.acquire()
+            await state.limiter.acquire()
+            try:
+                self.stats["requests"] += 1
+                started = time.monotonic()
+                try:
+                    response = await self.session.get(url, **kwargs)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    state.limiter.on_congestion()
+                    if attempt >= self.max_retries:
+                        self.stats["failed"] += 1
+                        raise
+                    delay = self._backoff(attempt)
+                    logger.info(f"Retrying {url} in {delay:.1f}s after {type(e).__name__}: {str(e)}")
+                else:
+                    latency = time.monotonic() - started
+                    if response.status not in RETRYABLE_STATUSES:
+                        state.limiter.on_success(latency)
+                        try:
+                            yield response
+                        finally:
+                            response.release()
+                        return
+
+                    state.limiter.on_congestion()
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    if response.status == 429 or retry_after is not None:
+                        self.stats["throttled"] += 1
+                    if attempt >= self.max_retries or (retry_after or 0) > MAX_RETRY_AFTER:
+                        self.stats["failed"] += 1
+                        try:
+                            yield response
+                        finally:
+                            response.release()
+                        return
+
+                    response.release()
+                    if retry_after is not None:
+                        # The whole host asked us to back off, not just this request
+                        state.bucket.pause(retry_after)
+                        delay = retry_after
+                    else:
+                        delay = self._backoff(attempt)
+                    logger.info(f"Retrying {url} in {delay:.1f}s after HTTP {response.status}")
+            finally:
+                await state.limiter.release()
+
+            self.stats["retries"] += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header
+
+    Args:
+        value: Delay in seconds or an HTTP date
+
+    Returns:
+        Seconds to wait, or None if absent or unparseable
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
@@ -0,0 +1,87 @@
+"""
+Crawl scope: which URLs and content types a crawl may fetch.
+"""
+import logging
+import re
+from fnmatch import fnmatch, translate
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+REGEX_PREFIX = "re:"
+
+
+def compile_patterns(patterns: Optional[List[str]]):
+    """
+    Compile URL rules into (path regex, URL regex)
+
+    A rule is a glob, or a regular expression when prefixed with "re:".
+    Globs starting with "/" match the URL's path and query
+    ("/docs/*"); other globs and every regex match the full URL
+    ("*/api/v1/*", "re:\\.(zip|tar\\.gz)$"). Regexes are searched, globs
+    must match the whole string. Either part is None when no rule needs it.
+    """
+    path_rules, url_rules = [], []
+    for pattern in patterns or []:
+        if pattern.startswith(REGEX_PREFIX):
+            regex = pattern[len(REGEX_PREFIX):]
+            try:
+                re.compile(regex)
+            except re.error as e:
+                raise ValueError(f"Invalid URL pattern {pattern!r}: {str(e)}")
+            url_rules.append(f"(?:.*?(?:{regex}))")
+        elif pattern.startswith("/"):
+            path_rules.append(translate(pattern))
+        else:
+            url_rules.append(translate(pattern))
+    path_regex = re.compile("|".join(path_rules)) if path_rules else None
+    url_regex = re.compile("|".join(url_rules), re.DOTALL) if url_rules else None
+    return path_regex, url_regex
+
+
+class CrawlScope:
+    """
+    Include/exclude URL rules and allowed content types for one crawl
+
+    Include rules limit which pages are crawled (the start page is always
+    fetched, so its links can be followed into the included part);
+    exclude rules apply to pages and assets alike. Content types are
+    fnmatch patterns ("text/html", "image/*") checked against the
+    Content-Type header before a body is read; responses without one
+    are let through.
+    """
+
+    def __init__(self, include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                 allowed_types: Optional[List[str]] = None):
+        self.include = compile_patterns(include) if include else None
+        self.exclude = compile_patterns(exclude) if exclude else None
+        self.allowed_types = [t.lower() for t in allowed_types] if allowed_types else None
+
+    def allows_page(self, url: str) -> bool:
+        """Whether a page URL passes the include and exclude rules"""
+        if self.include and not _matches(self.include, url):
+            return False
+        return self.allows_asset(url)
+
+    def allows_asset(self, url: str) -> bool:
+        """Whether an asset URL passes the exclude rules"""
+        return not (self.exclude and _matches(self.exclude, url))
+
+    def allows_type(self, content_type: Optional[str]) -> bool:
+        """Whether a Content-Type header value is an allowed type"""
+        if self.allowed_types is None or not content_type:
+            return True
+        mime = content_type.split(";", 1)[0].strip().lower()
+        return any(fnmatch(mime, pattern) for pattern in self.allowed_types)
+
+
+def _matches(compiled, url: str) -> bool:
+    path_regex, url_regex = compiled
+    if url_regex and url_regex.match(url):
+        return True
+    if path_regex:
+        parts = urlsplit(url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        return bool(path_regex.match(path))
+    return False
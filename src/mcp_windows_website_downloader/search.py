@@ -0,0 +1,251 @@
+"""
+Full-text search over the downloaded library (SQLite FTS5).
+"""
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_FILENAME = "search_index.sqlite"
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 100
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS documents (
+        id INTEGER PRIMARY KEY,
+        site TEXT NOT NULL,
+        url TEXT NOT NULL UNIQUE,
+        path TEXT NOT NULL,
+        hash TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS documents_site ON documents (site)",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+        title, body, tokenize = 'porter unicode61'
+    )
+    """,
+]
+
+
+class SearchIndex:
+    """
+    Library-wide inverted index of page text
+
+    One database in the library directory covers every site; each row
+    carries its site so searches can be scoped to one site or span them
+    all. Pages are (re)indexed as they are written and skipped when their
+    content hash is already indexed. All methods block, so the crawl runs
+    them on the writer pool.
+    """
+
+    def __init__(self, library_dir: Path):
+        self.library_dir = library_dir
+        self.path = library_dir / SEARCH_INDEX_FILENAME
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            with self._conn:
+                for statement in _SCHEMA:
+                    self._conn.execute(statement)
+        return self._conn
+
+    def has(self, url: str, digest: str) -> bool:
+        """Whether this exact version of a page is already indexed"""
+        with self._lock:
+            row = self._connect().execute("SELECT hash FROM documents WHERE url = ?", (url,)).fetchone()
+        return row is not None and row[0] == digest
+
+    def add(self, site: str, url: str, path: str, title: str, text: str, digest: str):
+        """
+        Index or re-index one page
+
+        Args:
+            site: Site directory name inside the library
+            url: Canonical page URL
+            path: Site-relative path of the saved page
+            title: Page title
+            text: Main-content text
+            digest: content_hash() of the page body
+        """
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                _add(conn, site, url, path, title, text, digest)
+
+    def remove(self, urls: Iterable[str]):
+        """Drop pages that no longer exist on their site"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                _remove(conn, urls)
+
+    def merge(self, path: Path):
+        """
+        Fold a StagedSearchIndex database into this index in one transaction, then delete it
+
+        Staged pages are added first, then staged removals applied.
+        """
+        if not path.exists():
+            return
+        staged = sqlite3.connect(path)
+        try:
+            pages = staged.execute(
+                "SELECT d.site, d.url, d.path, f.title, f.body, d.hash "
+                "FROM documents d JOIN documents_fts f ON f.rowid = d.id"
+            ).fetchall()
+            removed = [row[0] for row in staged.execute("SELECT url FROM removed")]
+        finally:
+            staged.close()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for page in pages:
+                    _add(conn, *page)
+                _remove(conn, removed)
+        _delete_database(path)
+
+    def search(self, query: str, site: Optional[str] = None,
+               limit: int = DEFAULT_SEARCH_LIMIT) -> List[Dict[str, Any]]:
+        """
+        Ranked full-text search
+
+        Args:
+            query: Words to look for; every word must match (prefix with * for prefix search)
+            site: Optional site directory name to search within
+            limit: Maximum number of results
+
+        Returns:
+            Results best first, each with site, url, file path, title, snippet and BM25 score
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+        sql = (
+            "SELECT d.site, d.url, d.path, documents_fts.title, "
+            "snippet(documents_fts, 1, '[', ']', ' ... ', 24), bm25(documents_fts, 5.0, 1.0) AS score "
+            "FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid "
+            "WHERE documents_fts MATCH ?"
+        )
+        params: List[Any] = [match]
+        if site:
+            sql += " AND d.site = ?"
+            params.append(site)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        return [
+            {
+                "site": row[0],
+                "url": row[1],
+                "path": str(self.library_dir / row[0] / row[2]),
+                "title": row[3],
+                "snippet": row[4],
+                "score": round(-row[5], 3)
+            }
+            for row in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class StagedSearchIndex(SearchIndex):
+    """
+    A crawl shard's writes to the library index, held in a database of its own
+
+    Shards running at once would otherwise contend for the library
+    database's single write lock. Pages and removals go to the staging
+    database, which the coordinator merges into the library index once
+    every shard is done; has() still reads the library index, so pages
+    that are indexed already are not staged again.
+    """
+
+    def __init__(self, library_dir: Path, path: Path):
+        super().__init__(library_dir)
+        self.path = path
+        self._library = SearchIndex(library_dir)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Left over from a crawl that failed before its merge
+            _delete_database(self.path)
+            conn = super()._connect()
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS removed (url TEXT PRIMARY KEY)")
+        return self._conn
+
+    def has(self, url: str, digest: str) -> bool:
+        return self._library.has(url, digest) or super().has(url, digest)
+
+    def remove(self, urls: Iterable[str]):
+        """Stage pages to drop from the library index"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO removed (url) VALUES (?)", ((url,) for url in urls))
+
+    def close(self):
+        super().close()
+        self._library.close()
+
+
+def _add(conn: sqlite3.Connection, site: str, url: str, path: str, title: str, text: str, digest: str):
+    row = conn.execute("SELECT id, hash FROM documents WHERE url = ?", (url,)).fetchone()
+    if row is not None:
+        if row[1] == digest:
+            return
+        conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (row[0],))
+        conn.execute("UPDATE documents SET site = ?, path = ?, hash = ? WHERE id = ?",
+                     (site, path, digest, row[0]))
+        doc_id = row[0]
+    else:
+        doc_id = conn.execute("INSERT INTO documents (site, url, path, hash) VALUES (?, ?, ?, ?)",
+                              (site, url, path, digest)).lastrowid
+    conn.execute("INSERT INTO documents_fts (rowid, title, body) VALUES (?, ?, ?)",
+                 (doc_id, title, text))
+
+
+def _remove(conn: sqlite3.Connection, urls: Iterable[str]):
+    for url in urls:
+        row = conn.execute("SELECT id FROM documents WHERE url = ?", (url,)).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (row[0],))
+            conn.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+
+
+def _delete_database(path: Path):
+    """Remove an SQLite database along with its WAL and shared-memory files"""
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+
+def fts_query(query: str) -> str:
+    """
+    Turn free text into a safe FTS5 query
+
+    Every word becomes a quoted term so punctuation in queries like
+    "asyncio.gather" can't break the FTS5 syntax; a trailing * keeps
+    prefix matching.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
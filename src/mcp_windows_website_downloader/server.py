@@ -5,14 +5,23 @@ import asyncio
 import logging
 import os
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 import mcp.types as types
 from mcp.server import Server
 from mcp.server.models import InitializationOptions
 from mcp.types import LoggingCapability, ToolsCapability
 import mcp.server.lowlevel.server as server
 import mcp.server.stdio
-from .downloader import WebsiteDownloader
+from .downloader import WebsiteDownloader, DEFAULT_CONCURRENCY, DEFAULT_CONNECTION_LIMIT
+from .metrics import PROFILERS
+from .jobs import JobManager, DownloadJob, DEFAULT_MAX_JOBS
+from .parser import ParsePool
+from .scheduler import DEFAULT_MAX_RETRIES
+from .search import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from .content import DEFAULT_CHUNK_TOKENS
+from .blobs import BLOB_COMPRESSIONS
+from .archive import ArchiveReader, OUTPUT_MODES, ARCHIVE_INDEX_FILENAME
+from .utils import TRAILING_SLASH_POLICIES
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,17 +29,27 @@ logger = logging.getLogger(__name__)
 class WebsiteDownloaderServer:
     """MCP server for downloading documentation websites"""
     
-    def __init__(self, library_dir: Path):
+    def __init__(self, library_dir: Path, parse_workers: int | None = None,
+                 max_jobs: int = DEFAULT_MAX_JOBS, max_connections: int = DEFAULT_CONNECTION_LIMIT,
+                 blob_compression: str = "none", shards: int = 1):
         self.library_dir = library_dir
+        # Worker processes per crawl when the download tool doesn't say
+        self.default_shards = shards
         logger.info(f"Initializing downloader with library dir: {library_dir}")
         abs_path = library_dir.absolute()
         logger.info(f"Absolute library path: {abs_path}")
         if not abs_path.exists():
             abs_path.mkdir(parents=True)
             logger.info(f"Created library directory at {abs_path}")
-        self.downloader = WebsiteDownloader(abs_path)
+        # Shared by every job: connection pool, DNS cache, writer and parse pool
+        self.downloader = WebsiteDownloader(abs_path, parse_pool=ParsePool(parse_workers),
+                                            max_connections=max_connections,
+                                            blob_compression=blob_compression)
         self.server = Server("mcp-windows-website-downloader")
-        self._tasks = set()
+        # Site downloads run as jobs; the manager caps how many run at once
+        self.jobs = JobManager(self.downloader, max_jobs=max_jobs)
+        # Open archive readers by site, with the index mtime they were loaded at
+        self._archives: Dict[str, Tuple[float, ArchiveReader]] = {}
         self._setup_tools()
         logger.info("Server initialized")
         
@@ -50,10 +69,244 @@ class WebsiteDownloaderServer:
                             "url": {
                                 "type": "string",
                                 "description": "Documentation site URL"
+                            },
+                            "concurrency": {
+                                "type": "integer",
+                                "description": "Number of pages fetched in parallel",
+                                "minimum": 1,
+                                "default": DEFAULT_CONCURRENCY
+                            },
+                            "max_pages": {
+                                "type": "integer",
+                                "description": "Maximum number of pages to crawl",
+                                "minimum": 1
+                            },
+                            "max_asset_size": {
+                                "type": "integer",
+                                "description": "Skip assets larger than this many bytes",
+                                "minimum": 1
+                            },
+                            "max_file_size": {
+                                "type": "integer",
+                                "description": "Skip any page or asset larger than this many bytes",
+                                "minimum": 1
+                            },
+                            "max_total_bytes": {
+                                "type": "integer",
+                                "description": "Stop making requests once the crawl has downloaded this many bytes",
+                                "minimum": 1
+                            },
+                            "include": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "description": "Only crawl pages matching one of these rules: globs (\"/docs/*\" matches the path, "
+                                               "others the full URL) or regexes prefixed with \"re:\""
+                            },
+                            "exclude": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "description": "Never fetch pages or assets matching one of these rules (same syntax as include)"
+                            },
+                            "allowed_types": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "description": "Content types to download, e.g. [\"text/html\", \"text/css\", \"image/*\"]; "
+                                               "checked before the body is read"
+                            },
+                            "ignore_query_params": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "description": "Query parameter patterns that don't identify a page "
+                                               "(default: highlight, utm_*, ...; [\"*\"] ignores all queries)"
+                            },
+                            "trailing_slash": {
+                                "type": "string",
+                                "enum": list(TRAILING_SLASH_POLICIES),
+                                "description": "Trailing-slash policy used when deduplicating URLs",
+                                "default": "strip-files"
+                            },
+                            "lowercase_path": {
+                                "type": "boolean",
+                                "description": "Treat URL paths as case-insensitive, for servers that do "
+                                               "(e.g. IIS): /Guide.html and /guide.html become one page",
+                                "default": False
+                            },
+                            "rate_limit": {
+                                "type": "number",
+                                "description": "Maximum requests per second to the site (default: adaptive, no fixed cap)",
+                                "exclusiveMinimum": 0
+                            },
+                            "max_retries": {
+                                "type": "integer",
+                                "description": "Retries for 429/5xx responses and connection errors",
+                                "minimum": 0,
+                                "default": DEFAULT_MAX_RETRIES
+                            },
+                            "use_sitemap": {
+                                "type": "boolean",
+                                "description": "Seed the crawl from robots.txt/sitemap.xml sitemaps",
+                                "default": True
+                            },
+                            "respect_robots": {
+                                "type": "boolean",
+                                "description": "Honor robots.txt disallow rules and Crawl-delay",
+                                "default": True
+                            },
+                            "resume": {
+                                "type": "boolean",
+                                "description": "Continue an interrupted download of this URL from its last checkpoint",
+                                "default": False
+                            },
+                            "export_chunks": {
+                                "type": "boolean",
+                                "description": "Also write boilerplate-free, heading-aware text chunks to chunks.jsonl for RAG",
+                                "default": False
+                            },
+                            "chunk_tokens": {
+                                "type": "integer",
+                                "description": "Maximum approximate tokens per exported chunk",
+                                "minimum": 1,
+                                "default": DEFAULT_CHUNK_TOKENS
+                            },
+                            "output": {
+                                "type": "string",
+                                "enum": list(OUTPUT_MODES),
+                                "description": "files: loose HTML and asset files; warc: one append-only site.warc with a site.cdxj offset index",
+                                "default": "files"
+                            },
+                            "skip_duplicates": {
+                                "type": "boolean",
+                                "description": "Skip pages whose text duplicates or nearly duplicates a page already saved (mirrored or versioned docs)",
+                                "default": True
+                            },
+                            "prune_duplicates": {
+                                "type": "boolean",
+                                "description": "Stop crawling directories whose pages keep coming back as duplicates, e.g. /latest/ next to /stable/; "
+                                               "not available with shards > 1",
+                                "default": False
+                            },
+                            "shards": {
+                                "type": "integer",
+                                "description": "Split the crawl by URL hash across this many worker processes "
+                                               "(very large sites); page and byte budgets are shared out between them",
+                                "minimum": 1
+                            },
+                            "profile": {
+                                "type": "string",
+                                "enum": list(PROFILERS),
+                                "description": "Profile the crawl and save crawl_profile.pstats (cprofile) or "
+                                               "crawl_profile.html (pyinstrument, optional package) in the site directory"
+                            },
+                            "background": {
+                                "type": "boolean",
+                                "description": "Return a job id immediately instead of waiting for the crawl",
+                                "default": False
                             }
                         },
                         "required": ["url"]
                     }
+                ),
+                types.Tool(
+                    name="download_status",
+                    description="Progress of a download job: pages done, queued, bytes, rate and ETA",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "job_id": {
+                                "type": "string",
+                                "description": "Job id returned by download"
+                            }
+                        },
+                        "required": ["job_id"]
+                    }
+                ),
+                types.Tool(
+                    name="cancel_download",
+                    description="Cancel a queued or running download job",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "job_id": {
+                                "type": "string",
+                                "description": "Job id returned by download"
+                            }
+                        },
+                        "required": ["job_id"]
+                    }
+                ),
+                types.Tool(
+                    name="list_downloads",
+                    description="List recent download jobs and their status",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {}
+                    }
+                ),
+                types.Tool(
+                    name="crawl_metrics",
+                    description="Request timings (p50/p95/p99), stage timers and counters of a running or finished crawl",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "site": {
+                                "type": "string",
+                                "description": "Site directory name in the library"
+                            },
+                            "job_id": {
+                                "type": "string",
+                                "description": "Job id returned by download, instead of site"
+                            },
+                            "format": {
+                                "type": "string",
+                                "enum": ["json", "prometheus"],
+                                "description": "JSON snapshot or Prometheus text exposition format",
+                                "default": "json"
+                            }
+                        }
+                    }
+                ),
+                types.Tool(
+                    name="search",
+                    description="Full-text search over downloaded pages; returns ranked snippets with file paths",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "query": {
+                                "type": "string",
+                                "description": "Words to search for; all must match, end a word with * for prefix search"
+                            },
+                            "site": {
+                                "type": "string",
+                                "description": "Only search this site (its directory name in the library)"
+                            },
+                            "limit": {
+                                "type": "integer",
+                                "description": "Maximum number of results",
+                                "minimum": 1,
+                                "maximum": MAX_SEARCH_LIMIT,
+                                "default": DEFAULT_SEARCH_LIMIT
+                            }
+                        },
+                        "required": ["query"]
+                    }
+                ),
+                types.Tool(
+                    name="read_archived_page",
+                    description="Read one page or asset of a site downloaded with output=warc, without extracting the archive",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "site": {
+                                "type": "string",
+                                "description": "Site directory name in the library"
+                            },
+                            "url": {
+                                "type": "string",
+                                "description": "Original URL, or the site-relative path pages link to (e.g. guide.html)"
+                            }
+                        },
+                        "required": ["site", "url"]
+                    }
                 )
             ]
             logger.info(f"Returning {len(tools)} tools")
@@ -67,36 +320,27 @@ class WebsiteDownloaderServer:
         ) -> List[types.TextContent]:
             """Handle tool calls"""
             logger.info(f"Tool called: {name} with args {arguments}")
+            arguments = arguments or {}
             try:
-                if name != "download":
+                if name == "download":
+                    result = await self._handle_download(arguments)
+                elif name == "download_status":
+                    result = self._require_job(arguments).snapshot()
+                elif name == "cancel_download":
+                    job = self._require_job(arguments)
+                    result = {"job_id": job.id, "cancelled": self.jobs.cancel(job.id)}
+                elif name == "list_downloads":
+                    result = {"jobs": [job.snapshot() for job in self.jobs.list()]}
+                elif name == "crawl_metrics":
+                    # Live metrics belong to the event loop, so no worker thread here
+                    result = self._crawl_metrics(arguments)
+                elif name == "search":
+                    result = await self._handle_search(arguments)
+                elif name == "read_archived_page":
+                    result = await asyncio.to_thread(self._read_archived_page, arguments)
+                else:
                     raise ValueError(f"Unknown tool: {name}")
                     
-                if not arguments or "url" not in arguments:
-                    raise ValueError("URL is required")
-
-                url = arguments["url"]
-                
-                # Create download task with progress tracking
-                async def download_with_progress():
-                    try:
-                        logger.info(f"Starting download of {url}")
-                        result = await self.downloader.download(url)
-                        logger.info("Download complete")
-                        return result
-                    except asyncio.CancelledError:
-                        logger.info("Download task cancelled")
-                        raise
-                    except Exception as e:
-                        logger.error(f"Download failed: {str(e)}")
-                        raise
-
-                task = asyncio.create_task(download_with_progress())
-                self._tasks.add(task)
-                try:
-                    result = await task
-                finally:
-                    self._tasks.remove(task)
-                    
                 return [types.TextContent(
                     type="text", 
                     text=str(result)
@@ -112,6 +356,164 @@ class WebsiteDownloaderServer:
                     text=f"Error: {str(e)}"
                 )]
                 
+    async def _handle_download(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Start a download job and either wait for it or hand back its id"""
+        if "url" not in arguments:
+            raise ValueError("URL is required")
+            
+        url = arguments["url"]
+        options = self._download_options(arguments)
+        background = bool(arguments.get("background", False))
+        listener = self._progress_listener(background)
+        job = self.jobs.submit(url, options, listener)
+        
+        if background:
+            return {"status": "queued", "job_id": job.id, "url": url}
+            
+        try:
+            await self.jobs.wait(job)
+        except asyncio.CancelledError:
+            # The caller gave up on a foreground download, so stop the crawl too
+            self.jobs.cancel(job.id)
+            raise
+        if job.status == "cancelled":
+            return {"status": "error", "error": "Download cancelled", "job_id": job.id}
+        return {**(job.result or {"status": "error", "error": job.error}), "job_id": job.id}
+        
+    async def _handle_search(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a full-text query against the library index"""
+        query = arguments.get("query")
+        if not query:
+            raise ValueError("query is required")
+        results = await asyncio.to_thread(
+            self.downloader.search_index.search, query, arguments.get("site"),
+            int(arguments.get("limit", DEFAULT_SEARCH_LIMIT))
+        )
+        return {"query": query, "results": results}
+        
+    def _crawl_metrics(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Metrics of the crawl named by site or job id"""
+        site = arguments.get("site")
+        if not site:
+            if not arguments.get("job_id"):
+                raise ValueError("site or job_id is required")
+            site = WebsiteDownloader.site_name(self._require_job(arguments).url)
+        return self.downloader.crawl_metrics(site, arguments.get("format", "json"))
+        
+    def _read_archived_page(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Serve one record from a site archive (blocking; runs in a thread)"""
+        site, key = arguments.get("site"), arguments.get("url")
+        if not site or not key:
+            raise ValueError("site and url are required")
+        reader = self._archive_reader(site)
+        found = reader.read(key)
+        if found is None:
+            raise ValueError(f"{key} is not in the archive of {site}")
+        entry, body = found
+        mime = entry.get("mime") or ""
+        result = {"url": entry["url"], "path": entry.get("path"), "content_type": mime, "size": len(body)}
+        if mime.startswith("text/") or any(kind in mime for kind in ("html", "json", "javascript", "xml")):
+            charset = mime.partition("charset=")[2].split(";")[0].strip() or "utf-8"
+            try:
+                result["content"] = body.decode(charset, errors="replace")
+            except LookupError:
+                result["content"] = body.decode("utf-8", errors="replace")
+        return result
+
+    def _archive_reader(self, site: str) -> ArchiveReader:
+        """Cached reader for a site's archive, reopened when a crawl has rewritten its index"""
+        library = self.downloader.output_dir.resolve()
+        site_dir = (library / site).resolve()
+        if site_dir.parent != library:
+            raise ValueError(f"Invalid site: {site}")
+        index_path = site_dir / ARCHIVE_INDEX_FILENAME
+        if not index_path.exists():
+            raise ValueError(f"{site} has no archive; download it with output=warc")
+        mtime = index_path.stat().st_mtime
+        cached = self._archives.get(site)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        if cached:
+            cached[1].close()
+        reader = ArchiveReader(site_dir)
+        self._archives[site] = (mtime, reader)
+        return reader
+        
+    def _download_options(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Translate download tool arguments into WebsiteDownloader.download keyword arguments"""
+        options = {
+            "concurrency": int(arguments.get("concurrency", DEFAULT_CONCURRENCY)),
+            "trailing_slash": arguments.get("trailing_slash", "strip-files"),
+            "ignore_query_params": arguments.get("ignore_query_params"),
+            "lowercase_path": bool(arguments.get("lowercase_path", False)),
+            "max_retries": int(arguments.get("max_retries", DEFAULT_MAX_RETRIES)),
+            "use_sitemap": bool(arguments.get("use_sitemap", True)),
+            "respect_robots": bool(arguments.get("respect_robots", True)),
+            "resume": bool(arguments.get("resume", False)),
+            "export_chunks": bool(arguments.get("export_chunks", False)),
+            "chunk_tokens": int(arguments.get("chunk_tokens", DEFAULT_CHUNK_TOKENS)),
+            "output": arguments.get("output", "files"),
+            "skip_duplicates": bool(arguments.get("skip_duplicates", True)),
+            "prune_duplicates": bool(arguments.get("prune_duplicates", False)),
+            "shards": int(arguments.get("shards", self.default_shards))
+        }
+        for key, cast in [("max_pages", int), ("max_asset_size", int), ("max_file_size", int),
+                          ("max_total_bytes", int), ("rate_limit", float)]:
+            if arguments.get(key) is not None:
+                options[key] = cast(arguments[key])
+        for key in ("include", "exclude", "allowed_types"):
+            if arguments.get(key):
+                options[key] = [str(value) for value in arguments[key]]
+        if arguments.get("profile"):
+            options["profile"] = str(arguments["profile"])
+        return options
+        
+    def _require_job(self, arguments: Dict[str, Any]) -> DownloadJob:
+        """Look up the job named in the arguments"""
+        job_id = arguments.get("job_id")
+        if not job_id:
+            raise ValueError("job_id is required")
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"Unknown job: {job_id}")
+        return job
+        
+    def _progress_listener(self, background: bool = False):
+        """
+        Build a job listener bound to the calling MCP session
+
+        Uses the request's progress token when the client sent one and waits
+        for the download, and log-message notifications keyed by job id
+        otherwise: a background call has already returned, and progress
+        notifications must stop once their request completes.
+        """
+        try:
+            context = self.server.request_context
+        except LookupError:
+            return None
+        session = context.session
+        token = context.meta.progressToken if context.meta and not background else None
+        
+        async def listener(job: DownloadJob):
+            progress = job.progress
+            done = progress.get("pages_done", 0)
+            message = (
+                f"{job.status}: {done} pages, {progress.get('queued', 0)} queued, "
+                f"{progress.get('bytes', 0)} bytes, {progress.get('pages_per_second', 0)} pages/s, "
+                f"ETA {progress.get('eta_seconds')}s"
+            )
+            if job.done:
+                await self._notify_completion(session, f"Download {job.id} of {job.url} {job.status}: {message}")
+            elif token is not None:
+                await session.send_progress_notification(
+                    token, done, total=done + progress.get("queued", 0), message=message
+                )
+            else:
+                await session.send_log_message("info", {"job_id": job.id, **job.snapshot()},
+                                               logger="website-downloader")
+                                               
+        return listener
+        
     async def run(self):
         """Run the MCP server"""
         logger.info("Starting server")
@@ -133,26 +535,23 @@ class WebsiteDownloaderServer:
                 
             except asyncio.CancelledError:
                 logger.info("Server received cancel signal")
-                # Clean shutdown - cancel tasks
-                for task in self._tasks:
-                    if not task.done():
-                        task.cancel()
-                # Wait for tasks to finish
-                if self._tasks:
-                    await asyncio.gather(*self._tasks, return_exceptions=True)
-                logger.info("Server shutdown complete")
                 raise
             except Exception as e:
                 logger.error(f"Server run error: {str(e)}")
-                raise            
-    async def _notify_completion(self, message: str):
-        """Send a notification about task completion"""
+                raise
+            finally:
+                # However the session ended (cancel or stdio EOF), stop the jobs
+                # before closing the session and pools they are still using
+                await self.jobs.shutdown()
+                for _, reader in self._archives.values():
+                    reader.close()
+                await self.downloader.close()
+                logger.info("Server shutdown complete")
+                
+    async def _notify_completion(self, session, message: str):
+        """Send a notification about job completion"""
         try:
-            notification = notification(
-                method="notifications/status",
-                params={"message": message}
-            )
-            await self.server.send_notification(notification)
+            await session.send_log_message("notice", message, logger="website-downloader")
         except Exception as e:
             logger.error(f"Failed to send notification: {str(e)}")
             
@@ -163,6 +562,16 @@ def main():
         parser = argparse.ArgumentParser(description="MCP Windows Website Downloader")
         parser.add_argument("--library", type=str, default="website_library",
                            help="Directory for downloaded sites")
+        parser.add_argument("--parse-workers", type=int, default=None,
+                           help="Processes used to parse HTML (default: one per CPU, 0 parses in-process)")
+        parser.add_argument("--max-jobs", type=int, default=DEFAULT_MAX_JOBS,
+                           help="Site downloads allowed to run at the same time")
+        parser.add_argument("--max-connections", type=int, default=DEFAULT_CONNECTION_LIMIT,
+                           help="Open HTTP connections shared by all running downloads")
+        parser.add_argument("--blob-compression", choices=BLOB_COMPRESSIONS, default="none",
+                           help="Compress text assets in the shared blob store (zstd needs the zstandard package)")
+        parser.add_argument("--shards", type=int, default=1,
+                           help="Default number of worker processes each crawl is split across")
         args = parser.parse_args()
         
         # Get the absolute path, keeping relative paths relative to where the script is run
@@ -174,7 +583,9 @@ def main():
             
         logger.info(f"Library directory: {library_dir}")
         
-        server = WebsiteDownloaderServer(library_dir)
+        server = WebsiteDownloaderServer(library_dir, parse_workers=args.parse_workers,
+                                         max_jobs=args.max_jobs, max_connections=args.max_connections,
+                                         blob_compression=args.blob_compression, shards=args.shards)
         logger.info("Server created")
         asyncio.run(server.run())
     except KeyboardInterrupt:
@@ -0,0 +1,534 @@
+"""
+Sharded crawls: one site split by URL hash across worker processes.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Container, Dict, List, Optional, Tuple
+from .dedup import DuplicateDetector, skipped_link_targets
+from .export import CHUNKS_FILENAME
+from .manifest import MANIFEST_FILENAME
+from .metrics import CrawlMetrics, METRICS_FILENAME
+from .parser import ParsePool, relink_page
+from .search import SEARCH_INDEX_FILENAME, SearchIndex, StagedSearchIndex
+from .storage import atomic_write
+
+logger = logging.getLogger(__name__)
+
+SHARD_POLL_INTERVAL = 0.05  # seconds between coordinator checks for results and termination
+PROGRESS_INTERVAL = 0.5  # shortest gap between two progress reports of a shard
+SHARD_JOIN_TIMEOUT = 10.0
+# Crawl options that are a budget for the whole site, split evenly across shards
+SPLIT_OPTIONS = ("max_pages", "max_total_bytes")
+
+
+def shard_of(url: str, count: int) -> int:
+    """Shard owning a canonical URL"""
+    digest = hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def shard_filename(filename: str, index: int) -> str:
+    """Per-shard variant of a site file: crawl_manifest.json -> crawl_manifest.shard2.json"""
+    stem, dot, suffix = filename.partition(".")
+    return f"{stem}.shard{index}{dot}{suffix}"
+
+
+def split_budget(total: Optional[int], count: int, index: int) -> Optional[int]:
+    """A shard's even share of a site-wide budget, at least 1"""
+    if total is None:
+        return None
+    return max(1, total // count + (index < total % count))
+
+
+class ShardLink:
+    """
+    A worker process's end of a sharded crawl
+
+    Pages and assets owned by other shards are sent to their inboxes
+    instead of being crawled here. Termination is detected by the
+    coordinator from two pieces of shared state, both changed under one
+    lock: the number of sent but not yet received messages, and each
+    shard's idle flag. A shard is idle once its frontier and asset
+    downloads are drained; receiving work clears the flag in the same
+    step that takes the message off the pending count, so "pending is
+    zero and every shard is idle" can only be seen when the crawl is done.
+    """
+
+    def __init__(self, index: int, count: int, inboxes: List[Any], events: Any,
+                 lock: Any, pending: Any, idle: Any):
+        self.index = index
+        self.count = count
+        self.inboxes = inboxes
+        self.events = events
+        self.lock = lock
+        self.pending = pending
+        self.idle = idle
+        self.stopped = False
+        self.task: Optional[asyncio.Task] = None  # the shard's crawl, cancelled on request
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._config: Optional[asyncio.Future] = None
+        self._on_page: Optional[Callable[..., Any]] = None
+        self._on_asset: Optional[Callable[[str], Any]] = None
+        self._backlog: List[Tuple] = []  # work received before the crawl attached
+        self._sent_assets = set()
+        self._last_progress = 0.0
+
+    def owns(self, url: str) -> bool:
+        return shard_of(url, self.count) == self.index
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Start receiving messages into loop"""
+        self._loop = loop
+        self._wake = asyncio.Event()
+        self._config = loop.create_future()
+        threading.Thread(target=self._read, name=f"shard-{self.index}-inbox", daemon=True).start()
+
+    def attach(self, on_page: Callable[..., Any], on_asset: Callable[[str], Any]):
+        """Hand received pages and assets to the crawl from now on"""
+        self._on_page, self._on_asset = on_page, on_asset
+        backlog, self._backlog = self._backlog, []
+        for message in backlog:
+            self._dispatch(message)
+
+    def configure(self, max_depth: int, framework: Optional[str]):
+        """Share the start page's site analysis with the other shards"""
+        for index, inbox in enumerate(self.inboxes):
+            if index != self.index:
+                inbox.put(("config", max_depth, framework))
+
+    async def configuration(self) -> Tuple[int, Optional[str]]:
+        """(max_depth, framework) from the shard that analyzed the start page"""
+        return await self._config
+
+    def send_page(self, url: str, depth: int, priority: int, lastmod: Optional[str] = None):
+        self._send(shard_of(url, self.count), ("page", url, depth, priority, lastmod))
+
+    def send_asset(self, url: str):
+        if url not in self._sent_assets:
+            self._sent_assets.add(url)
+            self._send(shard_of(url, self.count), ("asset", url))
+
+    def _send(self, index: int, message: Tuple):
+        with self.lock:
+            self.pending.value += 1
+        self.inboxes[index].put(message)
+
+    async def wait_idle(self) -> bool:
+        """
+        Report this shard idle and wait for more work
+
+        Returns:
+            True once the coordinator has stopped the crawl
+        """
+        self._wake.clear()
+        if not self.stopped:
+            with self.lock:
+                self.idle[self.index] = 1
+            await self._wake.wait()
+        return self.stopped
+
+    def report_progress(self, progress: Dict[str, Any]):
+        """Forward a progress snapshot to the coordinator, at most every PROGRESS_INTERVAL"""
+        now = time.monotonic()
+        if now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            self.events.put(("progress", self.index, progress))
+
+    def _read(self):
+        inbox = self.inboxes[self.index]
+        while True:
+            message = inbox.get()
+            self._loop.call_soon_threadsafe(self._receive, message)
+            if message[0] in ("stop", "cancel"):
+                return
+
+    def _receive(self, message: Tuple):
+        kind = message[0]
+        if kind in ("page", "asset"):
+            with self.lock:
+                self.idle[self.index] = 0
+                self.pending.value -= 1
+            if self._on_page is None:
+                self._backlog.append(message)
+            else:
+                self._dispatch(message)
+            self._wake.set()
+        elif kind == "config":
+            if not self._config.done():
+                self._config.set_result((message[1], message[2]))
+        elif kind == "stop":
+            self.stopped = True
+            self._wake.set()
+        elif kind == "cancel" and self.task is not None:
+            self.task.cancel()
+
+    def _dispatch(self, message: Tuple):
+        if message[0] == "page":
+            self._on_page(*message[1:])
+        else:
+            self._on_asset(message[1])
+
+
+def _shard_main(index: int, count: int, url: str, output_dir: str, options: Dict[str, Any],
+                settings: Dict[str, Any], inboxes: List[Any], events: Any, lock: Any, pending: Any, idle: Any):
+    """Worker process entry point"""
+    link = ShardLink(index, count, inboxes, events, lock, pending, idle)
+    try:
+        result = asyncio.run(_run_shard(link, url, Path(output_dir), options, settings))
+    except BaseException as e:
+        result = {"status": "error", "error": f"{type(e).__name__}: {str(e)}"}
+    events.put(("result", index, result))
+
+
+async def _run_shard(link: ShardLink, url: str, output_dir: Path, options: Dict[str, Any],
+                     settings: Dict[str, Any]) -> Dict[str, Any]:
+    from .downloader import WebsiteDownloader  # imports this module
+
+    link.start(asyncio.get_running_loop())
+    link.task = asyncio.current_task()
+    # The shard is the unit of parallelism, so it parses on its own loop, and
+    # stages its index writes for the coordinator instead of contending for
+    # the library index
+    staged = output_dir / WebsiteDownloader.site_name(url) / shard_filename(SEARCH_INDEX_FILENAME, link.index)
+    downloader = WebsiteDownloader(output_dir, parse_pool=ParsePool(0),
+                                   search_index=StagedSearchIndex(output_dir, staged), **settings)
+    try:
+        return await downloader.download(url, shard=link, **options)
+    except asyncio.CancelledError:
+        return {"status": "error", "error": "Download cancelled"}
+    finally:
+        await downloader.close()
+
+
+class ShardedCrawl:
+    """
+    Coordinator of a crawl split across worker processes
+
+    Each shard runs its own event loop, HTTP session and file writer and
+    crawls only the pages and assets whose canonical URL hashes to it;
+    links to other shards' URLs travel through per-shard multiprocessing
+    queues. The shard owning the start page analyzes the site and seeds
+    the sitemaps. Shards write pages and assets straight into the site
+    directory and their manifests, chunk exports, search index writes
+    and journals into per-shard files, which the coordinator merges once
+    every shard is done, along with their results, indexes and metrics.
+    Each shard only compares the pages it crawled for duplicates, so the
+    merge runs one more duplicate check across the pages every shard kept.
+    """
+
+    def __init__(self, url: str, site_dir: Path, shards: int, options: Dict[str, Any],
+                 settings: Dict[str, Any], search_index: SearchIndex,
+                 on_progress: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Args:
+            url: Canonical start URL
+            site_dir: The site's directory in the library
+            shards: Number of worker processes
+            options: WebsiteDownloader.download keyword arguments for the shards;
+                SPLIT_OPTIONS and rate_limit are divided between them
+            settings: WebsiteDownloader constructor arguments for the shards
+            search_index: The library index the shards' staged index writes are merged into
+            on_progress: Called with the combined progress of the shards
+        """
+        self.url = url
+        self.site_dir = site_dir
+        self.shards = shards
+        self.options = options
+        self.settings = settings
+        self.search_index = search_index
+        self.on_progress = on_progress
+        self.started_at = time.monotonic()
+        self._progress: Dict[int, Dict[str, Any]] = {}
+
+    def shard_options(self, index: int) -> Dict[str, Any]:
+        options = dict(self.options)
+        for name in SPLIT_OPTIONS:
+            options[name] = split_budget(options.get(name), self.shards, index)
+        if options.get("rate_limit"):
+            options["rate_limit"] = options["rate_limit"] / self.shards
+        return options
+
+    async def run(self) -> Dict[str, Any]:
+        """Crawl the site with every shard and merge what they wrote"""
+        context = multiprocessing.get_context("spawn")
+        lock = context.Lock()
+        pending = context.Value("q", 0, lock=False)
+        idle = context.Array("b", self.shards, lock=False)
+        inboxes = [context.Queue() for _ in range(self.shards)]
+        events = context.Queue()
+        processes = [
+            context.Process(
+                target=_shard_main, name=f"website-downloader-shard-{index}", daemon=True,
+                args=(index, self.shards, self.url, str(self.site_dir.parent), self.shard_options(index),
+                      self.settings, inboxes, events, lock, pending, idle)
+            )
+            for index in range(self.shards)
+        ]
+        logger.info(f"Starting {self.shards} crawl shards for {self.url}")
+        for process in processes:
+            process.start()
+        try:
+            results = await self._supervise(processes, inboxes, events, lock, pending, idle)
+        except BaseException:
+            for inbox in inboxes:
+                inbox.put(("cancel",))
+            await asyncio.shield(self._join(processes))
+            raise
+        await self._join(processes)
+        return await asyncio.to_thread(self._merge, results)
+
+    async def _supervise(self, processes, inboxes, events, lock, pending, idle) -> List[Dict[str, Any]]:
+        """Collect progress and results, and stop the shards once all of them run dry"""
+        results: Dict[int, Dict[str, Any]] = {}
+        stopping = False
+        while len(results) < self.shards:
+            exited = [index for index, process in enumerate(processes) if not process.is_alive()]
+            self._drain_events(events, results)
+            for index in exited:
+                if index not in results:
+                    raise RuntimeError(f"Crawl shard {index} exited with code {processes[index].exitcode}")
+            failed = [(index, result) for index, result in results.items() if result.get("status") != "success"]
+            if failed:
+                index, result = failed[0]
+                raise RuntimeError(f"Crawl shard {index} failed: {result.get('error')}")
+            if not stopping:
+                with lock:
+                    finished = pending.value == 0 and all(idle)
+                if finished:
+                    stopping = True
+                    for inbox in inboxes:
+                        inbox.put(("stop",))
+            await asyncio.sleep(SHARD_POLL_INTERVAL)
+        return [results[index] for index in range(self.shards)]
+
+    def _drain_events(self, events, results: Dict[int, Dict[str, Any]]):
+        while not events.empty():
+            try:
+                kind, index, payload = events.get_nowait()
+            except Exception:
+                return
+            if kind == "result":
+                results[index] = payload
+            elif kind == "progress":
+                self._progress[index] = payload
+                if self.on_progress:
+                    self.on_progress(self.progress())
+
+    def progress(self) -> Dict[str, Any]:
+        """Combined progress of the shards, shaped like CrawlContext.progress()"""
+        elapsed = time.monotonic() - self.started_at
+        done = sum(p.get("pages_done", 0) for p in self._progress.values())
+        queued = sum(p.get("queued", 0) for p in self._progress.values())
+        rate = done / elapsed if elapsed > 0 else 0.0
+        return {
+            "pages_done": done,
+            "queued": queued,
+            "bytes": sum(p.get("bytes", 0) for p in self._progress.values()),
+            "elapsed_seconds": round(elapsed, 1),
+            "pages_per_second": round(rate, 2),
+            "eta_seconds": round(queued / rate, 1) if rate > 0 else None,
+            "shards": self.shards
+        }
+
+    async def _join(self, processes):
+        for process in processes:
+            await asyncio.to_thread(process.join, SHARD_JOIN_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Terminating unresponsive {process.name}")
+                process.terminate()
+
+    def _merge(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Combine the shards' files, indexes and results (blocking; runs in a thread)"""
+        owner = results[shard_of(self.url, self.shards)]
+        entries = merge_manifests(self.site_dir, self.shards, MANIFEST_FILENAME)
+        for index in range(self.shards):
+            self.search_index.merge(self.site_dir / shard_filename(SEARCH_INDEX_FILENAME, index))
+        changes = _merge_counts(result["changes"] for result in results)
+        metrics = CrawlMetrics()
+        for result in results:
+            metrics.merge(result["metrics"])
+        counters = _merge_counts(result["counters"] for result in results)
+
+        indexes = [result["index"] for result in results]
+        index = {
+            **owner["index"],
+            "pages": sum(i["pages"] for i in indexes),
+            "assets": sum(i["assets"] for i in indexes),
+            "sitemap_urls": sum(i["sitemap_urls"] for i in indexes),
+            "changes": changes,
+            "shards": self.shards
+        }
+        duplicates = None
+        dropped: Dict[str, Tuple[str, str]] = {}
+        if owner["duplicates"] is not None:
+            duplicates = _merge_counts(r["duplicates"] for r in results)
+        if "duplicates" in owner["index"]:
+            dropped = self._drop_duplicates(entries, duplicates)
+            index["pages"] -= len(dropped)
+            # A page one shard kept may itself have been dropped for another shard's copy
+            duplicate_of = {url: dropped[kept][1] if kept in dropped else kept
+                            for i in indexes for url, kept in i["duplicates"].items()}
+            duplicate_of.update((url, kept) for url, (kind, kept) in dropped.items())
+            index["duplicates"] = duplicate_of
+            relink_pages(self.site_dir, entries, duplicate_of, duplicates.get("pruned_subtrees", []))
+        if "chunks" in owner["index"]:
+            left_out = concatenate_parts(self.site_dir, self.shards, CHUNKS_FILENAME, skip=dropped)
+            index["chunks"] = {**owner["index"]["chunks"],
+                               "count": sum(i["chunks"]["count"] for i in indexes) - left_out}
+        index["metrics"] = metrics.snapshot(counters)
+        (self.site_dir / "rag_index.json").write_text(json.dumps(index, indent=2), encoding="utf-8")
+        (self.site_dir / METRICS_FILENAME).write_text(metrics.prometheus(self.site_dir.name, counters),
+                                                          encoding="utf-8")
+
+        logger.info(f"Sharded download complete. {index['pages']} pages saved to {self.site_dir}")
+        return {
+            "status": "success",
+            "path": str(self.site_dir),
+            "pages": index["pages"],
+            "depth_used": owner["depth_used"],
+            "framework": owner["framework"],
+            "changes": changes,
+            "sitemap_urls": index["sitemap_urls"],
+            "robots_blocked": sum(r["robots_blocked"] for r in results),
+            "skipped_by_lastmod": sum(r["skipped_by_lastmod"] for r in results),
+            "resumed": False,
+            "assets_deduplicated": sum(r["assets_deduplicated"] for r in results),
+            "skipped": _merge_counts(r["skipped"] for r in results),
+            "duplicates": duplicates,
+            "requests": _merge_counts(r["requests"] for r in results),
+            "shards": [{"pages": r["pages"], "requests": r["requests"]["requests"]} for r in results]
+        }
+
+    def _drop_duplicates(self, entries: Dict[str, Any], duplicates: Dict[str, Any]) -> Dict[str, Tuple[str, str]]:
+        """
+        Remove pages duplicating a page another shard kept from the manifest, site and search index
+
+        Args:
+            entries: Merged manifest entries, updated in place
+            duplicates: Merged duplicate stats, updated in place
+
+        Returns:
+            Dropped page URL -> ("exact" or "near", URL of the page kept instead)
+        """
+        dropped = find_duplicates(entries)
+        if not dropped:
+            return dropped
+        removed = [entries.pop(url) for url in dropped]
+        kept_paths = {entry["path"] for entry in entries.values()}
+        for entry in removed:
+            if entry["path"] not in kept_paths:
+                (self.site_dir / entry["path"]).unlink(missing_ok=True)
+        write_manifest(self.site_dir / MANIFEST_FILENAME, entries)
+        self.search_index.remove(dropped)
+        for url, (kind, kept) in dropped.items():
+            duplicates[kind] += 1
+            logger.info(f"Dropping {url}: {kind} duplicate of {kept}, kept by another shard")
+        return dropped
+
+
+def _merge_counts(dicts) -> Dict[str, Any]:
+    """Add up per-shard stats: counts are summed, lists (like pruned subtrees) joined"""
+    total: Dict[str, Any] = {}
+    for counts in dicts:
+        for name, value in counts.items():
+            total[name] = total.get(name, [] if isinstance(value, list) else 0) + value
+    return total
+
+
+def merge_manifests(site_dir: Path, count: int, filename: str) -> Dict[str, Any]:
+    """Replace the site manifest with the union of the shards' manifests, returning its entries"""
+    entries: Dict[str, Any] = {}
+    paths = [site_dir / shard_filename(filename, index) for index in range(count)]
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            entries.update(json.load(f)["entries"])
+    write_manifest(site_dir / filename, entries)
+    for path in paths:
+        path.unlink()
+    return entries
+
+
+def write_manifest(path: Path, entries: Dict[str, Any]):
+    """Atomically replace a manifest file with entries"""
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "entries": entries}, f)
+    os.replace(tmp_path, path)
+
+
+def find_duplicates(entries: Dict[str, Any]) -> Dict[str, Tuple[str, str]]:
+    """
+    Pages in a manifest whose recorded fingerprints duplicate another page's
+
+    Pages are checked in an order that doesn't depend on which shard
+    fetched them first: pages whose canonical link points elsewhere last,
+    then shorter URLs first, so /stable/ wins over a /latest/ mirror
+    that names it as canonical.
+
+    Returns:
+        Duplicate page URL -> ("exact" or "near", URL of the page kept instead)
+    """
+    detector = DuplicateDetector()
+    pages = sorted((url for url, entry in entries.items() if "links" in entry),
+                   key=lambda url: (entries[url].get("canonical", url) != url, len(url), url))
+    found = {}
+    for url in pages:
+        duplicate = detector.check(url, entries[url].get("text_hash"), entries[url].get("simhash"))
+        if duplicate:
+            found[url] = duplicate
+    return found
+
+
+def relink_pages(site_dir: Path, entries: Dict[str, Any], duplicate_of: Dict[str, str], pruned: List[str]):
+    """Point saved pages' links to skipped duplicates and pruned pages, from any shard, at what exists instead"""
+    for url, entry in entries.items():
+        targets = skipped_link_targets(entry.get("links", ()), duplicate_of, pruned, entries)
+        if not targets:
+            continue
+        path = site_dir / entry["path"]
+        try:
+            body = path.read_bytes()
+            relinked = relink_page(body, targets)
+            if relinked != body:
+                atomic_write(path, relinked)
+        except OSError as e:
+            logger.warning(f"Could not relink {url}: {str(e)}")
+
+
+def concatenate_parts(site_dir: Path, count: int, filename: str, skip: Container[str] = ()) -> int:
+    """
+    Replace a JSON Lines site file with the shards' part files (e.g. chunks.shard0.jsonl.part) joined in order
+
+    Args:
+        skip: URLs whose lines are left out
+
+    Returns:
+        Number of lines left out
+    """
+    parts = [site_dir / shard_filename(filename + ".part", index) for index in range(count)]
+    tmp_path = site_dir / (filename + ".part")
+    left_out = 0
+    with open(tmp_path, "wb") as out:
+        for part in parts:
+            with open(part, "rb") as f:
+                if not skip:
+                    shutil.copyfileobj(f, out)
+                    continue
+                for line in f:
+                    if json.loads(line)["url"] in skip:
+                        left_out += 1
+                    else:
+                        out.write(line)
+    os.replace(tmp_path, site_dir / filename)
+    for part in parts:
+        part.unlink()
+    return left_out
@@ -0,0 +1,137 @@
+"""
+robots.txt rules and streaming sitemap.xml discovery for seeding the crawl frontier.
+"""
+import logging
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional, Set, Tuple
+from urllib.parse import urljoin
+from urllib.robotparser import RobotFileParser
+from lxml import etree
+from .scheduler import RequestScheduler
+from .storage import CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+ROBOTS_AGENT = "mcp-windows-website-downloader"
+MAX_SITEMAP_DEPTH = 3
+MAX_SITEMAPS = 1000
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+async def fetch_robots(client: RequestScheduler, site_url: str) -> Optional[RobotFileParser]:
+    """
+    Fetch and parse a site's robots.txt
+
+    Follows the urllib.robotparser conventions: 401/403 disallow
+    everything, other errors or a missing file allow everything.
+
+    Returns:
+        The parsed rules, or None if robots.txt could not be fetched at all
+    """
+    robots_url = urljoin(site_url, "/robots.txt")
+    robots = RobotFileParser(robots_url)
+    try:
+        async with client.get(robots_url) as response:
+            if response.status in (401, 403):
+                robots.disallow_all = True
+            elif 400 <= response.status < 500:
+                robots.allow_all = True
+            elif response.status == 200:
+                text = await response.text(errors="replace")
+                robots.parse(text.splitlines())
+            else:
+                return None
+    except Exception as e:
+        logger.warning(f"Could not fetch {robots_url}: {str(e)}")
+        return None
+    return robots
+
+
+async def iter_sitemap(client: RequestScheduler, sitemap_url: str,
+                       seen: Optional[Set[str]] = None,
+                       depth: int = 0) -> AsyncIterator[Tuple[str, Optional[str]]]:
+    """
+    Stream (loc, lastmod) pairs from a sitemap or sitemap index
+
+    The body is fed to an incremental XML parser chunk by chunk (gunzipping
+    on the fly when needed) and each <url> element is discarded once read,
+    so memory stays flat however large the sitemap is. Nested sitemap
+    indexes are followed up to MAX_SITEMAP_DEPTH levels.
+    """
+    seen = seen if seen is not None else set()
+    if sitemap_url in seen or len(seen) >= MAX_SITEMAPS or depth > MAX_SITEMAP_DEPTH:
+        return
+    seen.add(sitemap_url)
+
+    children = []
+    try:
+        async with client.get(sitemap_url) as response:
+            if response.status != 200:
+                logger.info(f"No sitemap at {sitemap_url} ({response.status})")
+                return
+            parser = etree.XMLPullParser(events=("end",), resolve_entities=False, no_network=True, huge_tree=True)
+            decompressor = None
+            first = True
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                if first:
+                    # aiohttp undoes Content-Encoding, but .xml.gz files arrive still gzipped
+                    if chunk.startswith(GZIP_MAGIC):
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    first = False
+                parser.feed(decompressor.decompress(chunk) if decompressor else chunk)
+                for entry in _drain(parser):
+                    if entry[0] == "sitemap":
+                        children.append(entry[1])
+                    else:
+                        yield entry[1], entry[2]
+            if decompressor:
+                parser.feed(decompressor.flush())
+            parser.close()
+            for entry in _drain(parser):
+                if entry[0] == "sitemap":
+                    children.append(entry[1])
+                else:
+                    yield entry[1], entry[2]
+    except etree.XMLSyntaxError as e:
+        logger.warning(f"Malformed sitemap {sitemap_url}: {str(e)}")
+    except Exception as e:
+        logger.warning(f"Sitemap error ({sitemap_url}): {str(e)}")
+
+    for child in children:
+        async for entry in iter_sitemap(client, child, seen, depth + 1):
+            yield entry
+
+
+def _drain(parser: etree.XMLPullParser):
+    """Turn finished <url>/<sitemap> elements into tuples and free them"""
+    for _, elem in parser.read_events():
+        tag = etree.QName(elem).localname
+        if tag not in ("url", "sitemap"):
+            continue
+        loc = lastmod = None
+        for child in elem:
+            name = etree.QName(child).localname
+            if name == "loc" and child.text:
+                loc = child.text.strip()
+            elif name == "lastmod" and child.text:
+                lastmod = child.text.strip()
+        # Free the element and everything parsed before it
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+        if loc:
+            yield (tag, loc, lastmod)
+
+
+def parse_lastmod(value: Optional[str]) -> Optional[datetime]:
+    """Parse a W3C datetime (or plain date) from a sitemap into an aware datetime"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
@@ -0,0 +1,117 @@
+"""
+Non-blocking filesystem helpers for the downloader.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WRITE_WORKERS = 4
+CHUNK_SIZE = 64 * 1024
+
+
+class AsyncFileWriter:
+    """Runs filesystem work on a bounded thread pool so slow disks never block the event loop"""
+
+    def __init__(self, max_workers: int = DEFAULT_WRITE_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="site-writer")
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking filesystem call on the writer pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def mkdir(self, path: Path):
+        """Create a directory and its parents"""
+        await self.run(path.mkdir, parents=True, exist_ok=True)
+
+    async def write_text(self, path: Path, text: str, encoding: str = "utf-8"):
+        """Atomically write a text file"""
+        await self.run(atomic_write, path, text.encode(encoding))
+
+    async def write_bytes(self, path: Path, data: bytes):
+        """Atomically write a binary file"""
+        await self.run(atomic_write, path, data)
+
+    async def stream_to_temp(self, chunks: AsyncIterator[bytes], directory: Path,
+                             max_size: Optional[int] = None) -> Optional[Tuple[Path, str, int]]:
+        """
+        Stream chunks into a temp file inside directory
+
+        Args:
+            chunks: Async iterator of body chunks
+            directory: Directory the file will finally live in, so the rename stays atomic
+            max_size: Optional cap in bytes; the temp file is discarded once it is exceeded
+
+        Returns:
+            (temp path, SHA-256 hex digest, size in bytes), or None if max_size was exceeded
+        """
+        handle, tmp_path = await self.run(_open_temp, directory)
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    await self.run(handle.close)
+                    await self.discard(tmp_path)
+                    return None
+                hasher.update(chunk)
+                await self.run(handle.write, chunk)
+            await self.run(handle.close)
+        except BaseException:
+            await asyncio.shield(self.run(_close_and_remove, handle, tmp_path))
+            raise
+        return tmp_path, hasher.hexdigest(), size
+
+    async def commit(self, tmp_path: Path, path: Path):
+        """Atomically move a finished temp file into place"""
+        await self.run(os.replace, tmp_path, path)
+
+    async def discard(self, tmp_path: Path):
+        """Remove a temp file that is no longer needed"""
+        await self.run(_remove, tmp_path)
+
+    def shutdown(self):
+        """Stop the writer threads once queued work has finished"""
+        self._executor.shutdown(wait=True)
+
+
+def atomic_write(path: Path, data: bytes):
+    """Write data to a temp file next to path and rename it into place"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handle, tmp_path = _open_temp(path.parent)
+    try:
+        with handle:
+            handle.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+
+
+def _open_temp(directory: Path):
+    """Open a uniquely named temp file for writing in directory"""
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(prefix=".part-", dir=directory)
+    return os.fdopen(fd, "wb"), Path(name)
+
+
+def _close_and_remove(handle, tmp_path: Path):
+    handle.close()
+    _remove(tmp_path)
+
+
+def _remove(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
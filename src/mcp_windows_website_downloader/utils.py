@@ -1,8 +1,12 @@
 """
 Utility functions for website downloader.
 """
+import hashlib
 import re
+from fnmatch import fnmatch
 from pathlib import Path
+from typing import List, Optional
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode, quote, unquote
 
 def clean_filename(filename: str) -> str:
     """
@@ -24,4 +28,165 @@ def clean_filename(filename: str) -> str:
     # Clean up multiple underscores
     filename = re.sub(r"_+", "_", filename)
     
-    return filename.strip("_")
\ No newline at end of file
+    return filename.strip("_")
+
+def page_path(url: str) -> str:
+    """
+    Site-relative path a page URL is saved to
+    
+    Args:
+        url: Absolute page URL
+        
+    Returns:
+        Clean relative path ending in .html
+    """
+    path = urlparse(url).path.lstrip("/")
+    if not path:
+        path = "index.html"
+    elif not path.endswith((".html", ".htm")):
+        path = f"{path}.html"
+    return clean_filename(unquote(path))
+
+
+def asset_path(url: str) -> Optional[Path]:
+    """
+    Site-relative path an asset URL is saved to
+    
+    Args:
+        url: Absolute asset URL
+        
+    Returns:
+        Path under assets/<type>/, or None if the URL has no path
+    """
+    path = urlparse(url).path.lstrip("/")
+    if not path:
+        return None
+        
+    decoded = unquote(path)
+    filename = clean_filename(decoded)
+    # Flattening folds "/" into "_" and drops unsafe characters, so distinct paths
+    # could land on one name; a short hash of the path keeps those apart
+    if "_" in decoded or filename != decoded.replace("/", "_"):
+        digest = hashlib.sha256(decoded.encode("utf-8")).hexdigest()[:8]
+        name = Path(filename)
+        filename = f"{name.stem}-{digest}{name.suffix}"
+    
+    # Determine asset type and directory from the path (CSS often adds ?v=... or #iefix)
+    extension = path.lower()
+    if extension.endswith((".css", ".scss")):
+        asset_dir = "css"
+    elif extension.endswith((".js", ".mjs")):
+        asset_dir = "js"
+    elif extension.endswith((".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".avif", ".ico")):
+        asset_dir = "images"
+    elif extension.endswith((".woff", ".woff2", ".ttf", ".otf", ".eot")):
+        asset_dir = "fonts"
+    elif extension.endswith((".mp4", ".webm", ".ogv", ".mp3", ".ogg", ".wav", ".vtt")):
+        asset_dir = "media"
+    else:
+        asset_dir = "other"
+        
+    return Path("assets") / asset_dir / filename
+
+
+# Query parameters that never change which document is served. Not "ref": docs
+# hosts use it to pick a branch or version, so callers opt in to ignoring it.
+DEFAULT_IGNORED_PARAMS = ["highlight", "utm_*", "fbclid", "gclid", "ref_src"]
+TRAILING_SLASH_POLICIES = ("keep", "strip", "add", "strip-files")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class UrlCanonicalizer:
+    """
+    Maps the many spellings of a URL to one canonical form
+    
+    Used as the key for the crawl frontier and the asset registry so that
+    page.html#section, page.html?highlight=foo, ./page.html and
+    HTTP://Host:80/page.html all count as the same document.
+    """
+    
+    def __init__(self, ignored_params: Optional[List[str]] = None,
+                 trailing_slash: str = "strip-files", lowercase_path: bool = False):
+        """
+        Args:
+            ignored_params: fnmatch patterns of query parameters to drop; ["*"] drops
+                the whole query. Defaults to DEFAULT_IGNORED_PARAMS.
+            trailing_slash: "keep", "strip", "add", or "strip-files" to strip it only
+                after a segment with a file extension (page.html/ -> page.html)
+            lowercase_path: Also lowercase the path, for case-insensitive servers
+        """
+        if trailing_slash not in TRAILING_SLASH_POLICIES:
+            raise ValueError(f"trailing_slash must be one of {', '.join(TRAILING_SLASH_POLICIES)}")
+        self.ignored_params = DEFAULT_IGNORED_PARAMS if ignored_params is None else ignored_params
+        self.trailing_slash = trailing_slash
+        self.lowercase_path = lowercase_path
+        
+    def canonicalize(self, url: str) -> str:
+        """Return the canonical form of an absolute URL"""
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        
+        # Lowercase host, drop default port and credentials
+        host = (parts.hostname or "").rstrip(".")
+        if ":" in host:
+            host = f"[{host}]"
+        port = parts.port
+        netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+        
+        path = remove_dot_segments(parts.path) or "/"
+        if self.lowercase_path:
+            path = path.lower()
+        path = self._apply_trailing_slash(path)
+        
+        query = urlencode(
+            sorted(
+                (name, value)
+                for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                if not any(fnmatch(name, pattern) for pattern in self.ignored_params)
+            ),
+            quote_via=quote
+        )
+        return urlunsplit((scheme, netloc, path, query, ""))
+        
+    def _apply_trailing_slash(self, path: str) -> str:
+        """Apply the trailing-slash policy to a non-root path"""
+        if path == "/" or self.trailing_slash == "keep":
+            return path
+        if self.trailing_slash == "add":
+            last = path.rsplit("/", 1)[-1]
+            return path if path.endswith("/") or "." in last else f"{path}/"
+        stripped = path.rstrip("/") or "/"
+        if self.trailing_slash == "strip":
+            return stripped
+        # strip-files: only when the last segment looks like a file
+        return stripped if "." in stripped.rsplit("/", 1)[-1] else path
+
+
+def remove_dot_segments(path: str) -> str:
+    """
+    Resolve "." and ".." segments as described in RFC 3986 section 5.2.4
+    
+    Args:
+        path: URL path
+        
+    Returns:
+        Path without dot segments
+    """
+    output: List[str] = []
+    segments = path.split("/")
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == ".":
+            if last:
+                output.append("")
+        elif segment == "..":
+            if len(output) > 1:
+                output.pop()
+            if last:
+                output.append("")
+        else:
+            output.append(segment)
+    result = "/".join(output)
+    if path.startswith("/") and not result.startswith("/"):
+        result = "/" + result
+    return result
@@ -0,0 +1,1043 @@
+"""
+Test cases for the WebsiteDownloader crawl engine
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import mcp.server.stdio
+from mcp.server.lowlevel.server import request_ctx
+from mcp.shared.context import RequestContext
+from mcp_windows_website_downloader.archive import ArchiveReader, SiteArchive
+from mcp_windows_website_downloader.content import extract_chunks
+from mcp_windows_website_downloader.dedup import simhash
+from mcp_windows_website_downloader.downloader import WebsiteDownloader
+from mcp_windows_website_downloader.jobs import DownloadJob
+from mcp_windows_website_downloader.parser import ParsePool, parse_page, extract_page
+from mcp_windows_website_downloader.search import SearchIndex, StagedSearchIndex
+from mcp_windows_website_downloader.server import WebsiteDownloaderServer
+from mcp_windows_website_downloader.utils import UrlCanonicalizer, clean_filename
+
+HITS = web.AppKey("hits", dict)
+
+
+def make_site(pages: int = 20, robots: Optional[str] = None, sitemap: bool = False) -> web.Application:
+    """
+    Build a small docs-like site where every page links to the next two
+
+    With sitemap=True it also serves /sitemap_index.xml pointing at a gzipped
+    sitemap that lists every page with a lastmod.
+    """
+    app = web.Application()
+    app[HITS] = {}
+
+    async def page(request):
+        name = request.match_info.get("name", "index")
+        if name != "index" and not re.fullmatch(r"page\d+\.html", name):
+            raise web.HTTPNotFound()
+        app[HITS][request.path] = app[HITS].get(request.path, 0) + 1
+        number = 0 if name == "index" else int(name.removeprefix("page").removesuffix(".html"))
+        image = '<img src="/static/diagram.png">' if name == "index" else ""
+        links = image + "".join(
+            f'<a href="/page{n}.html">page {n}</a>'
+            for n in (number + 1, number + 2) if n < pages
+        )
+        html = (
+            '<html><head><link rel="stylesheet" href="/static/theme.css"></head>'
+            f'<body><div class="sphinxsidebar"></div>{links}</body></html>'
+        )
+        etag = f'"{name}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.Response(text=html, content_type="text/html", headers={"ETag": etag})
+
+    async def stylesheet(request):
+        app[HITS][request.path] = app[HITS].get(request.path, 0) + 1
+        return web.Response(text="body { color: black; }", content_type="text/css")
+
+    async def image(request):
+        app[HITS][request.path] = app[HITS].get(request.path, 0) + 1
+        return web.Response(body=b"\x89PNG" + b"\0" * 200_000, content_type="image/png")
+
+    async def robots_txt(request):
+        return web.Response(text=robots, content_type="text/plain")
+
+    async def sitemap_index(request):
+        return web.Response(text=(
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            f'<sitemap><loc>{request.url.origin()}/sitemap-pages.xml.gz</loc></sitemap>'
+            '</sitemapindex>'
+        ), content_type="application/xml")
+
+    async def sitemap_pages(request):
+        urls = "".join(
+            f"<url><loc>{request.url.origin()}/{'page%d.html' % n if n else ''}</loc>"
+            "<lastmod>2024-05-01</lastmod></url>"
+            for n in range(pages)
+        )
+        xml = ('<?xml version="1.0" encoding="UTF-8"?>'
+               f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>')
+        return web.Response(body=gzip.compress(xml.encode()), content_type="application/x-gzip")
+
+    if robots is not None:
+        app.router.add_get("/robots.txt", robots_txt)
+    if sitemap:
+        app.router.add_get("/sitemap_index.xml", sitemap_index)
+        app.router.add_get("/sitemap-pages.xml.gz", sitemap_pages)
+    app.router.add_get("/", page)
+    app.router.add_get("/{name}", page)
+    app.router.add_get("/static/theme.css", stylesheet)
+    app.router.add_get("/static/diagram.png", image)
+    return app
+
+
+@pytest_asyncio.fixture
+async def site():
+    """Serve the synthetic site on a local port"""
+    server = TestServer(make_site(), host="127.0.0.1")
+    await server.start_server()
+    yield server
+    await server.close()
+
+
+@pytest_asyncio.fixture
+async def downloader(tmp_path):
+    """Downloader writing into a temporary library, parsing in-process"""
+    downloader = WebsiteDownloader(tmp_path, parse_pool=ParsePool(0))
+    yield downloader
+    await downloader.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_crawl_visits_every_page_once(site, downloader):
+    """Every reachable page is fetched exactly once by the worker pool"""
+    result = await downloader.download(str(site.make_url("/")), concurrency=4)
+
+    assert result["status"] == "success"
+    assert result["depth_used"] == 4
+    page_hits = {path: n for path, n in site.app[HITS].items() if path.endswith(".html")}
+    assert all(n == 1 for n in page_hits.values())
+    # depth 4 reaches pages 1-8 from the index
+    assert result["pages"] == 9
+    index = json.loads((Path(result["path"]) / "rag_index.json").read_text())
+    assert index["pages"] == 9
+
+
+@pytest.mark.asyncio
+async def test_page_found_again_at_a_shallower_depth(downloader):
+    """A page first queued through a long path still gets its links followed from its shortest one"""
+    graph = {"/": ["/slow.html", "/fast.html"], "/fast.html": ["/fast2.html"], "/fast2.html": ["/mid.html"],
+             "/slow.html": ["/mid.html"], "/mid.html": ["/leaf.html"], "/leaf.html": ["/end.html"], "/end.html": []}
+    fetched = []
+
+    async def handler(request):
+        if request.path not in graph:
+            raise web.HTTPNotFound()
+        if request.path == "/slow.html":
+            await asyncio.sleep(0.5)
+        fetched.append(request.path)
+        links = "".join(f'<a href="{link}">{link}</a>' for link in graph[request.path])
+        return web.Response(text=f'<html><body><div class="sphinxsidebar"></div>{request.path} {links}</body></html>',
+                            content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    try:
+        # depth 4: /mid.html is at depth 2 via /slow.html, but /fast2.html queues it at 3 first
+        result = await downloader.download(str(server.make_url("/")), concurrency=4, skip_duplicates=False)
+    finally:
+        await server.close()
+
+    assert result["depth_used"] == 4
+    assert "/end.html" in fetched
+    assert sorted(fetched) == sorted(graph)
+
+
+@pytest.mark.asyncio
+async def test_max_pages_budget(site, downloader):
+    """The crawl stops accepting pages once the budget is spent"""
+    result = await downloader.download(str(site.make_url("/")), concurrency=2, max_pages=3)
+
+    assert result["status"] == "success"
+    assert result["pages"] == 3
+
+
+@pytest.mark.asyncio
+async def test_shared_assets_fetched_once(site, downloader):
+    """Theme assets referenced by every page are downloaded a single time"""
+    result = await downloader.download(str(site.make_url("/")), concurrency=4)
+
+    assert result["status"] == "success"
+    assert site.app[HITS]["/static/theme.css"] == 1
+    assert (Path(result["path"]) / "assets" / "css" / "static_theme.css").exists()
+
+
+@pytest.mark.asyncio
+async def test_recrawl_uses_conditional_requests(site, downloader):
+    """A second crawl of an unchanged site gets 304s and reports no changes"""
+    first = await downloader.download(str(site.make_url("/")), concurrency=4)
+    assert first["changes"]["added"] == first["pages"] + 2  # pages plus the stylesheet and image
+    site_dir = Path(first["path"])
+    assert (site_dir / "crawl_manifest.json").exists()
+
+    index_file = site_dir / "index.html"
+    mtime = index_file.stat().st_mtime_ns
+    second = await downloader.download(str(site.make_url("/")), concurrency=4)
+
+    assert second["pages"] == first["pages"]
+    assert second["changes"]["added"] == 0
+    assert second["changes"]["changed"] == 0
+    assert second["changes"]["removed"] == 0
+    assert second["changes"]["unchanged"] == first["changes"]["added"]
+    assert index_file.stat().st_mtime_ns == mtime
+
+
+@pytest.mark.asyncio
+async def test_partial_recrawl_keeps_pages_it_did_not_reach(site, downloader):
+    """A budgeted re-crawl carries the other pages' manifest entries, index rows and chunks forward"""
+    url = str(site.make_url("/"))
+    first = await downloader.download(url, concurrency=4, export_chunks=True)
+    site_dir = Path(first["path"])
+    manifest = json.loads((site_dir / "crawl_manifest.json").read_text())
+    chunks = (site_dir / "chunks.jsonl").read_text().splitlines()
+
+    second = await downloader.download(url, concurrency=4, max_pages=2, export_chunks=True)
+
+    assert second["pages"] == 2
+    assert second["changes"]["removed"] == 0
+    assert json.loads((site_dir / "crawl_manifest.json").read_text())["entries"].keys() == manifest["entries"].keys()
+    assert sorted((site_dir / "chunks.jsonl").read_text().splitlines()) == sorted(chunks)
+    rows = downloader.search_index._connect().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+    assert rows == first["pages"]
+
+
+@pytest.mark.asyncio
+async def test_only_pages_that_are_gone_are_removed(downloader):
+    """A complete re-crawl drops pages that now answer 404, and keeps ones that merely failed"""
+    missing = set()
+
+    async def handler(request):
+        if request.path in missing:
+            raise web.HTTPNotFound()
+        if request.path == "/flaky.html" and missing:
+            raise web.HTTPServiceUnavailable()
+        if request.path == "/":
+            links = '<a href="/old.html">old</a><a href="/flaky.html">flaky</a>'
+            return web.Response(text=f"<html><body>{links}</body></html>", content_type="text/html")
+        if request.path in ("/old.html", "/flaky.html"):
+            word = "zebra" if request.path == "/old.html" else "quokka"
+            return web.Response(text=f"<html><body>{word} text</body></html>", content_type="text/html")
+        raise web.HTTPNotFound()
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    try:
+        url = str(server.make_url("/"))
+        old, flaky = str(server.make_url("/old.html")), str(server.make_url("/flaky.html"))
+        first = await downloader.download(url, max_retries=0, skip_duplicates=False)
+        assert first["pages"] == 3
+        missing.add("/old.html")
+        second = await downloader.download(url, max_retries=0, skip_duplicates=False)
+    finally:
+        await server.close()
+
+    assert second["changes"]["removed"] == 1
+    entries = json.loads((Path(second["path"]) / "crawl_manifest.json").read_text())["entries"]
+    assert old not in entries
+    assert flaky in entries
+    assert downloader.search_index.search("zebra") == []
+    assert downloader.search_index.search("quokka")
+
+
+@pytest.mark.asyncio
+async def test_assets_stream_to_disk_with_size_cap(site, downloader):
+    """Assets are streamed into place and oversized ones leave nothing behind"""
+    result = await downloader.download(str(site.make_url("/")), max_asset_size=100_000)
+
+    assert result["status"] == "success"
+    site_dir = Path(result["path"])
+    images = site_dir / "assets" / "images"
+    assert not (images / "static_diagram.png").exists()
+    assert list(images.iterdir()) == []
+    assert (site_dir / "assets" / "css" / "static_theme.css").read_text() == "body { color: black; }"
+
+    result = await downloader.download(str(site.make_url("/")))
+    assert (images / "static_diagram.png").stat().st_size == 200_004
+
+
+@pytest.mark.parametrize("parse", [parse_page, extract_page])
+def test_parse_page_rewrites_and_collects(parse):
+    """Both parse paths return rewritten HTML plus in-domain links and assets"""
+    body = (
+        b'<html><head><link rel="stylesheet" href="_static/basic.css">'
+        b'<script src="https://cdn.example.org/lib.js"></script></head>'
+        b'<body><a href="api/module.html">api</a><a href="#top">top</a>'
+        b'<a href="https://other.example.org/">out</a><img src="/img/logo.png"'
+        b' srcset="/img/logo.png 1x, /img/logo@2x.png 2x"></body></html>'
+    )
+    parsed = parse(body, "https://docs.example.com/en/index.html", "docs.example.com")
+
+    assert parsed["links"] == ["https://docs.example.com/en/api/module.html"]
+    assert sorted(parsed["assets"]) == [
+        "https://docs.example.com/en/_static/basic.css",
+        "https://docs.example.com/img/logo.png",
+        "https://docs.example.com/img/logo@2x.png",
+    ]
+    assert b'href="/en_api_module.html"' in parsed["html"]
+    # "_" in the path makes the flattened name ambiguous, so it gets a path hash
+    assert re.search(rb'href="assets/css/en_static_basic-[0-9a-f]{8}\.css"', parsed["html"])
+    assert b'src="https://cdn.example.org/lib.js"' in parsed["html"]
+    assert b'srcset="assets/images/img_logo.png 1x, assets/images/img_logo@2x.png 2x"' in parsed["html"]
+
+
+def test_extract_page_skips_comments_and_raw_text():
+    """Markup inside comments and script bodies is left alone, bytes elsewhere are untouched"""
+    body = (
+        b"<!DOCTYPE html><p>caf\xc3\xa9</p><!-- <a href='old.html'> -->"
+        b"<script>var s = '<a href=\"fake.html\">';</script>"
+        b"<A HREF=guide.html?x=1&amp;y=2 class=nav>guide</A>"
+    )
+    parsed = extract_page(body, "https://docs.example.com/", "docs.example.com")
+
+    assert parsed["links"] == ["https://docs.example.com/guide.html?x=1&y=2"]
+    assert parsed["html"] == body.replace(b"guide.html?x=1&amp;y=2", b'"/guide.html"')
+
+
+@pytest.mark.parametrize("tail", [b"x=y/", b'x="y"/', b"x /", b"x= y "])
+def test_extract_page_handles_unclosed_tags_in_linear_time(tail):
+    """An unclosed tag full of attributes can't make the tokenizer backtrack exponentially"""
+    body = b"<a " + tail * 5000 + b'<a href=/docs/page.html>docs</a>'
+    started = time.perf_counter()
+    parsed = extract_page(body, "https://docs.example.com/", "docs.example.com")
+
+    assert time.perf_counter() - started < 1.0
+    assert parsed["links"] == ["https://docs.example.com/docs/page.html"]
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTPS://Docs.Example.com:443/a/./b/../page.html#intro", "https://docs.example.com/a/page.html"),
+    ("https://docs.example.com/page.html?highlight=foo", "https://docs.example.com/page.html"),
+    ("https://docs.example.com/page.html/", "https://docs.example.com/page.html"),
+    ("https://docs.example.com/guide/", "https://docs.example.com/guide/"),
+    ("http://docs.example.com:8080/search.html?q=x&utm_source=y&a=1", "http://docs.example.com:8080/search.html?a=1&q=x"),
+    ("https://docs.example.com", "https://docs.example.com/"),
+    ("https://docs.example.com/api.html?ref=v2&ref_src=twsrc", "https://docs.example.com/api.html?ref=v2"),
+])
+def test_canonicalize_url(url, expected):
+    """Fragment, tracking params, default port, host case, dot segments and file slashes collapse"""
+    assert UrlCanonicalizer().canonicalize(url) == expected
+
+
+def test_canonicalize_url_lowercase_path():
+    """lowercase_path folds the case of the path but leaves the query alone"""
+    canonicalizer = UrlCanonicalizer(lowercase_path=True)
+    assert canonicalizer.canonicalize("https://Docs.example.com/Guide/Page.HTML?Q=X") == \
+        "https://docs.example.com/guide/page.html?Q=X"
+    assert UrlCanonicalizer().canonicalize("https://docs.example.com/Guide.html") == \
+        "https://docs.example.com/Guide.html"
+
+
+@pytest.mark.asyncio
+async def test_url_variants_fetched_once(downloader):
+    """Spellings of the same page share one entry in the frontier"""
+    hits = {}
+
+    async def handler(request):
+        hits[request.path_qs] = hits.get(request.path_qs, 0) + 1
+        links = "".join(
+            f'<a href="{href}">x</a>'
+            for href in ("page.html#a", "page.html?highlight=foo", "./page.html", "PAGE/../page.html", "page.html/")
+        )
+        return web.Response(text=f"<html><body>{request.path} {links}</body></html>", content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    try:
+        result = await downloader.download(str(server.make_url("/")))
+    finally:
+        await server.close()
+
+    assert result["pages"] == 2
+    # the crawl reuses the site analysis fetch of the index; robots.txt and sitemap.xml are looked up once
+    assert hits == {"/": 1, "/page.html": 1, "/robots.txt": 1, "/sitemap.xml": 1}
+
+
+@pytest.mark.asyncio
+async def test_lowercase_path_fetches_case_variants_once(downloader):
+    """With lowercase_path, /Guide.html and /GUIDE.html are one page on a case-insensitive server"""
+    hits = {}
+
+    async def handler(request):
+        hits[request.path] = hits.get(request.path, 0) + 1
+        links = "".join(f'<a href="{href}">x</a>' for href in ("Guide.html", "guide.html", "GUIDE.html"))
+        return web.Response(text=f"<html><body>{request.path} {links}</body></html>", content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    server = await serve(app)
+    try:
+        result = await downloader.download(str(server.make_url("/")), lowercase_path=True)
+    finally:
+        await server.close()
+
+    assert result["pages"] == 2
+    assert hits == {"/": 1, "/guide.html": 1, "/robots.txt": 1, "/sitemap.xml": 1}
+
+
+@pytest.mark.asyncio
+async def test_parallel_crawls_keep_separate_state(site, tmp_path):
+    """Two sites crawled at once through one downloader don't clobber each other"""
+    other = TestServer(make_site(pages=6), host="127.0.0.1")
+    await other.start_server()
+    urls = [str(site.make_url("/")), str(other.make_url("/"))]
+    downloader = WebsiteDownloader(tmp_path, parse_pool=ParsePool(2), max_connections=8)
+    try:
+        first, second = await asyncio.gather(
+            *(downloader.download(url, concurrency=4) for url in urls)
+        )
+    finally:
+        await downloader.close()
+        await other.close()
+
+    assert first["status"] == second["status"] == "success"
+    assert first["path"] != second["path"]
+    assert first["pages"] == 9
+    assert second["pages"] == 6
+    for result, url in zip((first, second), urls):
+        index = json.loads((Path(result["path"]) / "rag_index.json").read_text())
+        assert index["url"] == url
+        assert index["pages"] == result["pages"]
+
+
+async def serve(app: web.Application) -> TestServer:
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    return server
+
+
+@pytest.mark.asyncio
+async def test_sitemap_seeds_pages_beyond_link_depth(downloader):
+    """A gzipped sitemap behind a sitemap index reaches pages the link depth misses"""
+    server = await serve(make_site(robots="User-agent: *\nSitemap: /sitemap_index.xml\n", sitemap=True))
+    try:
+        result = await downloader.download(str(server.make_url("/")), concurrency=4)
+    finally:
+        await server.close()
+
+    assert result["status"] == "success"
+    assert result["sitemap_urls"] == 20
+    # depth 4 alone reaches 9 pages; the sitemap adds the other 11
+    assert result["pages"] == 20
+
+
+@pytest.mark.asyncio
+async def test_robots_disallow_is_honored(downloader):
+    """Disallowed pages are never requested"""
+    server = await serve(make_site(robots="User-agent: *\nDisallow: /page3.html\n"))
+    try:
+        result = await downloader.download(str(server.make_url("/")), concurrency=4)
+        hits = dict(server.app[HITS])
+    finally:
+        await server.close()
+
+    assert result["status"] == "success"
+    assert "/page3.html" not in hits
+    assert result["robots_blocked"] == 1
+    assert result["pages"] == 8
+
+
+@pytest.mark.asyncio
+async def test_sitemap_lastmod_skips_unchanged_pages(downloader):
+    """A re-crawl does not request pages whose sitemap lastmod has not moved"""
+    server = await serve(make_site(robots="Sitemap: /sitemap_index.xml\n", sitemap=True))
+    try:
+        url = str(server.make_url("/"))
+        first = await downloader.download(url, concurrency=4)
+        before = dict(server.app[HITS])
+        second = await downloader.download(url, concurrency=4)
+        after = dict(server.app[HITS])
+    finally:
+        await server.close()
+
+    assert first["pages"] == second["pages"] == 20
+    assert second["changes"]["unchanged"] >= 20
+    refetched = [path for path in after if path.endswith(".html") and after[path] > before[path]]
+    # Only pages reached through links before their sitemap entry streamed in are asked for again
+    assert second["skipped_by_lastmod"] + len(refetched) <= 20
+    assert second["skipped_by_lastmod"] >= 10
+
+
+@pytest.mark.asyncio
+async def test_resume_after_cancel(site, downloader):
+    """A cancelled crawl resumes from its journal without refetching finished pages"""
+    url = str(site.make_url("/"))
+    finished = asyncio.Event()
+
+    def on_progress(progress):
+        if progress["pages_done"] >= 3:
+            finished.set()
+
+    task = asyncio.create_task(downloader.download(url, concurrency=2, on_progress=on_progress))
+    await finished.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    site_dir = downloader.output_dir / clean_filename(f"127.0.0.1:{site.port}")
+    assert (site_dir / "crawl_journal.sqlite").exists()
+    before = dict(site.app[HITS])
+
+    result = await downloader.download(url, concurrency=2, resume=True)
+
+    assert result["status"] == "success"
+    assert result["resumed"] is True
+    assert result["pages"] == 9
+    # Restored from the journal rather than re-detected, since the start page is not fetched again
+    assert result["framework"] == "sphinx"
+    refetched = [path for path in before if path.endswith(".html") and site.app[HITS][path] > before[path]]
+    # Only pages that were in flight when the crawl was cancelled are fetched again
+    assert len(refetched) <= 2
+    assert not (site_dir / "crawl_journal.sqlite").exists()
+
+
+@pytest.mark.asyncio
+async def test_pages_are_searchable(downloader):
+    """Saved pages land in the library search index, main content only"""
+    pages = {
+        "/": '<html><head><title>Home</title></head><body><nav>Widgets menu</nav>'
+             '<main>Welcome. <a href="/guide.html">guide</a></main></body></html>',
+        "/guide.html": '<html><head><title>Guide</title></head><body>'
+                       '<main><h1>Configuring frobnicators</h1><p>Set the frobnicator depth first.</p></main>'
+                       '<footer>Widgets copyright</footer></body></html>',
+    }
+
+    async def handler(request):
+        if request.path not in pages:
+            raise web.HTTPNotFound()
+        return web.Response(text=pages[request.path], content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    server = await serve(app)
+    try:
+        result = await downloader.download(str(server.make_url("/")))
+    finally:
+        await server.close()
+
+    hits = downloader.search_index.search("frobnicator")
+    assert [hit["title"] for hit in hits] == ["Guide"]
+    assert hits[0]["path"] == str(Path(result["path"]) / "guide.html")
+    assert "[frobnicator]" in hits[0]["snippet"]
+    # Navigation and footer text is not indexed
+    assert downloader.search_index.search("widgets") == []
+    assert downloader.search_index.search("frobnicator", site="elsewhere") == []
+
+
+@pytest.mark.asyncio
+async def test_chunk_export_is_refreshed_incrementally(site, downloader):
+    """Chunks are written during the crawl and carried over unchanged on a re-crawl"""
+    url = str(site.make_url("/"))
+    first = await downloader.download(url, concurrency=4, export_chunks=True)
+    export = Path(first["path"]) / "chunks.jsonl"
+    records = [json.loads(line) for line in export.read_text().splitlines()]
+
+    assert {record["url"] for record in records} == {
+        url.rstrip("/") + path for path in ["/"] + [f"/page{n}.html" for n in range(1, 9)]
+    }
+    assert all(record["tokens"] > 0 and len(record["id"]) == 16 for record in records)
+    index = json.loads((Path(first["path"]) / "rag_index.json").read_text())
+    assert index["chunks"]["count"] == len(records)
+
+    second = await downloader.download(url, concurrency=4, export_chunks=True)
+    assert second["changes"]["unchanged"] == second["pages"] + 2
+    assert sorted(export.read_text().splitlines()) == sorted(json.dumps(r) for r in records)
+
+
+def test_extract_chunks_follows_headings():
+    """Chunks stay inside their section and carry its heading path"""
+    body = (b"<html><body><nav>Menu</nav><main><h1>Guide</h1><p>Intro.</p>"
+            b"<h2>Install</h2><p>Run the installer.</p><pre>pip install x</pre>"
+            b"<h2>Usage</h2><p>" + b"word " * 30 + b"</p></main></body></html>")
+    chunks = extract_chunks(body, max_tokens=20)
+
+    assert [chunk["headings"] for chunk in chunks] == [
+        ["Guide"], ["Guide", "Install"], ["Guide", "Usage"], ["Guide", "Usage"]
+    ]
+    assert chunks[1]["text"] == "Run the installer.\n\npip install x"
+    assert all(chunk["tokens"] <= 20 for chunk in chunks)
+    assert "Menu" not in "".join(chunk["text"] for chunk in chunks)
+
+
+@pytest.mark.asyncio
+async def test_assets_shared_across_sites_through_blob_store(site, tmp_path):
+    """The same bytes served by two sites are stored once and hardlinked into both"""
+    other = await serve(make_site(pages=3))
+    downloader = WebsiteDownloader(tmp_path, parse_pool=ParsePool(0))
+    try:
+        first = await downloader.download(str(site.make_url("/")))
+        second = await downloader.download(str(other.make_url("/")))
+    finally:
+        await downloader.close()
+        await other.close()
+
+    assert second["assets_deduplicated"] == 2
+    first_css = Path(first["path"]) / "assets" / "css" / "static_theme.css"
+    second_css = Path(second["path"]) / "assets" / "css" / "static_theme.css"
+    assert first_css.read_text() == "body { color: black; }"
+    assert os.path.samefile(first_css, second_css)
+    assert len([p for p in (tmp_path / ".blobs").rglob("*") if p.is_file()]) == 2
+
+
+@pytest.mark.asyncio
+async def test_compressed_blobs_are_referenced_from_manifest(site, tmp_path):
+    """With gzip compression text assets are stored compressed, yet pages' asset links still resolve"""
+    downloader = WebsiteDownloader(tmp_path, parse_pool=ParsePool(0), blob_compression="gzip")
+    try:
+        first = await downloader.download(str(site.make_url("/")))
+        site_dir = Path(first["path"])
+        manifest = json.loads((site_dir / "crawl_manifest.json").read_text())
+        entry = manifest["entries"][str(site.make_url("/static/theme.css"))]
+        blob = site_dir / entry["blob"]
+        assert blob.suffix == ".gz"
+        assert downloader.blobs.read(blob) == b"body { color: black; }"
+        assert (site_dir / entry["path"]).read_bytes() == b"body { color: black; }"
+        # Images are not compressed, so they are still linked into the site
+        assert (site_dir / "assets" / "images" / "static_diagram.png").exists()
+        home = (site_dir / "index.html").read_text()
+        references = re.findall(r'(?:href|src)="(assets/[^"]+)"', home)
+        assert "assets/css/static_theme.css" in references
+        assert all((site_dir / reference).is_file() for reference in references)
+
+        second = await downloader.download(str(site.make_url("/")))
+    finally:
+        await downloader.close()
+
+    assert second["changes"]["removed"] == 0
+
+
+@pytest.mark.asyncio
+async def test_warc_output_mode(site, downloader):
+    """Pages and assets go into one WARC that the reader serves by URL or path"""
+    url = str(site.make_url("/"))
+    first = await downloader.download(url, concurrency=4, output="warc")
+    site_dir = Path(first["path"])
+
+    assert first["status"] == "success"
+    assert not list(site_dir.glob("*.html"))
+    assert not (site_dir / "assets").exists()
+    with ArchiveReader(site_dir) as reader:
+        entry, body = reader.read(url)
+        assert entry["mime"].startswith("text/html")
+        assert b'href="/page1.html"' in body
+        assert reader.read("/page1.html")[0]["url"] == str(site.make_url("/page1.html"))
+        assert reader.read("assets/css/static_theme.css")[1] == b"body { color: black; }"
+        assert len(reader.index) == first["pages"] + 2
+
+    size = (site_dir / "site.warc").stat().st_size
+    second = await downloader.download(url, concurrency=4, output="warc")
+    assert second["changes"]["unchanged"] == second["pages"] + 2
+    # Nothing changed, so nothing was appended
+    assert (site_dir / "site.warc").stat().st_size == size
+
+
+def test_archive_recovers_unindexed_records(tmp_path):
+    """Records written after the last index save survive; a torn record is cut off"""
+    archive = SiteArchive(tmp_path)
+    archive.open()
+    archive.add_bytes("https://example.com/", "index.html", "text/html", b"<p>home</p>")
+    archive.save_index()
+    archive.add_bytes("https://example.com/a.html", "a.html", "text/html", b"<p>a</p>")
+    archive.close()
+    with open(tmp_path / "site.warc", "ab") as f:
+        f.write(b"WARC/1.1\r\nWARC-Type: resource\r\nContent-Length: 500\r\n\r\npartial")
+
+    archive = SiteArchive(tmp_path)
+    archive.open()
+    archive.save_index()
+    archive.close()
+
+    with ArchiveReader(tmp_path) as reader:
+        assert reader.read("a.html")[1] == b"<p>a</p>"
+        assert reader.read("https://example.com/")[1] == b"<p>home</p>"
+    assert not (tmp_path / "site.warc").read_bytes().endswith(b"partial")
+
+
+def make_mirrored_site() -> web.Application:
+    """/stable/p0-7, a /latest/ mirror naming them as canonical, and a near-identical printable p0"""
+    vocabulary = [f"term{n}" for n in range(300)]
+
+    def words(seed: int):
+        rng = random.Random(seed)
+        return [rng.choice(vocabulary) for _ in range(400)]
+
+    def page(text: str, canonical: str = "") -> str:
+        link = f'<link rel="canonical" href="{canonical}">' if canonical else ""
+        return f"<html><head>{link}</head><body><main><p>{text}</p></main></body></html>"
+
+    printable = words(0)
+    printable[200] = "printable"
+    pages = {f"/stable/p{n}.html": page(" ".join(words(n))) for n in range(8)}
+    pages.update({f"/latest/p{n}.html": page(" ".join(words(n)), f"/stable/p{n}.html") for n in range(8)})
+    pages["/stable/print.html"] = page(" ".join(printable))
+    pages["/"] = page("".join(f'<a href="{path}">{path}</a>' for path in pages))
+
+    async def handler(request):
+        if request.path not in pages:
+            raise web.HTTPNotFound()
+        return web.Response(text=pages[request.path], content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    return app
+
+
+@pytest.mark.asyncio
+async def test_duplicate_pages_are_skipped_and_mirrors_pruned(downloader):
+    """Mirrored and near-identical pages are not saved, and a mirrored subtree stops being crawled"""
+    server = await serve(make_mirrored_site())
+    origin = str(server.make_url("")).rstrip("/")
+    try:
+        result = await downloader.download(origin + "/", concurrency=1, prune_duplicates=True)
+    finally:
+        await server.close()
+
+    assert result["pages"] == 9
+    assert result["duplicates"] == {"exact": 5, "near": 1, "pruned_urls": 3, "canonical_links": 5,
+                                    "pruned_subtrees": ["/latest/"]}
+    site_dir = Path(result["path"])
+    assert (site_dir / "stable_p0.html").exists()
+    assert not list(site_dir.glob("latest_*.html"))
+    assert not (site_dir / "stable_print.html").exists()
+    # Links to skipped pages point at the kept page, or back at the site when pruned unseen
+    home = (site_dir / "index.html").read_text()
+    assert 'href="/stable_p0.html">/latest/p0.html<' in home
+    assert 'href="/stable_p0.html">/stable/print.html<' in home
+    assert f'href="{origin}/latest/p7.html"' in home
+    assert "latest_" not in home and "stable_print" not in home
+    index = json.loads((site_dir / "rag_index.json").read_text())
+    assert index["duplicates"][origin + "/latest/p0.html"] == origin + "/stable/p0.html"
+    assert index["duplicates"][origin + "/stable/print.html"] == origin + "/stable/p0.html"
+    manifest = json.loads((site_dir / "crawl_manifest.json").read_text())
+    assert len(manifest["entries"][origin + "/stable/p3.html"]["simhash"]) == 16
+
+
+def test_simhash_sets_the_bits_most_shingles_set():
+    """The byte tallies give the same SimHash as counting each bit over every shingle hash"""
+    rng = random.Random(1)
+    for size in (1, 2, 3, 60, 500):
+        words = [f"w{rng.randrange(40)}" for _ in range(size)]
+        hashes = [
+            int.from_bytes(hashlib.blake2b(" ".join(words[i:i + 3]).encode("utf-8"), digest_size=8).digest(), "big")
+            for i in range(max(1, size - 2))
+        ]
+        expected = sum(1 << bit for bit in range(64) if sum(h >> bit & 1 for h in hashes) > len(hashes) / 2)
+        assert simhash(words) == expected
+
+
+@pytest.mark.asyncio
+async def test_scope_rules_and_content_types(site, downloader):
+    """Include/exclude rules and allowed types decide what is fetched, before any body is read"""
+    result = await downloader.download(
+        str(site.make_url("/")), concurrency=2,
+        include=["/page[1-3].html"], exclude=["re:diagram"], allowed_types=["text/html"]
+    )
+
+    assert result["pages"] == 4
+    assert result["skipped"]["out_of_scope"] >= 2  # page4, page5 and the excluded image
+    assert result["skipped"]["content_type"] == 1  # theme.css
+    hits = site.app[HITS]
+    assert "/page4.html" not in hits and "/static/diagram.png" not in hits
+    assert hits["/static/theme.css"] == 1
+    assert not (Path(result["path"]) / "assets" / "css" / "static_theme.css").exists()
+
+
+@pytest.mark.asyncio
+async def test_byte_budgets(site, downloader):
+    """Per-file caps skip large bodies and a spent crawl budget stops new requests"""
+    budgeted = await downloader.download(str(site.make_url("/")), concurrency=1, max_total_bytes=1)
+    assert budgeted["pages"] == 1
+    assert budgeted["skipped"]["over_budget"] > 0
+    assert "/page1.html" not in site.app[HITS]
+
+    capped = await downloader.download(str(site.make_url("/")), concurrency=2, max_file_size=10_000)
+    assert capped["pages"] == 9
+    assert capped["skipped"]["too_large"] == 1  # the 200 kB diagram
+
+
+@pytest.mark.asyncio
+async def test_stylesheet_references_are_downloaded_and_rewritten(downloader):
+    """Fonts, images and imports referenced from CSS, inline styles and media elements are mirrored"""
+    hits = {}
+    files = {
+        "/": ("text/html", '<html><head><link rel="stylesheet" href="/static/site.css">'
+                           '<link rel="alternate" type="application/rss+xml" href="/feed.xml">'
+                           '<style>h1 { background: url(/static/h1.png) }</style></head>'
+                           '<body><div style="background-image: url(\'/static/hero.png\')">hi</div>'
+                           '<video src="/media/intro.mp4" poster="/static/poster.png"></video></body></html>'),
+        "/static/site.css": ("text/css", '@import "print.css";\n'
+                                         '@font-face { src: url("../fonts/body.woff2?v=2") format("woff2") }'),
+        "/static/print.css": ("text/css", '@import url(site.css); body { background: url(data:image/png;base64,AA) }'),
+        "/fonts/body.woff2": ("font/woff2", "font"),
+        "/static/h1.png": ("image/png", "png"),
+        "/static/hero.png": ("image/png", "png"),
+        "/static/poster.png": ("image/png", "png"),
+        "/media/intro.mp4": ("video/mp4", "mp4"),
+        "/feed.xml": ("application/rss+xml", "<rss/>"),
+    }
+
+    async def handler(request):
+        hits[request.path] = hits.get(request.path, 0) + 1
+        if request.path not in files:
+            raise web.HTTPNotFound()
+        content_type, text = files[request.path]
+        etag = f'"{request.path}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.Response(text=text, content_type=content_type, headers={"ETag": etag})
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    server = await serve(app)
+    try:
+        result = await downloader.download(str(server.make_url("/")))
+        site_dir = Path(result["path"])
+        css = (site_dir / "assets" / "css" / "static_site.css").read_text()
+        assert '@import "static_print.css"' in css
+        assert 'url("../fonts/fonts_body.woff2")' in css
+        assert 'url("static_site.css")' in (site_dir / "assets" / "css" / "static_print.css").read_text()
+        for path in ["fonts/fonts_body.woff2", "images/static_h1.png", "images/static_hero.png",
+                     "images/static_poster.png", "media/media_intro.mp4"]:
+            assert (site_dir / "assets" / path).exists(), path
+        page = (site_dir / "index.html").read_text()
+        assert "assets/images/static_hero.png" in page and "assets/images/static_h1.png" in page
+        assert "/feed.xml" not in hits
+        assert all(n == 1 for path, n in hits.items() if path != "/")
+
+        # An unchanged stylesheet still revalidates what it references
+        await downloader.download(str(server.make_url("/")))
+        assert hits["/fonts/body.woff2"] == 2
+    finally:
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_crawl_metrics_are_recorded_and_exported(site, downloader):
+    """Request phases, stage timers and status codes land in rag_index.json and the Prometheus dump"""
+    result = await downloader.download(str(site.make_url("/")), concurrency=2, profile="cprofile")
+    site_dir = Path(result["path"])
+    assert Path(result["profile"]).exists()
+
+    metrics = json.loads((site_dir / "rag_index.json").read_text())["metrics"]
+    for name in ["ttfb", "connect", "page_body", "parse", "page_write", "asset_write"]:
+        timing = metrics["timings"][name]
+        assert timing["count"] > 0 and timing["p50"] <= timing["p95"] <= timing["p99"] <= timing["max"]
+    assert metrics["timings"]["parse"]["count"] == result["pages"]
+    assert metrics["status_codes"]["200"] >= result["pages"]
+    assert metrics["counters"]["page_bytes"] > 0 and metrics["counters"]["requests"] > 0
+
+    live = downloader.crawl_metrics(site_dir.name)
+    assert live["running"] is False and live["metrics"] == metrics
+    text = downloader.crawl_metrics(site_dir.name, "prometheus")["metrics"]
+    assert 'website_downloader_ttfb_seconds_bucket{site="' in text and 'le="+Inf"' in text
+    assert "website_downloader_responses_total" in text
+    assert downloader.crawl_metrics("nowhere")["status"] == "error"
+
+
+@pytest.mark.asyncio
+async def test_frontier_fetches_navigation_first_and_index_pages_last(downloader):
+    """Sidebar links are crawled before body links, genindex/search/changelog pages after both"""
+    order = []
+    sidebar = ('<div class="sphinxsidebar"><a href="/genindex.html">Index</a><a href="/search.html">Search</a>'
+               '<a href="/guide.html">Guide</a><a href="/api.html">API</a></div>')
+
+    async def handler(request):
+        if request.path in ("/robots.txt", "/sitemap.xml"):
+            raise web.HTTPNotFound()
+        order.append(request.path)
+        body = "".join(f'<a href="/notes{n}.html">notes {n}</a>' for n in range(4))
+        body += '<a href="/changelog.html">Changelog</a>'
+        return web.Response(text=f"<html><body>{sidebar}<main>{request.path} {body}</main></body></html>",
+                            content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    try:
+        budgeted = await downloader.download(str(server.make_url("/")), concurrency=1, max_pages=3)
+        assert budgeted["framework"] == "sphinx"
+        assert order == ["/", "/guide.html", "/api.html"]
+
+        order.clear()
+        await downloader.download(str(server.make_url("/")), concurrency=1)
+    finally:
+        await server.close()
+
+    assert order[:3] == ["/", "/guide.html", "/api.html"]
+    assert set(order[3:7]) == {f"/notes{n}.html" for n in range(4)}
+    assert set(order[7:]) == {"/genindex.html", "/search.html", "/changelog.html"}
+
+
+def test_staged_search_index_merges_pages_and_removals(tmp_path):
+    """A shard's index writes stay out of the library index until they are merged"""
+    library = SearchIndex(tmp_path)
+    library.add("site", "https://example.com/old.html", "old.html", "Old", "zebra", "h1")
+    staged = StagedSearchIndex(tmp_path, tmp_path / "search_index.shard0.sqlite")
+    staged.add("site", "https://example.com/new.html", "new.html", "New", "quokka", "h2")
+    staged.remove(["https://example.com/old.html"])
+    assert staged.has("https://example.com/old.html", "h1")  # answered by the library index
+    assert library.search("quokka") == []
+    staged.close()
+
+    library.merge(staged.path)
+    assert [hit["url"] for hit in library.search("quokka")] == ["https://example.com/new.html"]
+    assert library.search("zebra") == []
+    assert not list(tmp_path.glob("search_index.shard0.sqlite*"))
+    library.close()
+
+
+@pytest.mark.asyncio
+async def test_sharded_crawl_merges_into_one_site(site, downloader):
+    """Worker processes split the site between them and leave one merged index and manifest"""
+    result = await downloader.download(str(site.make_url("/")), concurrency=2, shards=2, export_chunks=True)
+
+    assert result["status"] == "success", result
+    assert result["pages"] == 9
+    assert len(result["shards"]) == 2
+    page_hits = {path: n for path, n in site.app[HITS].items() if path.endswith(".html")}
+    assert all(n == 1 for n in page_hits.values())
+    assert site.app[HITS]["/static/theme.css"] == 1
+
+    site_dir = Path(result["path"])
+    index = json.loads((site_dir / "rag_index.json").read_text())
+    assert index["pages"] == 9
+    assert index["shards"] == 2
+    assert index["metrics"]["counters"]["pages_saved"] == 9
+    manifest = json.loads((site_dir / "crawl_manifest.json").read_text())
+    assert len([entry for entry in manifest["entries"].values() if "links" in entry]) == 9
+    # Each shard staged its pages, and the coordinator merged them into the library index
+    assert all(downloader.search_index.has(url, entry["hash"])
+               for url, entry in manifest["entries"].items() if "links" in entry)
+    assert sum(1 for _ in (site_dir / "chunks.jsonl").open()) == index["chunks"]["count"]
+    assert not list(site_dir.glob("*.shard*"))
+
+
+@pytest.mark.asyncio
+async def test_sharded_crawl_drops_duplicates_across_shards(downloader):
+    """Mirrors hashed to different shards are still dropped, from the site, index, chunks and links"""
+    server = await serve(make_mirrored_site())
+    origin = str(server.make_url("")).rstrip("/")
+    try:
+        result = await downloader.download(origin + "/", concurrency=1, shards=2, export_chunks=True)
+    finally:
+        await server.close()
+
+    assert result["status"] == "success", result
+    assert result["pages"] == 9
+    assert result["duplicates"]["exact"] == 8
+    assert result["duplicates"]["near"] == 1
+    site_dir = Path(result["path"])
+    assert not list(site_dir.glob("latest_*.html"))
+    assert not (site_dir / "stable_print.html").exists()
+    home = (site_dir / "index.html").read_text()
+    assert "latest_" not in home and "stable_print" not in home
+    index = json.loads((site_dir / "rag_index.json").read_text())
+    assert index["pages"] == 9
+    assert index["duplicates"][origin + "/latest/p0.html"] == origin + "/stable/p0.html"
+    assert index["duplicates"][origin + "/stable/print.html"] == origin + "/stable/p0.html"
+    assert len(index["duplicates"]) == 9
+    manifest = json.loads((site_dir / "crawl_manifest.json").read_text())
+    assert not set(index["duplicates"]) & set(manifest["entries"])
+    chunk_urls = [json.loads(line)["url"] for line in (site_dir / "chunks.jsonl").open()]
+    assert len(chunk_urls) == index["chunks"]["count"]
+    assert not set(index["duplicates"]) & set(chunk_urls)
+    indexed = {hit["url"] for hit in downloader.search_index.search("term1", limit=50)}
+    assert origin + "/stable/p0.html" in indexed
+    assert not set(index["duplicates"]) & indexed
+
+
+@pytest.mark.asyncio
+async def test_sharded_crawl_rejects_prune_duplicates(downloader):
+    """Pruning needs every shard's duplicates as they are found, so sharded crawls refuse it"""
+    result = await downloader.download("https://docs.example.com/", shards=2, prune_duplicates=True)
+
+    assert result["status"] == "error"
+    assert "prune_duplicates" in result["error"]
+
+
+@pytest.mark.asyncio
+async def test_background_jobs_do_not_reuse_the_request_progress_token(tmp_path):
+    """Progress for a background job goes out as log messages, since its request has already completed"""
+    sent = []
+
+    class Session:
+        async def send_progress_notification(self, token, progress, total=None, message=None):
+            sent.append(("progress", token))
+
+        async def send_log_message(self, level, data, logger=None):
+            sent.append(("log", data["job_id"]))
+
+    server = WebsiteDownloaderServer(tmp_path, parse_workers=0)
+    job = DownloadJob("https://docs.example.com/", {})
+    job.status = "running"
+    token = request_ctx.set(RequestContext("1", SimpleNamespace(progressToken="tok"), Session(), None))
+    try:
+        await server._progress_listener()(job)
+        await server._progress_listener(background=True)(job)
+    finally:
+        request_ctx.reset(token)
+        await server.downloader.close()
+
+    assert sent == [("progress", "tok"), ("log", job.id)]
+
+
+@pytest.mark.asyncio
+async def test_server_stops_jobs_before_closing_the_downloader(tmp_path, monkeypatch):
+    """When stdin closes, running jobs are cancelled before the session and pools they use are closed"""
+    @asynccontextmanager
+    async def stdio_server():
+        yield None, None
+
+    async def end_of_input(*args, **kwargs):
+        return None  # the client closed stdin
+
+    async def crawl_forever(url, **kwargs):
+        await asyncio.Event().wait()
+
+    server = WebsiteDownloaderServer(tmp_path, parse_workers=0)
+    monkeypatch.setattr(mcp.server.stdio, "stdio_server", stdio_server)
+    monkeypatch.setattr(server.server, "run", end_of_input)
+    monkeypatch.setattr(server.downloader, "download", crawl_forever)
+    job = server.jobs.submit("https://docs.example.com/")
+    await asyncio.sleep(0)
+
+    close = server.downloader.close
+    statuses = []
+
+    async def close_downloader():
+        statuses.append(job.status)
+        await close()
+
+    monkeypatch.setattr(server.downloader, "close", close_downloader)
+    await server.run()
+
+    assert statuses == ["cancelled"]
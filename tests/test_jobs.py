@@ -0,0 +1,72 @@
+"""
+Test cases for background download jobs
+"""
+
+import asyncio
+import pytest
+from mcp_windows_website_downloader.jobs import JobManager
+
+
+class FakeDownloader:
+    """Stands in for WebsiteDownloader: reports progress, then finishes when released"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.running = 0
+        self.peak = 0
+
+    async def download(self, url, on_progress=None, **options):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            if on_progress:
+                on_progress({"pages_done": 3, "queued": 7})
+            await self.release.wait()
+            return {"status": "success", "pages": 10, "options": options}
+        finally:
+            self.running -= 1
+
+
+@pytest.mark.asyncio
+async def test_background_job_lifecycle():
+    """A job reports progress while running and its result once finished"""
+    downloader = FakeDownloader()
+    manager = JobManager(downloader, max_jobs=1)
+    updates = []
+
+    async def listener(job):
+        updates.append(job.status)
+
+    job = manager.submit("https://docs.example.com/", {"max_pages": 10}, listener)
+    await asyncio.sleep(0.05)
+    status = manager.get(job.id).snapshot()
+    assert status["status"] == "running"
+    assert status["pages_done"] == 3 and status["queued"] == 7
+
+    downloader.release.set()
+    await manager.wait(job)
+    assert job.status == "completed"
+    assert job.snapshot()["result"]["options"] == {"max_pages": 10}
+    assert updates[0] == "running" and updates[-1] == "completed"
+
+
+@pytest.mark.asyncio
+async def test_job_cap_and_cancel():
+    """Jobs beyond max_jobs wait their turn and can be cancelled in either state"""
+    downloader = FakeDownloader()
+    manager = JobManager(downloader, max_jobs=2)
+    jobs = [manager.submit(f"https://site{i}.example.com/") for i in range(3)]
+    await asyncio.sleep(0.05)
+
+    assert [job.status for job in jobs] == ["running", "running", "queued"]
+    assert manager.cancel(jobs[2].id)
+    assert manager.cancel(jobs[0].id)
+    await asyncio.sleep(0.05)
+    assert jobs[0].status == "cancelled" and jobs[2].status == "cancelled"
+    assert not manager.cancel(jobs[0].id)
+
+    downloader.release.set()
+    await manager.wait(jobs[1])
+    assert jobs[1].status == "completed"
+    assert downloader.peak == 2
+    assert len(manager.list()) == 3
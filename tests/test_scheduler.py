@@ -0,0 +1,93 @@
+"""
+Test cases for the polite request scheduler
+"""
+
+import time
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from mcp_windows_website_downloader.scheduler import (
+    RequestScheduler, AdaptiveLimiter, TokenBucket, parse_retry_after
+)
+
+
+@pytest.mark.asyncio
+async def test_retries_transient_statuses():
+    """429 with Retry-After and a 503 are retried until the page comes back"""
+    statuses = [429, 503, 200]
+
+    async def handler(request):
+        status = statuses.pop(0)
+        headers = {"Retry-After": "0"} if status == 429 else {}
+        return web.Response(status=status, text="ok", headers=headers)
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    try:
+        async with aiohttp.ClientSession() as session:
+            scheduler = RequestScheduler(session, backoff_base=0.01)
+            async with scheduler.get(str(server.make_url("/"))) as response:
+                assert response.status == 200
+                assert await response.text() == "ok"
+    finally:
+        await server.close()
+
+    assert scheduler.stats == {"requests": 3, "retries": 2, "throttled": 1, "failed": 0}
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries():
+    """The last failing response is handed back once retries are spent"""
+    async def handler(request):
+        return web.Response(status=503)
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    try:
+        async with aiohttp.ClientSession() as session:
+            scheduler = RequestScheduler(session, max_retries=2, backoff_base=0.01)
+            async with scheduler.get(str(server.make_url("/"))) as response:
+                assert response.status == 503
+    finally:
+        await server.close()
+
+    assert scheduler.stats["requests"] == 3
+    assert scheduler.stats["failed"] == 1
+
+
+def test_adaptive_limiter_aimd():
+    """The limit creeps up on stable latency and halves on congestion"""
+    limiter = AdaptiveLimiter(initial=4, maximum=8)
+    for _ in range(20):
+        limiter.on_success(0.1)
+    assert 6 < limiter.limit <= 8
+
+    widened = limiter.limit
+    limiter.on_congestion()
+    assert limiter.limit == pytest.approx(widened / 2)
+
+    limiter.on_success(10.0)  # latency spike counts as congestion, but not twice in one window
+    assert limiter.limit == pytest.approx(widened / 2)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_rate():
+    """A drained bucket makes the next caller wait for a refill"""
+    bucket = TokenBucket(rate=50, burst=1)
+    await bucket.acquire()
+    started = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - started >= 0.015
+
+
+def test_parse_retry_after():
+    """Both delta-seconds and HTTP-date forms are understood"""
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0